@@ -61,19 +61,16 @@ if build is True:
     include_files.append('./LICENSE.txt')
 
     excludes = [
-        'concurrent',
         'curses',
         'email',
         'html',
         'http',
         'IPython',
-        'json'
         'jupyter',
         'lib2to3',
         'lxml',
         'matplotlib',
         'mpl_toolkits',
-        'multiprocessing',
         'nose',
         'numpy',
         'PIL',
@@ -0,0 +1,502 @@
+"""Autobackup files written on a worker thread.
+
+The drawing area takes a fileformat.Snapshot of the scene on the GUI thread,
+which only copies the state of the items into plain data. Encoding the
+snapshot and writing it happen on a worker thread. The backup is written to
+a temporary file first and then moved over the old one, so a crash while
+writing never leaves a half written backup behind.
+
+Such a snapshot is only a checkpoint. Every change made through the undo
+stack after it is appended to the same file as a journal record, right after
+the last section of the checkpoint. Readers of the file format ignore
+anything after the last section, so the file can still be loaded as is.
+
+Journal records (all integers little endian):
+
+    crc32           uint32, of everything in the record after it
+    body length     uint32
+    symbols length  uint32
+    blob length     uint32
+    body            UTF-8 JSON object {"op": "put", "remove", "place" or
+                    "pen", "id": id}. Put records also hold "root" and
+                    "items" like the BODY section and replace the top level
+                    item with that id. Place records hold the "origin",
+                    "transform" and "reflections" of a moved, rotated or
+                    mirrored item, and pen records the "pen" options of an
+                    item whose pen changed, so that such edits do not store
+                    the whole item again.
+    symbols         UTF-8 JSON list of symbol definitions, as in SYMS
+    blob            Binary data, as in BLOB
+
+The top level items of the checkpoint have the ids 0, 1, ... in the order
+they are stored in. Items added later get the next free id. Reading stops at
+the first record that is truncated or fails its checksum, which is where a
+crash interrupted the journal.
+"""
+from PyQt5 import QtCore, QtWidgets
+from .commands import (
+    ChangePen, ChangePenCapStyle, ChangePenColour, ChangePenJoinStyle, ChangePenStyle,
+    ChangePenWidth, Mirror, Move, Rotate)
+from .components import TextBox
+from .fileformat import (
+    BlobWriter, Decoder, Encoder, RecordScope, SymbolTable, decodeItems, isSchematicFile,
+    loadSchematicFile, sectionsEnd)
+import json
+import logging
+import os
+import struct
+import zlib
+
+logger = logging.getLogger('YCircuit.autobackup')
+
+recordFormat = '<IIII'
+# Commands that only change the position and transform of their items
+placeCommands = (Move, Rotate, Mirror)
+# Commands that only change the pen of their item
+penCommands = (
+    ChangePenWidth, ChangePenColour, ChangePenStyle, ChangePenCapStyle, ChangePenJoinStyle)
+# The journal is compacted into a new checkpoint once it is larger than the
+# checkpoint, but never before it reaches this size
+minimumCompactionSize = 64*1024
+
+
+def writeFileAtomically(fileName, data):
+    """Writes data to fileName through a temporary file in the same folder.
+    The temporary name starts with a dot so that it is never mistaken for
+    an autobackup file."""
+    folder, name = os.path.split(fileName)
+    temporaryFile = os.path.join(folder, '.' + name + '.tmp')
+    with open(temporaryFile, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    try:
+        os.replace(temporaryFile, fileName)
+    except OSError:
+        # The backup may be held open elsewhere, eg. on Windows
+        os.remove(temporaryFile)
+        with open(fileName, 'wb') as file:
+            file.write(data)
+
+
+class AutobackupSignals(QtCore.QObject):
+    # Generation of the task, the revision that was written or -1 if
+    # writing failed, and the name of the autobackup file
+    finished = QtCore.pyqtSignal(int, int, str)
+    # Name of a file that could not be written
+    failed = QtCore.pyqtSignal(str)
+    # Name of a saved file and whether it was written
+    saved = QtCore.pyqtSignal(str, bool)
+
+
+class AutobackupTask(QtCore.QRunnable):
+    """Encodes a snapshot and writes it to every file in fileNames, the last
+    of which is the autobackup file. If recording is given, the preview of
+    the snapshot is rendered from the area iconRect of it first, and the
+    first file is a save whose result is reported with saved."""
+
+    def __init__(self, snapshot, fileNames, revision, generation, signals,
+                 recording=None, iconRect=None, iconProvider=None):
+        super().__init__()
+        self.snapshot = snapshot
+        self.fileNames = fileNames
+        self.revision = revision
+        self.generation = generation
+        self.signals = signals
+        self.recording = recording
+        self.iconRect = iconRect
+        self.iconProvider = iconProvider
+
+    def renderIcon(self):
+        img = self.iconProvider.renderIconImage(self.recording, self.iconRect)
+        icon = QtCore.QByteArray()
+        buf = QtCore.QBuffer(icon)
+        buf.open(QtCore.QIODevice.WriteOnly)
+        img.save(buf, 'PNG', quality=10)
+        buf.close()
+        return bytes(icon)
+
+    def run(self):
+        revision = -1
+        try:
+            if self.recording is not None:
+                self.snapshot.icon = self.renderIcon()
+            data = self.snapshot.encode()
+        except:
+            logger.warning('Could not encode %s', self.fileNames[0])
+            for fileName in self.fileNames:
+                self.signals.failed.emit(fileName)
+            self.signals.finished.emit(self.generation, revision, self.fileNames[-1])
+            if self.recording is not None:
+                self.signals.saved.emit(self.fileNames[0], False)
+            return
+        written = []
+        for fileName in self.fileNames:
+            try:
+                writeFileAtomically(fileName, data)
+            except:
+                logger.warning('Could not write file %s', fileName)
+                self.signals.failed.emit(fileName)
+                revision = -1
+                continue
+            logger.info('Wrote file %s', fileName)
+            written.append(fileName)
+            revision = self.revision
+        self.signals.finished.emit(self.generation, revision, self.fileNames[-1])
+        if self.recording is not None:
+            self.signals.saved.emit(self.fileNames[0], self.fileNames[0] in written)
+
+
+class AutobackupWriter(QtCore.QObject):
+    """Writes one file at a time on its own thread. written is emitted with
+    the revision of the document that was backed up and the name of the
+    autobackup file it was written to, and failed with the
+    name of every file that could not be written. saved is emitted once
+    for every save, after the other signals of its task. Every task is tagged with
+    a generation, and written is only emitted for the latest one, so that a
+    task finishing late never reports an older backup as current."""
+
+    written = QtCore.pyqtSignal(int, str)
+    failed = QtCore.pyqtSignal(str)
+    saved = QtCore.pyqtSignal(str, bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.threadPool = QtCore.QThreadPool(self)
+        self.threadPool.setMaxThreadCount(1)
+        self.signals = AutobackupSignals(self)
+        self.signals.finished.connect(self.taskFinished)
+        self.signals.failed.connect(self.failed)
+        self.signals.saved.connect(self.saved)
+        # Tasks that were started but have not finished
+        self.queued = 0
+        # Generation of the last task that was started
+        self.generation = 0
+
+    @property
+    def busy(self):
+        return self.queued > 0
+
+    def write(self, snapshot, fileName, revision):
+        """Queues snapshot to be written to fileName. Returns False without
+        doing anything if the previous backup is still being written."""
+        if self.busy is True:
+            return False
+        self.queued += 1
+        self.generation += 1
+        self.threadPool.start(AutobackupTask(
+            snapshot, [fileName], revision, self.generation, self.signals))
+        return True
+
+    def save(self, snapshot, fileName, autobackupFileName, revision,
+             recording, iconRect, iconProvider):
+        """Queues snapshot to be saved to fileName and to a new autobackup
+        file, after rendering its preview from recording. The snapshot is
+        encoded once for both files. Saves are never skipped, but are
+        written after the backup that is being written."""
+        self.queued += 1
+        self.generation += 1
+        self.threadPool.start(AutobackupTask(
+            snapshot, [fileName, autobackupFileName], revision, self.generation,
+            self.signals, recording, iconRect, iconProvider))
+
+    def taskFinished(self, generation, revision, fileName):
+        self.queued -= 1
+        if generation != self.generation:
+            logger.info('Ignoring the result of an older backup')
+            return
+        if revision >= 0:
+            self.written.emit(revision, fileName)
+
+    def waitForDone(self):
+        """Blocks until the files being written are on disk. Must be called
+        before the autobackup file is removed or written elsewhere."""
+        self.threadPool.waitForDone()
+        # The results are queued for slot proxies owned by PyQt rather than
+        # for self.signals, so every queued call of this thread is delivered
+        QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.MetaCall)
+
+
+def encodeRecord(body, definitions=None, blob=b''):
+    body = json.dumps(body, separators=(',', ':')).encode('utf-8')
+    definitions = json.dumps(definitions or [], separators=(',', ':')).encode('utf-8')
+    data = struct.pack('<III', len(body), len(definitions), len(blob)) + body + definitions + blob
+    return struct.pack('<I', zlib.crc32(data)) + data
+
+
+def encodePut(itemId, item, origin):
+    """Returns a record holding item and its children. Its origin is stored
+    relative to origin, the origin of the checkpoint."""
+    blobs = BlobWriter()
+    symbols = SymbolTable(blobs)
+    encoder = Encoder(blobs, symbols, overrides={item: {'origin': item.pos() - origin}})
+    rootIndex = encoder.encodeItem(item)
+    body = {'op': 'put', 'id': itemId, 'root': rootIndex, 'items': encoder.encodeRecords()}
+    return encodeRecord(body, symbols.definitions, blobs.data())
+
+
+def encodeRemove(itemId):
+    return encodeRecord({'op': 'remove', 'id': itemId})
+
+
+def encodePlace(itemId, item, origin):
+    """Returns a record holding the position and transform of item"""
+    encoder = Encoder(BlobWriter())
+    return encodeRecord({
+        'op': 'place',
+        'id': itemId,
+        'origin': encoder.encodeValue(item.pos() - origin),
+        'transform': encoder.encodeValue(item.transform()),
+        'reflections': getattr(item, 'reflections', None)})
+
+
+def encodePen(itemId, item):
+    """Returns a record holding the pen options of item"""
+    encoder = Encoder(BlobWriter())
+    pen = {
+        'width': item.localPenWidth,
+        'penColour': item.localPenColour,
+        'penStyle': item.localPenStyle,
+        'penCapStyle': item.localPenCapStyle,
+        'penJoinStyle': item.localPenJoinStyle}
+    return encodeRecord({
+        'op': 'pen',
+        'id': itemId,
+        'pen': {key: encoder.encodeValue(value) for key, value in pen.items()}})
+
+
+def readJournal(data, offset):
+    """Yields the (body, symbols, blob) of every intact record in data from
+    offset on"""
+    headerSize = struct.calcsize(recordFormat)
+    while offset + headerSize <= len(data):
+        crc, bodyLength, symbolsLength, blobLength = struct.unpack_from(
+            recordFormat, data, offset)
+        end = offset + headerSize + bodyLength + symbolsLength + blobLength
+        if end > len(data) or zlib.crc32(data[offset + 4:end]) != crc:
+            logger.warning('Ignoring damaged journal record at %d', offset)
+            return
+        start = offset + headerSize
+        yield (
+            data[start:start + bodyLength],
+            data[start + bodyLength:start + bodyLength + symbolsLength],
+            data[end - blobLength:end])
+        offset = end
+
+
+def loadAutobackupFile(fileName, start=None):
+    """Loads the checkpoint in an autobackup file and replays its journal.
+    Returns the top level group, like loadSchematicFile."""
+    if start is None:
+        start = QtCore.QPointF(0, 0)
+    with open(fileName, 'rb') as file:
+        data = file.read()
+    if not isSchematicFile(data):
+        # Backups from before the journal
+        return loadSchematicFile(fileName, start)
+    end = sectionsEnd(data)
+    root = decodeItems(data[:end], start)
+    items = dict(enumerate(root.listOfItems))
+    replayed = 0
+    for body, definitions, blob in readJournal(data, end):
+        decoder = Decoder(blob)
+        decoder.parseSymbols(definitions)
+        record = json.loads(body.decode('utf-8'), object_hook=decoder.decodeObject)
+        if record['op'] in ['place', 'pen']:
+            item = items.get(record['id'])
+            if item is None:
+                logger.warning('Ignoring journal record of unknown item %s', record['id'])
+                continue
+            if record['op'] == 'place':
+                # Applied by setItems below, as for items read from a file
+                item.origin = record['origin']
+                item.transformData = record['transform']
+                if record['reflections'] is not None:
+                    item.reflections = record['reflections']
+            else:
+                item.setLocalPenOptions(**record['pen'])
+            replayed += 1
+            continue
+        oldItem = items.pop(record['id'], None)
+        if oldItem is not None:
+            oldItem.setParentItem(None)
+        if record['op'] == 'put':
+            decoder.scope = RecordScope(record['items'])
+            items[record['id']] = decoder.buildItem(record['root'], root)
+            decoder.resolveReferences()
+        replayed += 1
+    logger.info('Replayed %d journal records from %s', replayed, fileName)
+    if replayed > 0:
+        root.setItems(list(items.values()))
+        root.pins = [
+            item for item in root.listOfItems
+            if hasattr(item, 'isPin') and item.isPin is True]
+    return root
+
+
+def commandItems(command, items=None):
+    """Returns the items that an undo command and its children refer to"""
+    if items is None:
+        items = []
+    for value in getattr(command, '__dict__', {}).values():
+        if isinstance(value, dict):
+            values = list(value.keys()) + list(value.values())
+        elif isinstance(value, (list, tuple)):
+            values = value
+        else:
+            values = [value]
+        for item in values:
+            if isinstance(item, QtWidgets.QGraphicsItem) and item not in items:
+                items.append(item)
+    for i in range(command.childCount()):
+        commandItems(command.child(i), items)
+    return items
+
+
+def commandChanges(command, placed, restyled, items):
+    """Sorts the items that an undo command and its children refer to into
+    the lists of items that were only moved, rotated or mirrored, items whose
+    pen was the only thing that changed and all other items"""
+    if isinstance(command, placeCommands):
+        for item in command.listOfItems:
+            if item not in placed:
+                placed.append(item)
+    elif isinstance(command, penCommands) and not isinstance(command.item, TextBox):
+        # Text boxes also swap their rendered LaTeX when the colour changes
+        if command.item not in restyled:
+            restyled.append(command.item)
+    elif not isinstance(command, ChangePen):
+        # ChangePen only holds the children that do the work
+        for item in commandItems(command):
+            if item not in items:
+                items.append(item)
+        return
+    for i in range(command.childCount()):
+        commandChanges(command.child(i), placed, restyled, items)
+
+
+class AutobackupJournal(object):
+    """Appends the changes made since the last checkpoint to the autobackup
+    file. Records made while a checkpoint is being written are kept until it
+    is on disk, because they refer to the ids of that checkpoint."""
+
+    def __init__(self):
+        self.fileName = None
+        self.ids = {}
+        self.nextId = 0
+        self.origin = QtCore.QPointF(0, 0)
+        self.pending = []
+        # True once the checkpoint is on disk
+        self.ready = False
+        # Set by changes that the journal could not record
+        self.dirty = False
+        self.size = 0
+        self.checkpointSize = 0
+
+    def reset(self, fileName, items, origin):
+        """Starts a journal for a checkpoint of items, saved with their
+        origins relative to origin, that is about to be written to fileName"""
+        self.fileName = fileName
+        self.ids = {item: itemId for itemId, item in enumerate(items)}
+        self.nextId = len(items)
+        self.origin = QtCore.QPointF(origin)
+        self.pending = []
+        self.ready = False
+        self.dirty = False
+        self.size = 0
+
+    def checkpointWritten(self, fileName):
+        """Appends the records kept while the checkpoint was written. Does
+        nothing if fileName is not the file of this journal, eg. because the
+        journal was closed or reset since the write was queued."""
+        if fileName != self.fileName:
+            return
+        self.checkpointSize = os.path.getsize(self.fileName)
+        self.ready = True
+        pending, self.pending = self.pending, []
+        self.append(pending)
+
+    def close(self):
+        """Stops recording, eg. because the autobackup file was removed"""
+        self.fileName = None
+        self.ids = {}
+        self.pending = []
+        self.ready = False
+
+    def compactionDue(self):
+        """Returns True if a new checkpoint should be written"""
+        if self.ready is False or self.dirty is True:
+            return True
+        return self.size > max(minimumCompactionSize, self.checkpointSize)
+
+    def recordCommands(self, commands):
+        """Records the changes that undo commands made. Moving, rotating and
+        mirroring top level items and changing their pen only records what
+        changed, anything else the current state of the items."""
+        if self.fileName is None:
+            return
+        placed, restyled, items = [], [], []
+        for command in commands:
+            commandChanges(command, placed, restyled, items)
+        self.recordItems(items, placed, restyled)
+
+    def recordItems(self, items, placed=(), restyled=()):
+        """Records the current state of items that undo commands changed.
+        Of the top level items in placed and restyled, only the position and
+        transform or the pen is recorded, unless they need a full record."""
+        if self.fileName is None:
+            return
+        deltas = []
+        for item in list(placed) + list(restyled):
+            if item in self.ids and item.scene() is not None and item.parentItem() is None:
+                deltas.append(item)
+            elif item not in items:
+                items = list(items) + [item]
+        records = []
+        topLevelItems = []
+        for item in items:
+            # Removed items and items that were grouped
+            if item in self.ids and (item.scene() is None or item.parentItem() is not None):
+                records.append(encodeRemove(self.ids.pop(item)))
+            if item.scene() is not None:
+                topLevelItem = item.topLevelItem()
+                if topLevelItem not in topLevelItems:
+                    topLevelItems.append(topLevelItem)
+        for item in topLevelItems:
+            if item not in self.ids:
+                self.ids[item] = self.nextId
+                self.nextId += 1
+            try:
+                records.append(encodePut(self.ids[item], item, self.origin))
+            except:
+                logger.warning('Could not record %s in the journal', item)
+                self.dirty = True
+        for item in deltas:
+            # Items recorded in full above already include the change
+            if item in topLevelItems:
+                continue
+            try:
+                if item in placed:
+                    records.append(encodePlace(self.ids[item], item, self.origin))
+                if item in restyled:
+                    records.append(encodePen(self.ids[item], item))
+            except:
+                logger.warning('Could not record %s in the journal', item)
+                self.dirty = True
+        self.append(records)
+
+    def append(self, records):
+        if len(records) == 0:
+            return
+        if self.ready is False:
+            self.pending.extend(records)
+            return
+        data = b''.join(records)
+        try:
+            with open(self.fileName, 'ab') as file:
+                file.write(data)
+        except OSError:
+            logger.warning('Could not append to journal %s', self.fileName)
+            self.dirty = True
+            return
+        self.size += len(data)
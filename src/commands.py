@@ -1,6 +1,6 @@
 from PyQt5 import QtCore, QtWidgets, QtGui
 from .components import myGraphicsItemGroup, TextBox
-import copy
+from .fileformat import cloneItem
 import logging
 
 logger = logging.getLogger('YCircuit.commands')
@@ -84,7 +84,11 @@ class Add(QtWidgets.QUndoCommand):
         else:
             self.symbol = False
         if self.symbol is True:
-            self.item = copy.deepcopy(item)
+            # Symbols are templates unless they were created for this command
+            if 'clone' in kwargs and kwargs['clone'] is False:
+                self.item = item
+            else:
+                self.item = cloneItem(item, self.origin)
         else:
             self.item = item
 
@@ -100,7 +104,10 @@ class Add(QtWidgets.QUndoCommand):
             logger.info('Adding item %s as a regular item', self.item)
         else:
             """Or if item is a symbol to be loaded"""
-            self.item.__init__(self.parentItem, self.origin, self.item.listOfItems, mode='symbol')
+            # The symbol is already built, so it only needs to be placed
+            self.item.setParentItem(self.parentItem)
+            self.item.start = self.origin
+            self.item.setPos(self.origin)
             if self.parentItem is None:
                 self.scene.addItem(self.item)
             # self.item.loadItems('symbol')
@@ -111,7 +118,7 @@ class Add(QtWidgets.QUndoCommand):
             #     self.item.rotateBy(moving=False, origin=self.origin, angle=self.rotateAngle)
             if hasattr(self, 'transform_'):
                 self.item.setTransform(self.transform_)
-            if hasattr(self, 'pinVisibility'):
+            if hasattr(self, 'pinVisibility') and isinstance(self.item, myGraphicsItemGroup):
                 self.item.pinVisibility(self.pinVisibility.isChecked())
             logger.info('Adding item %s as a symbol', self.item)
         self.scene.update(self.scene.sceneRect())
@@ -441,6 +448,7 @@ class Ungroup(QtWidgets.QUndoCommand):
         super().__init__(parent)
         self.scene = scene
         self.item = item
+        self.item.materialize()
         self.listOfItems = item.listOfItems
 
         x = min([item.scenePos().x() for item in self.listOfItems])
@@ -522,6 +530,7 @@ class ChangePen(QtWidgets.QUndoCommand):
                 self.listOfItems = item
                 for i in self.listOfItems:
                     if isinstance(i, myGraphicsItemGroup):
+                        i.materialize()
                         changePen = ChangePen(self, i.listOfItems, **kwargs)
                     else:
                         changePen = ChangePenWidth(self, i, **kwargs)
@@ -531,6 +540,7 @@ class ChangePen(QtWidgets.QUndoCommand):
                 self.listOfItems = item
                 for i in self.listOfItems:
                     if isinstance(i, myGraphicsItemGroup):
+                        i.materialize()
                         changePen = ChangePen(self, i.listOfItems, **kwargs)
                     else:
                         changePen = ChangePenColour(self, i, **kwargs)
@@ -540,6 +550,7 @@ class ChangePen(QtWidgets.QUndoCommand):
                 self.listOfItems = item
                 for i in self.listOfItems:
                     if isinstance(i, myGraphicsItemGroup):
+                        i.materialize()
                         changePen = ChangePen(self, i.listOfItems, **kwargs)
                     else:
                         changePen = ChangePenStyle(self, i, **kwargs)
@@ -549,6 +560,7 @@ class ChangePen(QtWidgets.QUndoCommand):
                 self.listOfItems = item
                 for i in self.listOfItems:
                     if isinstance(i, myGraphicsItemGroup):
+                        i.materialize()
                         changePen = ChangePen(self, i.listOfItems, **kwargs)
                     else:
                         changePen = ChangePenJoinStyle(self, i, **kwargs)
@@ -558,6 +570,7 @@ class ChangePen(QtWidgets.QUndoCommand):
                 self.listOfItems = item
                 for i in self.listOfItems:
                     if isinstance(i, myGraphicsItemGroup):
+                        i.materialize()
                         changePen = ChangePen(self, i.listOfItems, **kwargs)
                     else:
                         changePen = ChangePenCapStyle(self, i, **kwargs)
@@ -708,6 +721,7 @@ class ChangeBrush(QtWidgets.QUndoCommand):
                 self.listOfItems = item
                 for i in self.listOfItems:
                     if isinstance(i, myGraphicsItemGroup):
+                        i.materialize()
                         changeBrush = ChangeBrush(self, i.listOfItems, **kwargs)
                     else:
                         changeBrush = ChangeBrushColour(self, i, **kwargs)
@@ -717,6 +731,7 @@ class ChangeBrush(QtWidgets.QUndoCommand):
                 self.listOfItems = item
                 for i in self.listOfItems:
                     if isinstance(i, myGraphicsItemGroup):
+                        i.materialize()
                         changeBrush = ChangeBrush(self, i.listOfItems, **kwargs)
                     else:
                         changeBrush = ChangeBrushStyle(self, i, **kwargs)
@@ -1,7 +1,6 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 import math
-import pickle
-from src.drawingitems import TextEditor
+from src.drawingitems import TextEditor, richTextToLatex
 import logging
 
 logger = logging.getLogger('YCircuit.components')
@@ -15,8 +14,12 @@ def xyFromPoint(point):
     xy += ')'
     return xy
 
-def sceneXYFromPoint(point, item):
-    return xyFromPoint(item.mapToScene(point))
+def sceneXYFromPoint(point, item, frame=None):
+    """Maps point from item to the scene, or to the coordinates of frame if
+    it is given"""
+    if frame is None:
+        return xyFromPoint(item.mapToScene(point))
+    return xyFromPoint(item.mapToItem(frame, point))
 
 
 class drawingElement(object):
@@ -323,9 +326,25 @@ class drawingElement(object):
         else:
             return 'miter'
 
-    def exportToLatex(self, rotate=True):
-        """ Handled by classes individually, just sets up the boilerplate code
-        that will remain common to all the classes"""
+    def exportToLatex(self):
+        """Returns the TikZ code of the item as a single string"""
+        return ''.join(self.latexFragments())
+
+    def latexFragments(self, frame=None):
+        """Handled by classes individually. Yields the TikZ code of the item
+        in pieces so that it can be streamed to a file. Coordinates are in
+        the scene, or relative to frame if it is given."""
+        yield self.latexOptions(frame=frame)
+
+    def latexOptions(self, rotate=True, frame=None):
+        """Sets up the boilerplate code that will remain common to all the
+        classes"""
+        if frame is None:
+            transform_ = self.sceneTransform()
+            pos = self.scenePos()
+        else:
+            transform_ = self.itemTransform(frame)[0]
+            pos = self.mapToItem(frame, QtCore.QPointF(0, 0))
         if isinstance(self, TextBox):
             latex = '\\node['
         else:
@@ -337,15 +356,15 @@ class drawingElement(object):
             else:
                 latex += 'rotate around={'
             if hasattr(self, 'reflections') and self.reflections == 1:
-                latex += str(math.atan2(self.sceneTransform().m21(),-self.sceneTransform().m11())*180/math.pi)
+                latex += str(math.atan2(transform_.m21(),-transform_.m11())*180/math.pi)
             else:
-                latex += str(math.atan2(self.sceneTransform().m21(),self.sceneTransform().m11())*180/math.pi)
+                latex += str(math.atan2(transform_.m21(),transform_.m11())*180/math.pi)
             if isinstance(self, TextBox):
                 latex += ','
             else:
-                latex += ':' + xyFromPoint(self.scenePos()) + '},'
+                latex += ':' + xyFromPoint(pos) + '},'
             if hasattr(self, 'reflections') and self.reflections == 1:
-                latex += 'xscale=-1.0,xshift=-' + str(2*self.scenePos().x()/100) + 'cm,'
+                latex += 'xscale=-1.0,xshift=-' + str(2*pos.x()/100) + 'cm,'
         # Pen settings
         if hasattr(self, 'localPenWidth'):
             if not isinstance(self, TextBox):
@@ -368,8 +387,16 @@ class drawingElement(object):
 class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
     """Subclassed from QGraphicsItem. Provides additional methods so that
     the parent item remembers all the items that are its children.
+
+    Symbol instances can be drawn from a shared SymbolDefinition instead.
+    They then only have their pins as children, and get their own copies
+    of the other items from materialize when those are about to change.
     """
 
+    # Set on instances that are drawn from a shared definition
+    definition = None
+    lightened = False
+
     def __init__(self, parent=None, start=None, listOfItems=None, **kwargs):
         super().__init__(parent=parent, start=start)
         self.listOfItems = listOfItems
@@ -399,6 +426,13 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
         self.localBrushStyle = 0
         self.setAcceptHoverEvents(True)
 
+    def __getstate__(self):
+        """The shared definition is not part of the state of the group"""
+        localDictCopy = super().__getstate__()
+        localDictCopy.pop('definition', None)
+        localDictCopy.pop('lightened', None)
+        return localDictCopy
+
     def __setstate__(self, state):
         """Reimplemented from drawingElement because group does not have
         pen and brush of its own.
@@ -407,6 +441,17 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
 
     def paint(self, painter, *args):
         """Call child paint methods individually"""
+        if self.definition is not None:
+            picture = self.definition.picture(self.lightened)
+            # QPicture playback scales by the resolution of the target
+            # device, eg. a 1200 dpi printer, so undo that to stay in item
+            # coordinates
+            device = painter.device()
+            painter.save()
+            painter.scale(picture.logicalDpiX() / device.logicalDpiX(),
+                          picture.logicalDpiY() / device.logicalDpiY())
+            painter.drawPicture(0, 0, picture)
+            painter.restore()
         if not isinstance(self.parentItem(), myGraphicsItemGroup):
             if self.isSelected() is True:
                 pen = QtGui.QPen()
@@ -424,13 +469,54 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
                 painter.drawLine(yLine)
 
     def boundingRect(self):
+        if self.definition is not None:
+            return self.childrenBoundingRect().united(self.definition.rect())
         return self.childrenBoundingRect()
 
+    def contentItems(self):
+        """Returns the items the group is made of. For groups drawn from a
+        shared definition, these are the items of the definition."""
+        if self.definition is not None:
+            return self.definition.template.listOfItems
+        return self.listOfItems
+
+    def materialize(self, recursive=False):
+        """Gives a group drawn from a shared definition its own copies of
+        the items of the definition, keeping its pins. If recursive is True,
+        groups below this one are materialized as well."""
+        if self.definition is not None:
+            from src.fileformat import cloneItem
+            definition = self.definition
+            self.prepareGeometryChange()
+            del self.definition
+            logger.info('Materializing %s', self)
+            pins = list(self.pins)
+            items = []
+            for item in definition.template.listOfItems:
+                if hasattr(item, 'isPin') and item.isPin is True and len(pins) > 0:
+                    items.append(pins.pop(0))
+                else:
+                    items.append(cloneItem(item))
+            self.setItems(items)
+            # Keep the stacking order of the definition
+            for i in range(len(items) - 2, -1, -1):
+                items[i].stackBefore(items[i + 1])
+            self.listOfItems = items
+            if self.lightened is True:
+                self.lightenColour(True)
+        if recursive is True:
+            for item in self.listOfItems:
+                if isinstance(item, myGraphicsItemGroup):
+                    item.materialize(True)
+
     def createCopy(self, parent=None):
         """Call child copy methods individually after creating new parent"""
         self.setSelected(False)
         _start = self.pos()
         newItem = self.__class__(parent, _start, [])
+        if self.definition is not None:
+            # Only the pins are copied below
+            newItem.definition = self.definition
         newItem.origin = self.origin
         newItem.setTransform(self.transform())
         newItem.setScale(self.scale())
@@ -441,6 +527,8 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
         if hasattr(self, 'height'):
             newItem.height = self.height
             newItem.setZValue(newItem.height)
+        if hasattr(self, 'symbolFile'):
+            newItem.symbolFile = self.symbolFile
         if hasattr(self, 'isPin'):
             newItem.isPin = self.isPin
             newItem.setVisible(self.isVisible())
@@ -475,6 +563,7 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
 
     def reparentItems(self, newParent=None):
         """Sets parent of all child items to newParent"""
+        self.materialize()
         # Call prepareGeometryChange because the bounding rect for this
         # item is going to change
         self.prepareGeometryChange()
@@ -514,7 +603,7 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
         penStyleList = []
         penCapStyleList = []
         penJoinStyleList = []
-        for item in self.listOfItems:
+        for item in self.contentItems():
             if item.localPen.width() not in widthList:
                 widthList.append(item.localPen.width())
             if item.localPen.color() not in penColourList:
@@ -553,6 +642,8 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
 
     def setLocalPenOptions(self, **kwargs):
         """Set pen individually for each child item"""
+        if len(kwargs) > 0:
+            self.materialize()
         self.prepareGeometryChange()
         if hasattr(self, 'listOfItems'):
             for item in self.listOfItems:
@@ -563,7 +654,7 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
     def getLocalBrushParameters(self, parameter='colour'):
         brushColourList = []
         brushStyleList = []
-        for item in self.listOfItems:
+        for item in self.contentItems():
             if item.localBrush.color() not in brushColourList:
                 brushColourList.append(item.localBrush.color())
             if item.localBrush.style() not in brushStyleList:
@@ -581,6 +672,8 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
 
     def setLocalBrushOptions(self, **kwargs):
         """Set brush individually for each child item"""
+        if len(kwargs) > 0:
+            self.materialize()
         self.prepareGeometryChange()
         if hasattr(self, 'listOfItems'):
             for item in self.listOfItems:
@@ -595,6 +688,9 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
         self.lightenColour(False)
 
     def lightenColour(self, lighten=False):
+        if self.definition is not None:
+            self.lightened = lighten
+            self.update()
         for item in self.listOfItems:
             item.lightenColour(lighten)
 
@@ -638,14 +734,130 @@ class myGraphicsItemGroup(QtWidgets.QGraphicsItem, drawingElement):
         for item in self.listOfItems:
             item.redoEdit(point, **kwargs)
 
-    def exportToLatex(self):
-        latex = ''
+    def latexFragments(self, frame=None):
         if hasattr(self, 'isPin') and self.isPin is True:
             if self.isVisible() is False:
-                return ''
+                return
+        if self.definition is not None:
+            yield from self.definition.latexFragments(self, frame)
         for item in self.listOfItems:
-            latex += item.exportToLatex()
-        return latex
+            yield from item.latexFragments(frame)
+
+
+def canShare(item):
+    """Text and images are drawn at the resolution of the device, so they
+    are not recorded into shared pictures. Pins below the top level of a
+    symbol are only hidden through their own group."""
+    if isinstance(item, (TextBox, Image)):
+        return False
+    if hasattr(item, 'isPin') and item.isPin is True:
+        return False
+    if isinstance(item, myGraphicsItemGroup):
+        return all(canShare(child) for child in item.contentItems())
+    return True
+
+
+class SymbolDefinition(object):
+    """The items of a symbol, shared by all instances that are drawn from
+    it. template is a group holding the items, which is never added to a
+    scene. Everything but the pins is recorded once into a QPicture that
+    every instance plays back through its own transform."""
+
+    def __init__(self, template, minimumItems=2, parent=None):
+        self.template = template
+        # The template of a pin definition is a child of the template of
+        # its parent, so the parent has to live as long as the pins drawn
+        # from it, even after the instance they belong to is materialized
+        self.parent = parent
+        self.pictures = {}
+        self.boundingRect = None
+        items = [
+            item for item in template.listOfItems
+            if not (hasattr(item, 'isPin') and item.isPin is True)]
+        # A symbol with a single item saves nothing by being shared, but
+        # pins are copied into every instance
+        self.shareable = len(items) >= minimumItems and \
+            all(canShare(item) for item in items)
+        self.pinDefinitions = []
+        if self.shareable is True:
+            for pin in template.pins:
+                definition = None
+                if isinstance(pin, myGraphicsItemGroup):
+                    definition = SymbolDefinition(pin, minimumItems=1, parent=self)
+                    if definition.shareable is False:
+                        definition = None
+                self.pinDefinitions.append(definition)
+
+    def createPins(self):
+        """Returns copies of the pins for a new instance, drawn from shared
+        definitions of their own where possible"""
+        from src.fileformat import cloneItem
+        return [
+            cloneItem(pin, None, definition)
+            for pin, definition in zip(self.template.pins, self.pinDefinitions)]
+
+    def rect(self):
+        if self.boundingRect is None:
+            self.boundingRect = self.template.childrenBoundingRect()
+        return self.boundingRect
+
+    def picture(self, lightened=False):
+        """Returns the recorded items, with lightened colours when the
+        mouse is over the instance"""
+        if lightened not in self.pictures:
+            self.pictures[lightened] = self.record(lightened)
+        return self.pictures[lightened]
+
+    def record(self, lightened):
+        picture = QtGui.QPicture()
+        painter = QtGui.QPainter(picture)
+        option = QtWidgets.QStyleOptionGraphicsItem()
+        if lightened is True:
+            self.template.lightenColour(True)
+        for item in self.paintedItems(self.template):
+            painter.save()
+            painter.setTransform(item.itemTransform(self.template)[0], True)
+            item.paint(painter, option, None)
+            painter.restore()
+        if lightened is True:
+            self.template.lightenColour(False)
+        painter.end()
+        return picture
+
+    def paintedItems(self, group):
+        """Returns the visible items below group in painting order,
+        leaving out the pins"""
+        items = []
+        children = sorted(group.listOfItems, key=lambda item: item.zValue())
+        for item in children:
+            if hasattr(item, 'isPin') and item.isPin is True:
+                continue
+            if not item.isVisible():
+                continue
+            items.append(item)
+            if isinstance(item, myGraphicsItemGroup):
+                items.extend(self.paintedItems(item))
+        return items
+
+    def latexFragments(self, instance, frame=None):
+        """Returns the TikZ code of everything but the pins as if the items
+        were children of instance"""
+        if frame is None:
+            transform_ = instance.sceneTransform()
+        else:
+            transform_ = instance.itemTransform(frame)[0]
+        # Place the template where the instance is for the duration
+        templatePos, templateTransform = self.template.pos(), self.template.transform()
+        self.template.setPos(0, 0)
+        self.template.setTransform(transform_)
+        fragments = []
+        for item in self.template.listOfItems:
+            if hasattr(item, 'isPin') and item.isPin is True:
+                continue
+            fragments.extend(item.latexFragments())
+        self.template.setPos(templatePos)
+        self.template.setTransform(templateTransform)
+        return fragments
 
 
 class Wire(QtWidgets.QGraphicsPathItem, drawingElement):
@@ -833,17 +1045,17 @@ class Wire(QtWidgets.QGraphicsPathItem, drawingElement):
             self.editPointNumber += 1
             self.editPointNumber %= self.oldPath.toSubpathPolygons(QtGui.QTransform())[0].size()
 
-    def exportToLatex(self):
+    def latexFragments(self, frame=None):
         polyPathList = self.path().toSubpathPolygons(QtGui.QTransform())
-        polyPathPointList = []
         # latex = '\draw '
-        latex = super().exportToLatex(rotate=False)
+        yield self.latexOptions(rotate=False, frame=frame)
+        separator = ''
         for poly in polyPathList:
             for i in range(poly.count()):
                 point = poly.at(i)
-                latex += sceneXYFromPoint(point, self)
-                latex += ' -- '
-        return latex[:-4] + ';'
+                yield separator + sceneXYFromPoint(point, self, frame)
+                separator = ' -- '
+        yield ';'
 
 
 class Net(QtWidgets.QGraphicsLineItem, drawingElement):
@@ -968,308 +1180,105 @@ class Net(QtWidgets.QGraphicsLineItem, drawingElement):
         self.updateNet(newEnd)
         logger.info('Changed right angle to %s', self.rightAngleMode)
 
-    def mergeNets(self, netList, undoStack):
-        # Had to do the import here to avoid circular imports
-        from src.commands import Add, Delete, EditNet
-        # If this net has already been processed, its scene will not exist
-        if self.scene() is None:
-            return None
-        if self in netList:
-            netList.remove(self)
-        mergedNet = None
-        line1 = self.line()
-        line1 = QtCore.QLineF(self.mapToScene(line1.p1()), self.mapToScene(line1.p2()))
-        # Logic to figure out which points are within which other points
-        x11, x12 = min(line1.p1().x(), line1.p2().x()), max(line1.p1().x(), line1.p2().x())
-        y11, y12 = min(line1.p1().y(), line1.p2().y()), max(line1.p1().y(), line1.p2().y())
-        for net in netList:
-            line2 = net.line()
-            line2 = QtCore.QLineF(net.mapToScene(line2.p1()), net.mapToScene(line2.p2()))
-            x21, x22 = min(line2.p1().x(), line2.p2().x()), max(line2.p1().x(), line2.p2().x())
-            y21, y22 = min(line2.p1().y(), line2.p2().y()), max(line2.p1().y(), line2.p2().y())
-            xList, yList = [x11, x21, x12, x22], [y11, y21, y12, y22]
-            if x21 < x11:
-                xList = [x21, x11, x22, x12]
-            if y21 < y11:
-                yList = [y21, y11, y22, y12]
-            sortedXList, sortedYList = sorted(xList), sorted(yList)
-            if line2.angleTo(line1) in [0, 180]:
-                p1 = None
-                p2 = None
-                if y11 == y21 and y11 == y12 and y11 == y22:
-                    if xList == sortedXList:
-                        p1 = self.mapFromScene(QtCore.QPointF(sortedXList[0], y11))
-                        p2 = self.mapFromScene(QtCore.QPointF(sortedXList[3], y11))
-                    elif x21 >= x11 and x22 <= x12:
-                        logger.info('Merging net %s into net %s', net, self)
-                        scene = net.scene()
-                        del1 = Delete(None, scene, [net])
-                        undoStack.push(del1)
-                        mergedNet = self
-                    elif x21 < x11 and x22 > x12:
-                        logger.info('Merging net %s into net %s', self, net)
-                        scene = self.scene()
-                        del1 = Delete(None, scene, [self])
-                        undoStack.push(del1)
-                        mergedNet = net
-                elif x11 == x21 and x11 == x12 and x11 == x22:
-                    if yList == sortedYList:
-                        p1 = self.mapFromScene(QtCore.QPointF(x11, sortedYList[0]))
-                        p2 = self.mapFromScene(QtCore.QPointF(x11, sortedYList[3]))
-                    elif y21 >= y11 and y22 <= y12:
-                        logger.info('Merging net %s into net %s', net, self)
-                        scene = net.scene()
-                        del1 = Delete(None, scene, [net])
-                        undoStack.push(del1)
-                        mergedNet = self
-                    elif y21 < y11 and y22 > y12:
-                        logger.info('Merging net %s into net %s', self, net)
-                        scene = self.scene()
-                        del1 = Delete(None, scene, [self])
-                        undoStack.push(del1)
-                        mergedNet = net
-                if p1 is not None:
-                    logger.info('Merging nets %s and %s into %s', net, self, self)
-                    scene = self.scene()
-                    oldLine = self.line()
-                    newLine = QtCore.QLineF(p1, p2)
-                    editNet = EditNet(None, scene, self, oldLine, newLine)
-                    undoStack.push(editNet)
-                    # self.setLine(QtCore.QLineF(p1, p2))
-                    del1 = Delete(None, scene, [net])
-                    undoStack.push(del1)
-                    # Update x11, x12, y11 and y12
-                    line1 = self.line()
-                    line1 = QtCore.QLineF(self.mapToScene(line1.p1()), self.mapToScene(line1.p2()))
-                    # Logic to figure out which points are within which other points
-                    x11, x12 = min(line1.p1().x(), line1.p2().x()), max(line1.p1().x(), line1.p2().x())
-                    y11, y12 = min(line1.p1().y(), line1.p2().y()), max(line1.p1().y(), line1.p2().y())
-                    mergedNet = self
-        if mergedNet == self:
-            scene = mergedNet.scene()
-            # Check if the item is a dot
-            allDots = [item for item in scene.items() if isinstance(item, Circle) and item.localBrushStyle == 1 and item.oldRect == QtCore.QRectF(0, -4, 8, 8)]
-            # Keep only dots that are inside the net (not on endpoints)
-            for dot in allDots[:]:
-                dotPos = mergedNet.mapFromScene(dot.scenePos())
-                # The dot's scenePos is slightly to the left of actual center
-                dotPos += QtCore.QPointF(4, 0)
-                if dotPos in [mergedNet.line().p1(), mergedNet.line().p2()]:
-                    allDots.remove(dot)
-                elif not mergedNet.contains(dotPos):
-                    allDots.remove(dot)
-            if allDots != []:
-                # Find parent item of the dot instead of the circle that has been found
-                for i in range(len(allDots)):
-                    while allDots[i].parentItem() is not None:
-                        allDots[i] = allDots[i].parentItem()
-                # Delete the dots that are on the net
-                del1 = Delete(None, scene, allDots)
-                undoStack.push(del1)
-        return mergedNet
-
-    def splitNets(self, netList, pinList, undoStack, mode='add'):
-        # Had to do the import here to avoid circular imports
-        from src.commands import Add, Delete
-        # If this net has already been processed, its scene will not exist
-        if self.scene() is None:
-            return None
-        if self in netList:
-            netList.remove(self)
-        line1 = self.line()
-        line1 = QtCore.QLineF(self.mapToScene(line1.p1()), self.mapToScene(line1.p2()))
-        scene = self.scene()
-        for pin in pinList:
-            pinPos = pin.scenePos()
-            if pinPos in [line1.p1(), line1.p2()]:
-                pass
-            elif self.contains(self.mapFromScene(pinPos)):
-                newNet1 = self.createCopy()
-                newNet2 = self.createCopy()
-                scene.removeItem(newNet1)
-                scene.removeItem(newNet2)
-                newNet1Line, newNet2Line = newNet1.line(), newNet2.line()
-                newNet1Line.setP1(self.line().p1())
-                newNet1Line.setP2(self.mapFromScene(pinPos))
-                newNet2Line.setP2(self.line().p2())
-                newNet2Line.setP1(self.mapFromScene(pinPos))
-                newNet1.setLine(newNet1Line)
-                newNet2.setLine(newNet2Line)
-                if self.scene() is not None:
-                    parentItem = self.parentItem()
-                    del1 = Delete(None, scene, [self])
-                    undoStack.push(del1)
-                logger.info('Splitting net %s into nets %s and %s', self, newNet1, newNet2)
-                add = Add(None, scene, newNet1, parentItem)
-                undoStack.push(add)
-                add = Add(None, scene, newNet2, parentItem)
-                undoStack.push(add)
-                dotPos = pin.scenePos()
-                self.addDot(scene, dotPos, netList, pinList, undoStack)
-                self.splitNewNets(scene, dotPos, netList, pinList, undoStack, newNet1)
-                self.splitNewNets(scene, dotPos, netList, pinList, undoStack, newNet2)
-                return
-        for net in netList:
-            line2 = net.line()
-            line2 = QtCore.QLineF(net.mapToScene(line2.p1()), net.mapToScene(line2.p2()))
-            if line2.angleTo(line1) == 90 or line2.angleTo(line1) == 270:
-                if line2.p1() in [line1.p1(), line1.p2()] or line2.p2() in [line1.p1(), line1.p2()]:
-                    if line2.p1() in [line1.p1(), line1.p2()]:
-                        dotPos = line2.p1()
-                    else:
-                        dotPos = line2.p2()
-                    allDots = [item for item in scene.items() if
-                                isinstance(item, Circle) and
-                                item.localBrushStyle == 1 and
-                                item.rect() == QtCore.QRectF(0, -4, 8, 8)
-                    ]
-                    for pin in pinList:
-                        pinPos = pin.scenePos()
-                        if dotPos == pinPos:
-                            self.addDot(scene, dotPos, netList, pinList, undoStack, allDots)
-                            break
-                else:
-                    newNet1, newNet2 = None, None
-                    if net.contains(net.mapFromItem(self, self.line().p1())):
-                        newNet1 = net.createCopy()
-                        newNet2 = net.createCopy()
-                        scene.removeItem(newNet1)
-                        scene.removeItem(newNet2)
-                        newNet1Line, newNet2Line = newNet1.line(), newNet2.line()
-                        newNet1Line.setP1(net.line().p1())
-                        newNet1Line.setP2(net.mapFromItem(self, self.line().p1()))
-                        newNet2Line.setP2(net.line().p2())
-                        newNet2Line.setP1(net.mapFromItem(self, self.line().p1()))
-                        newNet1.setLine(newNet1Line)
-                        newNet2.setLine(newNet2Line)
-                        if net.scene() is not None:
-                            parentItem = net.parentItem()
-                            del1 = Delete(None, scene, [net])
-                            undoStack.push(del1)
-                        logger.info('Splitting net %s into nets %s and %s', net, newNet1, newNet2)
-                        add = Add(None, scene, newNet1, parentItem)
-                        undoStack.push(add)
-                        add = Add(None, scene, newNet2, parentItem)
-                        undoStack.push(add)
-                        dotPos = self.mapToScene(self.line().p1())
-                    elif net.contains(net.mapFromItem(self, self.line().p2())):
-                        newNet1 = net.createCopy()
-                        newNet2 = net.createCopy()
-                        scene.removeItem(newNet1)
-                        scene.removeItem(newNet2)
-                        newNet1Line, newNet2Line = newNet1.line(), newNet2.line()
-                        newNet1Line.setP1(net.line().p1())
-                        newNet1Line.setP2(net.mapFromItem(self, self.line().p2()))
-                        newNet2Line.setP2(net.line().p2())
-                        newNet2Line.setP1(net.mapFromItem(self, self.line().p2()))
-                        newNet1.setLine(newNet1Line)
-                        newNet2.setLine(newNet2Line)
-                        if net.scene() is not None:
-                            parentItem = net.parentItem()
-                            del1 = Delete(None, scene, [net])
-                            undoStack.push(del1)
-                        logger.info('Splitting net %s into nets %s and %s', net, newNet1, newNet2)
-                        add = Add(None, scene, newNet1, parentItem)
-                        undoStack.push(add)
-                        add = Add(None, scene, newNet2, parentItem)
-                        undoStack.push(add)
-                        dotPos = self.mapToScene(self.line().p2())
-                    elif self.contains(self.mapFromItem(net, net.line().p1())):
-                        newNet1 = self.createCopy()
-                        newNet2 = self.createCopy()
-                        scene.removeItem(newNet1)
-                        scene.removeItem(newNet2)
-                        newNet1Line, newNet2Line = newNet1.line(), newNet2.line()
-                        newNet1Line.setP1(self.line().p1())
-                        newNet1Line.setP2(self.mapFromItem(net, net.line().p1()))
-                        newNet2Line.setP2(self.line().p2())
-                        newNet2Line.setP1(self.mapFromItem(net, net.line().p1()))
-                        newNet1.setLine(newNet1Line)
-                        newNet2.setLine(newNet2Line)
-                        if self.scene() is not None:
-                            parentItem = self.parentItem()
-                            del1 = Delete(None, scene, [self])
-                            undoStack.push(del1)
-                        logger.info('Splitting net %s into nets %s and %s', self, newNet1, newNet2)
-                        add = Add(None, scene, newNet1, parentItem)
-                        undoStack.push(add)
-                        add = Add(None, scene, newNet2, parentItem)
-                        undoStack.push(add)
-                        dotPos = net.mapToScene(net.line().p1())
-                    elif self.contains(self.mapFromItem(net, net.line().p2())):
-                        newNet1 = self.createCopy()
-                        newNet2 = self.createCopy()
-                        scene.removeItem(newNet1)
-                        scene.removeItem(newNet2)
-                        newNet1Line, newNet2Line = newNet1.line(), newNet2.line()
-                        newNet1Line.setP1(self.line().p1())
-                        newNet1Line.setP2(self.mapFromItem(net, net.line().p2()))
-                        newNet2Line.setP2(self.line().p2())
-                        newNet2Line.setP1(self.mapFromItem(net, net.line().p2()))
-                        newNet1.setLine(newNet1Line)
-                        newNet2.setLine(newNet2Line)
-                        if self.scene() is not None:
-                            parentItem = self.parentItem()
-                            del1 = Delete(None, scene, [self])
-                            undoStack.push(del1)
-                        logger.info('Splitting net %s into nets %s and %s', self, newNet1, newNet2)
-                        add = Add(None, scene, newNet1, parentItem)
-                        undoStack.push(add)
-                        add = Add(None, scene, newNet2, parentItem)
-                        undoStack.push(add)
-                        dotPos = net.mapToScene(net.line().p2())
-                    if newNet1 is not None:
-                        self.splitNewNets(scene, dotPos, netList, pinList, undoStack, newNet1)
-                        self.splitNewNets(scene, dotPos, netList, pinList, undoStack, newNet2)
-                        # Break if self has been deleted
-                        if self.scene() is None:
-                            break
-
-    def splitNewNets(self, scene, dotPos, netList, pinList, undoStack, newNet):
-        if newNet is not None:
-            self.addDot(scene, dotPos, netList, pinList, undoStack)
-            newNetList = [item for item in netList if item.collidesWithItem(newNet)]
-            for net in newNetList:
-                if net.scene() is None:
-                    newNetList.remove(net)
-            newNet.splitNets(newNetList, pinList, undoStack)
-
-    def addDot(self, scene, dotPos, netList, pinList, undoStack, allDots=None):
-        from src.commands import Add
-        # Add a dot if required
-        if allDots is None:
-            allDots = [item for item in scene.items() if
-                    isinstance(item, Circle) and
-                    item.localBrushStyle == 1 and
-                    item.rect() == QtCore.QRectF(0, -4, 8, 8)
-            ]
-        dotExists = False
-        for item in allDots:
-            existingDotPos = item.scenePos()
-            # The dot's scenePos is slightly to the left of actual center
-            existingDotPos += QtCore.QPointF(4, 0)
-            if dotPos == item.scenePos():
-                dotExists = True
-                break
-        if dotExists is False:
-            logger.info('Adding dot at %s', dotPos)
-            with open('Resources/Symbols/Standard/Dot.sym', 'rb') as f:
-                dot1 = pickle.load(f)
-                dot1.__init__(None, dotPos, dot1.listOfItems, mode='symbol')
-                scene.addItem(dot1)
-                dot1.moveTo(dotPos, 'start')
-                dot1.moveTo(dotPos, 'done')
-                scene.removeItem(dot1)
-                add1 = Add(None, scene, dot1, symbol=True, origin=dotPos)
-                undoStack.push(add1)
-
-    def exportToLatex(self):
+    def latexFragments(self, frame=None):
         # latex = '\draw '
-        latex = super().exportToLatex(rotate=False)
-        latex += sceneXYFromPoint(self.line().p1(), self)
-        latex += ' -- '
-        latex += sceneXYFromPoint(self.line().p2(), self)
-        return latex + ';'
+        yield self.latexOptions(rotate=False, frame=frame)
+        yield sceneXYFromPoint(self.line().p1(), self, frame)
+        yield ' -- '
+        yield sceneXYFromPoint(self.line().p2(), self, frame)
+        yield ';'
+
+
+class Junction(QtWidgets.QGraphicsItem, drawingElement):
+    """A filled dot where nets connect. Schematics can hold thousands of
+    these, so unlike the old dot symbol a junction has no children, paints
+    one path shared by all junctions and is saved as little more than its
+    position."""
+
+    radius = 4
+    # Built on first use and shared by every junction
+    path = None
+    lightened = False
+    # Junctions are drawn in these unless they were changed
+    localPenWidth = 2
+    localPenColour = 'black'
+    localPenStyle = 1
+    localPenCapStyle = 0x10
+    localPenJoinStyle = 0x80
+    localBrushColour = 'black'
+    localBrushStyle = 1
+
+    def __init__(self, parent=None, start=None, **kwargs):
+        super().__init__(parent=parent, start=start)
+        self.setLocalPenOptions(**kwargs)
+        self.setLocalBrushOptions(**kwargs)
+        if start is not None:
+            self.setPos(start)
+
+    def __getstate__(self):
+        """Only the position and the options that differ from those of
+        every other junction are saved"""
+        state = {'origin': self.pos()}
+        for key in ['localPenWidth', 'localPenStyle', 'localBrushStyle']:
+            if self.__dict__.get(key, getattr(Junction, key)) != getattr(Junction, key):
+                state[key] = self.__dict__[key]
+        for key in ['localPenColour', 'localBrushColour']:
+            value = self.__dict__.get(key, getattr(Junction, key))
+            if QtGui.QColor(value) != QtGui.QColor(getattr(Junction, key)):
+                state[key] = value
+        if not self.transform().isIdentity():
+            state['transformData'] = self.transform()
+        return state
+
+    def setLocalPenOptions(self, **kwargs):
+        # The pen width changes the bounding rect
+        self.prepareGeometryChange()
+        super().setLocalPenOptions(**kwargs)
+
+    def dotPath(self):
+        if Junction.path is None:
+            path = QtGui.QPainterPath()
+            path.addEllipse(QtCore.QPointF(0, 0), self.radius, self.radius)
+            Junction.path = path
+        return Junction.path
+
+    def boundingRect(self):
+        padding = self.radius + 2*self.localPen.width()
+        return QtCore.QRectF(-padding, -padding, 2*padding, 2*padding)
+
+    def paint(self, painter, option, widget):
+        pen = QtGui.QPen(self.localPen)
+        brush = QtGui.QBrush(self.localBrush)
+        if self.lightened is True:
+            penColour = pen.color().lighter()
+            brushColour = brush.color().lighter()
+            if penColour == QtGui.QColor('black'):
+                penColour = QtGui.QColor('grey')
+            if brushColour == QtGui.QColor('black'):
+                brushColour = QtGui.QColor('grey')
+            pen.setColor(penColour)
+            brush.setColor(brushColour)
+        painter.setPen(pen)
+        painter.setBrush(brush)
+        painter.drawPath(self.dotPath())
+        if self.isSelected() is True:
+            pen = QtGui.QPen()
+            pen.setWidth(0.5)
+            pen.setStyle(2)
+            painter.setPen(pen)
+            painter.setBrush(QtGui.QBrush())
+            painter.drawRect(self.boundingRect())
+
+    def lightenColour(self, lighten=False):
+        self.lightened = lighten
+        self.update()
+
+    def latexFragments(self, frame=None):
+        yield self.latexOptions(rotate=False, frame=frame)
+        yield sceneXYFromPoint(QtCore.QPointF(0, 0), self, frame)
+        yield ' circle '
+        yield '[radius=' + str(self.radius/100) + ']'
+        yield ';'
 
 
 class Rectangle(QtWidgets.QGraphicsRectItem, drawingElement):
@@ -1397,8 +1406,8 @@ class Rectangle(QtWidgets.QGraphicsRectItem, drawingElement):
         rect = self.rect().normalized()
         self.p1, self.p2 = rect.topLeft(), rect.bottomRight()
 
-    def exportToLatex(self):
-        latex = super().exportToLatex()
+    def latexFragments(self, frame=None):
+        yield self.latexOptions(frame=frame)
         # Calculate bottom left and top right of rect in scene coords
         rect = self.rect()
         width, height = rect.width(), rect.height()
@@ -1406,12 +1415,16 @@ class Rectangle(QtWidgets.QGraphicsRectItem, drawingElement):
             width = -width
         if rect.topLeft().y() < 0:
             height = -height
-        p1 = sceneXYFromPoint(QtCore.QPointF(0, 0), self)
-        p2 = xyFromPoint(self.mapToScene(QtCore.QPointF(0, 0)) + QtCore.QPointF(width, height))
-        latex += p1
-        latex += ' rectangle '
-        latex += p2
-        return latex + ';'
+        if frame is None:
+            origin = self.mapToScene(QtCore.QPointF(0, 0))
+        else:
+            origin = self.mapToItem(frame, QtCore.QPointF(0, 0))
+        p1 = xyFromPoint(origin)
+        p2 = xyFromPoint(origin + QtCore.QPointF(width, height))
+        yield p1
+        yield ' rectangle '
+        yield p2
+        yield ';'
 
 
 class Ellipse(QtWidgets.QGraphicsEllipseItem, drawingElement):
@@ -1539,16 +1552,16 @@ class Ellipse(QtWidgets.QGraphicsEllipseItem, drawingElement):
         self.undoRectList.append(self.rect())
         self.updateP1P2()
 
-    def exportToLatex(self):
+    def latexFragments(self, frame=None):
         center = self.transform().inverted()[0].mapRect(self.rect()).center()
         rect = self.rect().normalized()
-        latex = super().exportToLatex()
-        latex += sceneXYFromPoint(center, self)
-        latex += ' ellipse '
-        latex += '[x radius=' + str(rect.width()/200)
-        latex += ', '
-        latex += 'y radius=' + str(rect.height()/200) + ']'
-        return latex + ';'
+        yield self.latexOptions(frame=frame)
+        yield sceneXYFromPoint(center, self, frame)
+        yield ' ellipse '
+        yield '[x radius=' + str(rect.width()/200)
+        yield ', '
+        yield 'y radius=' + str(rect.height()/200) + ']'
+        yield ';'
 
 
 class Circle(Ellipse):
@@ -1609,14 +1622,14 @@ class Circle(Ellipse):
         self.updateCircle(point)
         self.undoPointList.append(point)
 
-    def exportToLatex(self):
+    def latexFragments(self, frame=None):
         center = self.transform().inverted()[0].mapRect(self.rect()).center()
         rect = self.rect().normalized()
-        latex = drawingElement.exportToLatex(self)
-        latex += sceneXYFromPoint(center, self)
-        latex += ' circle '
-        latex += '[radius=' + str(rect.width()/200) + ']'
-        return latex + ';'
+        yield self.latexOptions(frame=frame)
+        yield sceneXYFromPoint(center, self, frame)
+        yield ' circle '
+        yield '[radius=' + str(rect.width()/200) + ']'
+        yield ';'
 
 
 class TextBox(QtWidgets.QGraphicsTextItem, drawingElement):
@@ -1886,22 +1899,20 @@ class TextBox(QtWidgets.QGraphicsTextItem, drawingElement):
             newItem.origin = self.origin
         return newItem
 
-    def exportToLatex(self):
-        if not hasattr(self, 'textEditor'):
-            self.textEditor = TextEditor(self, eulerFont=self.useEulerFont)
-        latex = super().exportToLatex()
-        latex += ' at '
-        latex += sceneXYFromPoint(QtCore.QPointF(0, 0), self)
-        latex += ' {'
+    def latexFragments(self, frame=None):
+        yield self.latexOptions(frame=frame)
+        yield ' at '
+        yield sceneXYFromPoint(QtCore.QPointF(0, 0), self, frame)
+        yield ' {'
         fontsize = self.localPenWidth/3
-        latex += '\\fontsize{' + str(fontsize) + 'pt}{' + str(fontsize) + 'pt}'
-        latex += '\\selectfont '
+        yield '\\fontsize{' + str(fontsize) + 'pt}{' + str(fontsize) + 'pt}'
+        yield '\\selectfont '
         if hasattr(self, 'latexExpression') and self.latexExpression is not None:
-            latex += '$' + self.latexExpression + '$'
+            yield '$' + self.latexExpression + '$'
         else:
-            latex += self.textEditor.exportToLatex()
-        latex += '}'
-        return latex + ';'
+            yield richTextToLatex(self.document())
+        yield '}'
+        yield ';'
 
 
 class Arc(Wire):
@@ -2077,17 +2088,17 @@ class Arc(Wire):
         self.oldPath = path
         self.setPath(path)
 
-    def exportToLatex(self):
-        latex = super().exportToLatex()
-        latex += sceneXYFromPoint(self.startPoint, self)
-        latex += ' .. controls '
-        latex += sceneXYFromPoint(self.controlPoint, self)
+    def latexFragments(self, frame=None):
+        yield from super().latexFragments(frame)
+        yield sceneXYFromPoint(self.startPoint, self, frame)
+        yield ' .. controls '
+        yield sceneXYFromPoint(self.controlPoint, self, frame)
         if self.points == 4:
-            latex += ' and '
-            latex += sceneXYFromPoint(self.controlPointAlt, self)
-        latex += ' .. '
-        latex += sceneXYFromPoint(self.endPoint, self)
-        return latex + ';'
+            yield ' and '
+            yield sceneXYFromPoint(self.controlPointAlt, self, frame)
+        yield ' .. '
+        yield sceneXYFromPoint(self.endPoint, self, frame)
+        yield ';'
 
 
 class Image(QtWidgets.QGraphicsPixmapItem, drawingElement):
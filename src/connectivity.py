@@ -0,0 +1,623 @@
+"""Incremental net connectivity.
+
+The NetGraph owns an index of the top level nets, the pins and the junction
+dots of a scene. Items are kept in a spatial hash of square cells, so that
+the items near a net are found without scanning the scene. The end points
+of the nets are joined in a union-find, whose sets are the connected parts
+of the schematic. Nets only connect at their end points, because nets are
+split wherever another net ends on them.
+
+Junction dots are registered under the point they sit on, so checking for a
+dot at a junction is a dictionary lookup and the dots on a net are found in
+the cells the net covers. The pin index also answers the nearest pin
+queries that nets snap to while they are drawn.
+
+The graph is brought up to date with update() for the items that undo
+commands touched. Merging collinear nets, splitting nets at T-junctions and
+pins and placing junction dots only look at the cells around the nets being
+placed.
+
+cleanupNets does the same for a whole schematic at once, by sorting the nets
+of every horizontal and vertical line instead of looking at each net's
+neighbours.
+"""
+from PyQt5 import QtCore
+from .components import Junction, Net, myGraphicsItemGroup
+import bisect
+import logging
+
+logger = logging.getLogger('YCircuit.connectivity')
+
+# Size of the cells of the spatial hash, in scene units
+cellSize = 100
+
+
+def pointKey(point):
+    """Returns the key of a scene point. Grid points are exact, so rounding
+    only hides floating point noise from transforms."""
+    return (round(point.x(), 3), round(point.y(), 3))
+
+
+def sceneLine(net):
+    line = net.line()
+    return QtCore.QLineF(net.mapToScene(line.p1()), net.mapToScene(line.p2()))
+
+
+def isPin(item):
+    return isinstance(item, myGraphicsItemGroup) and getattr(item, 'isPin', False) is True
+
+
+def isDot(item):
+    """Returns True if item is a top level junction dot"""
+    return isinstance(item, Junction) and item.parentItem() is None
+
+
+def strictlyInside(key, start, end):
+    """Returns True if key lies on the axis aligned segment from start to
+    end, but not on one of its end points"""
+    if start[0] == end[0] == key[0]:
+        return min(start[1], end[1]) < key[1] < max(start[1], end[1])
+    if start[1] == end[1] == key[1]:
+        return min(start[0], end[0]) < key[0] < max(start[0], end[0])
+    return False
+
+
+class NetGraph(object):
+    """Spatial hash and union-find over the nets, pins and dots of scene"""
+
+    def __init__(self, scene):
+        self.scene = scene
+        self.valid = False
+
+    def invalidate(self):
+        """Drops the index. It is built again from the scene when it is next
+        used, eg. after a file is loaded."""
+        self.valid = False
+
+    def rebuild(self):
+        self.cells = {}
+        self.itemCells = {}
+        self.netEnds = {}
+        self.pinPoints = {}
+        self.dotPoints = {}
+        self.pointNets = {}
+        self.pointPins = {}
+        self.pointDots = {}
+        self.parent = {}
+        self.members = {}
+        self.valid = True
+        for item in self.scene.items():
+            self.insert(item)
+        logger.info('Indexed %d nets, %d pins and %d dots',
+                    len(self.netEnds), len(self.pinPoints), len(self.dotPoints))
+
+    def ensureValid(self):
+        if self.valid is False:
+            self.rebuild()
+
+    def update(self, items):
+        """Indexes items and their children again at their current place in
+        the scene, or drops them if they are no longer in it"""
+        if self.valid is False:
+            return
+        for item in items:
+            for child in [item] + self.descendants(item):
+                self.discard(child)
+                if child.scene() is self.scene:
+                    self.insert(child)
+
+    def descendants(self, item):
+        children = []
+        for child in item.childItems():
+            children.append(child)
+            children.extend(self.descendants(child))
+        return children
+
+    # Spatial hash
+
+    def cellsOf(self, rect):
+        x1, y1 = int(rect.left() // cellSize), int(rect.top() // cellSize)
+        x2, y2 = int(rect.right() // cellSize), int(rect.bottom() // cellSize)
+        return [(x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+
+    def addToCells(self, item, rect):
+        cells = self.cellsOf(rect)
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(item)
+        self.itemCells[item] = cells
+
+    def itemsNear(self, rect):
+        items = set()
+        for cell in self.cellsOf(rect):
+            items.update(self.cells.get(cell, ()))
+        return items
+
+    def insert(self, item):
+        if isinstance(item, Net):
+            if item.parentItem() is not None:
+                return
+            line = sceneLine(item)
+            ends = (pointKey(line.p1()), pointKey(line.p2()))
+            self.netEnds[item] = ends
+            self.addToCells(item, QtCore.QRectF(line.p1(), line.p2()).normalized())
+            for key in ends:
+                self.pointNets.setdefault(key, set()).add(item)
+            self.union(*ends)
+        elif isPin(item):
+            point = item.scenePos()
+            key = pointKey(point)
+            self.pinPoints[item] = key
+            self.addToCells(item, QtCore.QRectF(point, point))
+            self.pointPins.setdefault(key, set()).add(item)
+            self.find(key)
+        elif isDot(item):
+            point = item.mapToScene(QtCore.QPointF(0, 0))
+            key = pointKey(point)
+            self.dotPoints[item] = key
+            self.addToCells(item, QtCore.QRectF(point, point))
+            self.pointDots.setdefault(key, set()).add(item)
+
+    def discard(self, item):
+        cells = self.itemCells.pop(item, None)
+        if cells is None:
+            return
+        for cell in cells:
+            self.cells[cell].discard(item)
+            if not self.cells[cell]:
+                del self.cells[cell]
+        if item in self.netEnds:
+            ends = self.netEnds.pop(item)
+            for key in ends:
+                self.pointNets[key].discard(item)
+                if not self.pointNets[key]:
+                    del self.pointNets[key]
+            self.separate(ends[0])
+        elif item in self.pinPoints:
+            key = self.pinPoints.pop(item)
+            self.pointPins[key].discard(item)
+            if not self.pointPins[key]:
+                del self.pointPins[key]
+        elif item in self.dotPoints:
+            key = self.dotPoints.pop(item)
+            self.pointDots[key].discard(item)
+            if not self.pointDots[key]:
+                del self.pointDots[key]
+
+    # Union-find over the end points of nets
+
+    def find(self, key):
+        if key not in self.parent:
+            self.parent[key] = key
+            self.members[key] = {key}
+            return key
+        root = key
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[key] != root:
+            self.parent[key], key = root, self.parent[key]
+        return root
+
+    def union(self, key1, key2):
+        root1, root2 = self.find(key1), self.find(key2)
+        if root1 == root2:
+            return
+        if len(self.members[root1]) < len(self.members[root2]):
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.members[root1].update(self.members.pop(root2))
+
+    def separate(self, key):
+        """Splits up the set of key after a net was removed from it. Only the
+        nets of that set are joined again."""
+        points = self.members.pop(self.find(key))
+        for point in points:
+            self.parent[point] = point
+            self.members[point] = {point}
+        for point in points:
+            for net in self.pointNets.get(point, ()):
+                self.union(*self.netEnds[net])
+        for point in points:
+            if point not in self.pointNets and point not in self.pointPins and \
+                    self.parent[point] == point and len(self.members[point]) == 1:
+                del self.parent[point]
+                del self.members[point]
+
+    def connectedNets(self, net):
+        """Returns the nets that are connected to net, including net"""
+        self.ensureValid()
+        if net not in self.netEnds:
+            return set()
+        nets = set()
+        for point in self.members[self.find(self.netEnds[net][0])]:
+            nets.update(self.pointNets.get(point, ()))
+        return nets
+
+    def connected(self, item1, item2):
+        """Returns True if two nets or pins are connected"""
+        self.ensureValid()
+        keys = []
+        for item in [item1, item2]:
+            if item in self.netEnds:
+                keys.append(self.netEnds[item][0])
+            elif item in self.pinPoints:
+                keys.append(self.pinPoints[item])
+            else:
+                return False
+        return self.find(keys[0]) == self.find(keys[1])
+
+    # Queries
+
+    def ignored(self, item, ignore):
+        return item in ignore or item.topLevelItem() in ignore
+
+    def netsNear(self, net, ignore=()):
+        """Returns the indexed nets whose cells overlap those of net"""
+        line = sceneLine(net)
+        return [
+            item for item in self.itemsNear(QtCore.QRectF(line.p1(), line.p2()).normalized())
+            if item in self.netEnds and item is not net and not self.ignored(item, ignore)]
+
+    def degree(self, key, ignore=()):
+        """Returns the number of net ends and pins at key"""
+        nets = [net for net in self.pointNets.get(key, ()) if not self.ignored(net, ignore)]
+        pins = [pin for pin in self.pointPins.get(key, ()) if not self.ignored(pin, ignore)]
+        return len(nets) + len(pins)
+
+    def covered(self, net):
+        """Returns True if net lies completely on another net"""
+        self.ensureValid()
+        line = sceneLine(net)
+        start, end = pointKey(line.p1()), pointKey(line.p2())
+        for other in self.netsNear(net):
+            otherStart, otherEnd = self.netEnds[other]
+            ends = [otherStart, otherEnd]
+            if (start in ends or strictlyInside(start, otherStart, otherEnd)) and \
+                    (end in ends or strictlyInside(end, otherStart, otherEnd)):
+                return True
+        return False
+
+    def nearestPin(self, point, radius):
+        """Returns the scene position of the pin closest to point, or None if
+        there is no pin closer than radius. Only the cells within radius
+        are searched."""
+        self.ensureValid()
+        rect = QtCore.QRectF(point.x() - radius, point.y() - radius, 2*radius, 2*radius)
+        closest, closestDistance = None, radius**2
+        for item in self.itemsNear(rect):
+            if item not in self.pinPoints:
+                continue
+            x, y = self.pinPoints[item]
+            distance = (x - point.x())**2 + (y - point.y())**2
+            if distance < closestDistance:
+                closest, closestDistance = (x, y), distance
+        if closest is None:
+            return None
+        return QtCore.QPointF(*closest)
+
+    def dotsAt(self, key, ignore=()):
+        return [dot for dot in self.pointDots.get(key, ()) if not self.ignored(dot, ignore)]
+
+    def dotsInside(self, net, ignore=()):
+        """Returns the dots on net, except for those on its end points"""
+        start, end = self.netEnds[net]
+        line = sceneLine(net)
+        return [
+            item for item in self.itemsNear(QtCore.QRectF(line.p1(), line.p2()).normalized())
+            if item in self.dotPoints and not self.ignored(item, ignore) and
+            strictlyInside(self.dotPoints[item], start, end)]
+
+    # Editing
+
+    def push(self, undoStack, command, items):
+        undoStack.push(command)
+        self.update(items)
+
+    def placeNet(self, net, undoStack, ignore=()):
+        """Merges net with the collinear nets that it overlaps or touches,
+        splits it and the nets around it where they meet and adds the dots
+        that the junctions need. Returns the net that net was merged into."""
+        self.ensureValid()
+        self.update([net])
+        if net not in self.netEnds:
+            return None
+        net = self.mergeNet(net, undoStack, ignore)
+        self.splitNet(net, undoStack, ignore)
+        return net
+
+    def reconnect(self, nets, undoStack, ignore=()):
+        """Places the nets that touch nets again, treating the items in
+        ignore as if they were not in the scene. Used before nets are
+        deleted or moved away, so that the nets they split are joined."""
+        self.ensureValid()
+        neighbours = []
+        for net in nets:
+            if net not in self.netEnds:
+                continue
+            start, end = self.netEnds[net]
+            for other in self.netsNear(net, ignore):
+                otherStart, otherEnd = self.netEnds[other]
+                if set([start, end]) & set([otherStart, otherEnd]) or \
+                        strictlyInside(otherStart, start, end) or \
+                        strictlyInside(otherEnd, start, end):
+                    if other not in neighbours:
+                        neighbours.append(other)
+        for other in neighbours:
+            if other.scene() is self.scene and other in self.netEnds:
+                self.placeNet(other, undoStack, ignore)
+
+    def mergeNet(self, net, undoStack, ignore=()):
+        from src.commands import Delete, EditNet
+        scene = self.scene
+        merged = False
+        while True:
+            start, end = self.netEnds[net]
+            if start[1] == end[1]:
+                axis, fixed = 0, start[1]
+            elif start[0] == end[0]:
+                axis, fixed = 1, start[0]
+            else:
+                break
+            low, high = sorted([start[axis], end[axis]])
+            candidates = []
+            for other in self.netsNear(net, ignore):
+                otherStart, otherEnd = self.netEnds[other]
+                if otherStart[1 - axis] != fixed or otherEnd[1 - axis] != fixed:
+                    continue
+                otherLow, otherHigh = sorted([otherStart[axis], otherEnd[axis]])
+                if otherLow <= high and low <= otherHigh:
+                    candidates.append((other, otherLow, otherHigh))
+            if candidates == []:
+                break
+            newLow = min([low] + [other[1] for other in candidates])
+            newHigh = max([high] + [other[2] for other in candidates])
+            survivor = net
+            if (low, high) != (newLow, newHigh):
+                for other, otherLow, otherHigh in candidates:
+                    if (otherLow, otherHigh) == (newLow, newHigh):
+                        survivor = other
+                        break
+            removed = [item for item, _, _ in candidates if item is not survivor]
+            if survivor is not net:
+                removed.append(net)
+            logger.info('Merging nets %s into net %s', removed, survivor)
+            survivorLow, survivorHigh = sorted([
+                self.netEnds[survivor][0][axis], self.netEnds[survivor][1][axis]])
+            if (survivorLow, survivorHigh) != (newLow, newHigh):
+                if axis == 0:
+                    p1, p2 = QtCore.QPointF(newLow, fixed), QtCore.QPointF(newHigh, fixed)
+                else:
+                    p1, p2 = QtCore.QPointF(fixed, newLow), QtCore.QPointF(fixed, newHigh)
+                newLine = QtCore.QLineF(survivor.mapFromScene(p1), survivor.mapFromScene(p2))
+                editNet = EditNet(None, scene, survivor, survivor.line(), newLine)
+                self.push(undoStack, editNet, [survivor])
+            self.push(undoStack, Delete(None, scene, removed), removed)
+            net = survivor
+            merged = True
+        if merged is True:
+            # Dots that used to be on the ends of the merged nets
+            dots = self.dotsInside(net, ignore)
+            if dots != []:
+                self.push(undoStack, Delete(None, scene, dots), dots)
+        return net
+
+    def splitNet(self, net, undoStack, ignore=()):
+        from src.commands import AddMulti, Delete
+        scene = self.scene
+        junctions = set()
+        queue = [net]
+        while queue != []:
+            net = queue.pop()
+            if net not in self.netEnds or self.ignored(net, ignore):
+                continue
+            start, end = self.netEnds[net]
+            junctions.update([start, end])
+            points = set()
+            line = sceneLine(net)
+            for item in self.itemsNear(QtCore.QRectF(line.p1(), line.p2()).normalized()):
+                if self.ignored(item, ignore) or item is net:
+                    continue
+                if item in self.pinPoints:
+                    keys = [self.pinPoints[item]]
+                elif item in self.netEnds:
+                    keys = self.netEnds[item]
+                    otherStart, otherEnd = keys
+                    # This net ends on the other one
+                    if strictlyInside(start, otherStart, otherEnd) or \
+                            strictlyInside(end, otherStart, otherEnd):
+                        queue.append(item)
+                else:
+                    continue
+                for key in keys:
+                    if strictlyInside(key, start, end):
+                        points.add(key)
+            if points == set():
+                continue
+            axis = 0 if start[1] == end[1] else 1
+            reverse = start[axis] > end[axis]
+            ends = [start] + sorted(points, key=lambda key: key[axis], reverse=reverse) + [end]
+            pieces = []
+            for p1, p2 in zip(ends[:-1], ends[1:]):
+                piece = net.createCopy()
+                scene.removeItem(piece)
+                piece.setLine(QtCore.QLineF(
+                    net.mapFromScene(QtCore.QPointF(*p1)),
+                    net.mapFromScene(QtCore.QPointF(*p2))))
+                piece.oldLine = piece.line()
+                pieces.append(piece)
+            logger.info('Splitting net %s into nets %s', net, pieces)
+            self.push(undoStack, Delete(None, scene, [net]), [net])
+            self.push(undoStack, AddMulti(None, scene, pieces, net.parentItem()), pieces)
+            junctions.update(points)
+        for key in junctions:
+            if self.degree(key, ignore) >= 3 and self.dotsAt(key, ignore) == []:
+                self.addDot(QtCore.QPointF(*key), undoStack)
+
+    def addDot(self, dotPos, undoStack):
+        from src.commands import Add
+        logger.info('Adding dot at %s', dotPos)
+        dot = Junction(None, dotPos)
+        self.push(undoStack, Add(None, self.scene, dot), [dot])
+
+
+def runsOfLine(segments):
+    """Merges the (low, high, net) segments of one line into runs of
+    overlapping or touching segments. Returns (low, high, nets) tuples
+    sorted by low."""
+    runs = []
+    for low, high, net in sorted(segments, key=lambda segment: (segment[0], segment[1])):
+        if runs != [] and low <= runs[-1][1]:
+            runs[-1][1] = max(runs[-1][1], high)
+            runs[-1][2].append(net)
+        else:
+            runs.append([low, high, [net]])
+    return [tuple(run) for run in runs]
+
+
+def onRun(runs, position):
+    """Returns True if position lies strictly inside one of the sorted runs
+    of a line"""
+    index = bisect.bisect_left(runs, (position,)) - 1
+    return index >= 0 and runs[index][0] < position < runs[index][1]
+
+
+def cleanupNets(scene, undoStack=None):
+    """Normalizes all top level nets of scene: overlapping and touching
+    collinear nets are merged, nets are split wherever another net ends on
+    them or a pin or a dot on a crossing lies on them, dots are added where
+    three or more net ends and pins meet and removed elsewhere.
+
+    The nets of each horizontal and vertical line are merged with a sort and
+    a sweep, and the junctions on each line are found by bisection, so this
+    takes O(n log n) time. The changes are pushed to undoStack as one macro,
+    or done directly if undoStack is None. Returns a dictionary counting the
+    nets and dots that were removed and added."""
+    from src.commands import AddMulti, Delete
+    lines = ({}, {})
+    nets = []
+    pins = []
+    dots = []
+    for item in scene.items():
+        if isinstance(item, Net):
+            if item.parentItem() is None:
+                nets.append(item)
+        elif isPin(item):
+            pins.append(pointKey(item.scenePos()))
+        elif isDot(item):
+            dots.append((item, pointKey(item.mapToScene(QtCore.QPointF(0, 0)))))
+    removedNets = []
+    # The span of each net along its line
+    bounds = {}
+    for net in nets:
+        line = sceneLine(net)
+        start, end = pointKey(line.p1()), pointKey(line.p2())
+        if start == end:
+            removedNets.append(net)
+        elif start[1] == end[1]:
+            bounds[net] = (min(start[0], end[0]), max(start[0], end[0]))
+            lines[0].setdefault(start[1], []).append(bounds[net] + (net,))
+        elif start[0] == end[0]:
+            bounds[net] = (min(start[1], end[1]), max(start[1], end[1]))
+            lines[1].setdefault(start[0], []).append(bounds[net] + (net,))
+    # Runs of each line, keyed by the fixed coordinate. Axis 0 holds the
+    # horizontal lines and axis 1 the vertical ones.
+    runs = [{fixed: runsOfLine(segments) for fixed, segments in lines[axis].items()}
+            for axis in range(2)]
+    # Points that nets have to be split at, by line
+    splitPoints = ({}, {})
+
+    def addPoint(key):
+        splitPoints[0].setdefault(key[1], []).append(key[0])
+        splitPoints[1].setdefault(key[0], []).append(key[1])
+
+    for axis in range(2):
+        for fixed, lineRuns in runs[axis].items():
+            for low, high, runNets in lineRuns:
+                if axis == 0:
+                    addPoint((low, fixed))
+                    addPoint((high, fixed))
+                else:
+                    addPoint((fixed, low))
+                    addPoint((fixed, high))
+    for key in pins:
+        addPoint(key)
+    for dot, key in dots:
+        # A dot on a crossing connects the crossing nets
+        if onRun(runs[0].get(key[1], []), key[0]) and onRun(runs[1].get(key[0], []), key[1]):
+            addPoint(key)
+    for points in splitPoints:
+        for fixed in points:
+            points[fixed] = sorted(set(points[fixed]))
+    # Split every run at the points strictly inside it
+    addedNets = []
+    ends = {}
+    for axis in range(2):
+        for fixed, lineRuns in runs[axis].items():
+            points = splitPoints[axis].get(fixed, [])
+            for low, high, runNets in lineRuns:
+                first = bisect.bisect_right(points, low)
+                last = bisect.bisect_left(points, high)
+                stops = [low] + points[first:last] + [high]
+                pieces = list(zip(stops[:-1], stops[1:]))
+                for pieceLow, pieceHigh in pieces:
+                    if axis == 0:
+                        pieceEnds = [(pieceLow, fixed), (pieceHigh, fixed)]
+                    else:
+                        pieceEnds = [(fixed, pieceLow), (fixed, pieceHigh)]
+                    for key in pieceEnds:
+                        ends[key] = ends.get(key, 0) + 1
+                if sorted(bounds[net] for net in runNets) == pieces:
+                    # The nets of the run are already split this way
+                    continue
+                net = runNets[0]
+                line = sceneLine(net)
+                removedNets.extend(runNets)
+                reverse = (line.p1().x(), line.p1().y())[axis] > (line.p2().x(), line.p2().y())[axis]
+                for pieceLow, pieceHigh in pieces:
+                    if axis == 0:
+                        p1, p2 = QtCore.QPointF(pieceLow, fixed), QtCore.QPointF(pieceHigh, fixed)
+                    else:
+                        p1, p2 = QtCore.QPointF(fixed, pieceLow), QtCore.QPointF(fixed, pieceHigh)
+                    if reverse is True:
+                        p1, p2 = p2, p1
+                    piece = net.createCopy()
+                    scene.removeItem(piece)
+                    piece.setLine(QtCore.QLineF(net.mapFromScene(p1), net.mapFromScene(p2)))
+                    piece.oldLine = piece.line()
+                    addedNets.append(piece)
+    for key in pins:
+        ends[key] = ends.get(key, 0) + 1
+    # Junction dots
+    junctions = set(key for key, degree in ends.items() if degree >= 3)
+    removedDots = []
+    dotted = set()
+    for dot, key in dots:
+        if key in junctions and key not in dotted:
+            dotted.add(key)
+        else:
+            removedDots.append(dot)
+    addedDots = []
+    for key in sorted(junctions - dotted):
+        addedDots.append(Junction(None, QtCore.QPointF(*key)))
+    removed, added = removedNets + removedDots, addedNets + addedDots
+    if undoStack is not None and removed + added != []:
+        undoStack.beginMacro('Clean up nets')
+        if removed != []:
+            undoStack.push(Delete(None, scene, removed))
+        if added != []:
+            undoStack.push(AddMulti(None, scene, added))
+        undoStack.endMacro()
+    elif undoStack is None:
+        # Without an undo stack to keep commands alive, AddMulti would hand
+        # the new items back to Python and they would be destroyed with it,
+        # so the scene is changed directly and owns them
+        for item in removed:
+            scene.removeItem(item)
+        for item in added:
+            scene.addItem(item)
+    summary = {
+        'netsRemoved': len(removedNets),
+        'netsAdded': len(addedNets),
+        'dotsRemoved': len(removedDots),
+        'dotsAdded': len(addedDots)}
+    logger.info('Cleaned up nets: %s', summary)
+    return summary
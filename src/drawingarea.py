@@ -1,9 +1,13 @@
-from PyQt5 import QtCore, QtGui, QtWidgets, QtPrintSupport, QtSvg
+from PyQt5 import QtCore, QtGui, QtWidgets
 from src.commands import *
 from src.components import *
 from src.drawingitems import *
 from .optionswindow import MyOptionsWindow
 from .preview import DrawingAreaPreview, ExportWindow
+from .export import ExportTarget, SceneRecording, exportPlan
+from .fileformat import Snapshot, instantiateSymbol, loadSchematicFile
+from .autobackup import AutobackupJournal, AutobackupWriter, commandItems, loadAutobackupFile
+from .connectivity import NetGraph, cleanupNets
 import pickle
 import os
 import glob
@@ -55,6 +59,14 @@ class DrawingArea(QtWidgets.QGraphicsView):
         self.showItemCenters = False
         self.undoStack = QtWidgets.QUndoStack(self)
         self.undoStack.setUndoLimit(1000)
+        # Every change to the undo stack is a new revision of the document
+        self.revision = 0
+        self.undoIndex = 0
+        self.undoStack.indexChanged.connect(self.documentChanged)
+        # Nets, pins and junction dots of the scene
+        self.netGraph = NetGraph(self.scene())
+        # Nets snap to the pins in the graph
+        self._grid.pinIndex = self.netGraph
         self.reflections = 0
         self.rotations = 0
         self.rotateAngle = 45
@@ -67,6 +79,18 @@ class DrawingArea(QtWidgets.QGraphicsView):
         self.autobackupTimer = QtCore.QTimer()
         self.autobackupTimer.setInterval(10000)
         self.autobackupTimer.timeout.connect(self.autobackupRoutine)
+        # Backups are written on a worker thread. None means that the current
+        # autobackup file has not been written yet
+        self.autobackupRevision = None
+        self.autobackupWriter = AutobackupWriter(self)
+        self.autobackupWriter.written.connect(self.autobackupWritten)
+        self.autobackupWriter.failed.connect(self.saveFailed)
+        self.autobackupWriter.saved.connect(self.saveFinished)
+        # Saves that are being written, oldest first
+        self.pendingSaves = []
+        self.lastSaveSucceeded = True
+        # Changes made after the last backup are appended to it
+        self.autobackupJournal = AutobackupJournal()
 
         self.settingsFileName = '.config'
 
@@ -213,6 +237,8 @@ class DrawingArea(QtWidgets.QGraphicsView):
         self.symbolPreviewFolder1 = settings.value('Misc/Symbol Preview Folder/1', 'Resources/Symbols/Standard/')
         self.symbolPreviewFolder2 = settings.value('Misc/Symbol Preview Folder/2', 'Resources/Symbols/Standard/')
         self.symbolPreviewFolder3 = settings.value('Misc/Symbol Preview Folder/3', 'Resources/Symbols/Standard/')
+        if hasattr(self.window(), 'symbolLibrary'):
+            self.window().updateSymbolLibraryFolders()
 
     def applyShortcuts(self, settings):
         """Applies shortcuts for the various functions part of YCircuit"""
@@ -363,13 +389,6 @@ class DrawingArea(QtWidgets.QGraphicsView):
         self.escapeRoutine()
         self._keys['net'] = True
         self.currentNet = None
-        self._grid.pinsPos = []
-        # Create a list of all pins in the schematic
-        for item in self.scene().items():
-            if isinstance(item, myGraphicsItemGroup):
-                if hasattr(item, 'isPin'):
-                    if item.isPin is True:
-                        self._grid.pinsPos.append(item.scenePos())
         self.statusbarMessage.emit('Left click to begin drawing a new net (press ' + self.window().ui.action_snapNetToPin.shortcut().toString() + ' to toggle snapping to pins or press ESC to cancel)', 0)
 
     def addResistor(self):
@@ -391,7 +410,7 @@ class DrawingArea(QtWidgets.QGraphicsView):
         self.loadRoutine('symbol', './Resources/Symbols/Standard/Ground_earth.sym')
 
     def addDot(self):
-        """Load the standard dot symbol"""
+        """Load the standard dot symbol, which is placed as a junction"""
         self.escapeRoutine()
         start = self.mapToGrid(self.currentPos)
         self.loadRoutine('symbol', './Resources/Symbols/Standard/Dot.sym')
@@ -466,11 +485,76 @@ class DrawingArea(QtWidgets.QGraphicsView):
             else:
                 self.statusbarMessage.emit('Please check that the quick access symbol exists', 1000)
 
+    def documentChanged(self, index):
+        """Records the commands that were done or undone in the journal and
+        updates the net connectivity of the items they changed"""
+        self.revision += 1
+        if index == self.undoIndex and self.undoStack.count() > 0:
+            # At the undo limit, the oldest command is dropped for the new one
+            commands = [self.undoStack.command(index - 1)]
+        else:
+            first, last = sorted([self.undoIndex, index])
+            commands = [self.undoStack.command(i) for i in range(first, last)]
+        if self.undoStack.count() == 0 or None in commands:
+            # The stack was cleared
+            self.autobackupJournal.dirty = True
+            self.netGraph.invalidate()
+        else:
+            items = []
+            for command in commands:
+                commandItems(command, items)
+            self.autobackupJournal.recordCommands(commands)
+            self.netGraph.update(items)
+        self.undoIndex = index
+
     def autobackupRoutine(self):
-        """Convenience function for saving the autobackup file"""
-        if self.autobackupEnable is True:
-            self.saveRoutine(mode='autobackup')
-            self.autobackupFile.flush()
+        """Saves the autobackup file if the document changed since the last
+        backup and the journal of those changes is due to be compacted. Only
+        a snapshot of the items is taken here, and it is written to the file
+        on a worker thread."""
+        if self.autobackupEnable is not True:
+            return
+        if self.autobackupRevision == self.revision:
+            return
+        if self.autobackupJournal.compactionDue() is False:
+            return
+        if self.autobackupWriter.busy is True:
+            return
+        listOfItems = self.listOfItemsToSave(mode='autobackup')
+        if len(listOfItems) == 0:
+            logger.info('Nothing to save')
+            self.autobackupRevision = self.revision
+            return
+        logger.info('Starting autobackup')
+        x = min([item.scenePos().x() for item in listOfItems])
+        y = min([item.scenePos().y() for item in listOfItems])
+        origin = QtCore.QPointF(x, y)
+        saveObject = myGraphicsItemGroup(None, origin, [])
+        saveObject.origin = origin
+        # The item under the mouse should not be saved in a lighter colour
+        hoverItem = self.itemUnderMouse()
+        if hoverItem is not None:
+            hoverItem.lightenColour(False)
+        snapshot = Snapshot(saveObject, listOfItems)
+        if hoverItem is not None:
+            hoverItem.lightenColour(True)
+        self.autobackupJournal.reset(self.autobackupFile.fileName(), listOfItems, origin)
+        self.autobackupWriter.write(snapshot, self.autobackupFile.fileName(), self.revision)
+
+    def autobackupWritten(self, revision, fileName):
+        # The autobackup file may have been closed or replaced meanwhile
+        if fileName != self.autobackupJournal.fileName:
+            return
+        self.autobackupRevision = revision
+        self.autobackupJournal.checkpointWritten(fileName)
+
+    def closeAutobackupFile(self):
+        """Waits for the backup being written and removes the autobackup file"""
+        self.autobackupWriter.waitForDone()
+        self.autobackupFile.close()
+        self.autobackupFile.remove()
+        self.autobackupRevision = None
+        self.autobackupJournal.close()
 
     def listOfItemsToSave(self, mode='schematicAs'):
         """Convenience function for generating the list of items to save. Most
@@ -514,19 +598,17 @@ class DrawingArea(QtWidgets.QGraphicsView):
         return listOfItems
 
     def saveRoutine(self, mode='schematicAs', export_filename=None):
-        """Handles saving of both symbols and schematics. For symbols and
-        schematics, items are first parented to a myGraphicsItemGroup.
-        The parent item is then saved into a corresponding .sym (symbol) and
-        .sch (schematic) file. If the save option is a schematic, the items are then
-        unparented.
+        """Handles saving of both symbols and schematics. The top level items
+        are taken into a snapshot as the children of a myGraphicsItemGroup,
+        without being reparented, and the snapshot is written to a
+        corresponding .sym (symbol) and .sch (schematic) file on the
+        autobackup writer's thread. The preview is rendered there too, from
+        a recording of the scene. Returns True once the save is queued; the
+        document is marked as saved by saveFinished once it is on disk.
         """
-        # Cancel all other modes unless autosaving
-        if mode != 'autobackup':
-            self.escapeRoutine()
-        else:
-            selectedItems = self.scene().selectedItems()
-            logger.info('Starting autobackup')
-        possibleModes = ['schematic', 'schematicAs', 'symbol', 'symbolAs', 'autobackup', 'commandline']
+        # Cancel all other modes
+        self.escapeRoutine()
+        possibleModes = ['schematic', 'schematicAs', 'symbol', 'symbolAs', 'commandline']
         # Create list of items
         listOfItems = self.listOfItemsToSave(mode)
         # Return if no items are present
@@ -625,73 +707,121 @@ class DrawingArea(QtWidgets.QGraphicsView):
                     return False
                 if not saveFile.endswith('.sch'):
                     saveFile += '.sch'
-            elif mode == 'autobackup':
-                saveFile = self.autobackupFile.fileName()
             elif mode == 'commandline':
                 saveFile = os.path.splitext(export_filename)[0] + '.sch'
 
+            if saveFile[:-4] == '':
+                return True
+            # The items are saved as they are, without being reparented
             saveObject = myGraphicsItemGroup(None, origin, [])
-            self.scene().addItem(saveObject)
             saveObject.origin = origin
-
-            # Set relative origins of child items
+            hoverItem = self.itemUnderMouse()
+            if hoverItem is not None:
+                hoverItem.lightenColour(False)
+            snapshot = Snapshot(saveObject, listOfItems)
+            # Items can only be painted on the GUI thread, so the area of the
+            # preview is recorded here into a display list, without painting
+            # any pixels. The writer renders the preview from it.
+            if self.mouseRect in self.scene().items():
+                self.scene().removeItem(self.mouseRect)
+            iconRect = QtCore.QRectF()
             for item in listOfItems:
-                item.origin = item.pos() - saveObject.origin
-                if hasattr(item, 'isPin'):
-                    if item.isPin is True:
-                        saveObject.pins.append(item)
-                item.lightenColour(False)
-                logger.info('Setting origin for item %s to %s', item, item.origin)
-            saveObject.setItems(listOfItems)
-
-            if saveFile[:-4] != '':
-                # Delete old autobackup file
-                if mode != 'autobackup':
-                    self.autobackupFile.close()
-                    self.autobackupFile.remove()
-                    logger.info('Closing old autobackup file')
-                    # Create and save a preview of the file unless when creating an autobackup
-                    if self.mouseRect in self.scene().items():
-                        self.scene().removeItem(self.mouseRect)
-                    saveObject.lightenColour(False)
-                    saveObject.icon = QtCore.QByteArray()
-                    buf = QtCore.QBuffer(saveObject.icon)
-                    img = myIconProvider().createIconPixmap(saveObject, self.scene()).toImage()
-                    img.save(buf, 'PNG', quality=10)
-                    if self.showMouseRect is True:
-                        self.scene().addItem(self.mouseRect)
-                with open(saveFile, 'wb') as file:
-                    logger.info('Saving to file %s', saveFile)
-                    pickle.dump(saveObject, file, -1)
-                if mode == 'symbol' or mode == 'symbolAs':
-                    self.symbolFileName = saveFile
-                    self.schematicFileName = None
-                    self.autobackupFile = QtCore.QTemporaryFile(self.symbolFileName)
-                if mode == 'schematic' or mode == 'schematicAs':
-                    self.schematicFileName = saveFile
-                    self.symbolFileName = None
-                    self.autobackupFile = QtCore.QTemporaryFile(self.schematicFileName)
-                if mode != 'autobackup':
-                    self.autobackupFile.open()
-                    self.autobackupFile.setAutoRemove(False)
-                    with open(self.autobackupFile.fileName(), 'wb') as file:
-                        pickle.dump(saveObject, file, -1)
-                    logger.info('New autobackup file created at %s', self.autobackupFile.fileName())
-                    self.undoStack.setClean()
-                    logger.info('Setting undo stack to clean')
-
-            # Always reparent items
-            saveObject.reparentItems()
-            self.scene().removeItem(saveObject)
-            if mode == 'autobackup':
-                for item in selectedItems:
-                    item.setSelected(True)
-            if self.itemAt(self.currentPos):
-                item = self.itemAt(self.currentPos).topLevelItem()
-                if item != self.mouseRect:
-                    item.lightenColour(True)
+                iconRect = iconRect.united(item.sceneBoundingRect())
+            recording = SceneRecording(self.scene(), iconRect)
+            if self.showMouseRect is True:
+                self.scene().addItem(self.mouseRect)
+            if hoverItem is not None:
+                hoverItem.lightenColour(True)
+
+            # The old autobackup file is kept until the save is on disk
+            oldAutobackupFile = self.autobackupFile
+            oldFileNames = (self.schematicFileName, self.symbolFileName)
+            if mode == 'symbol' or mode == 'symbolAs':
+                self.symbolFileName = saveFile
+                self.schematicFileName = None
+                self.autobackupFile = QtCore.QTemporaryFile(self.symbolFileName)
+            if mode == 'schematic' or mode == 'schematicAs':
+                self.schematicFileName = saveFile
+                self.symbolFileName = None
+                self.autobackupFile = QtCore.QTemporaryFile(self.schematicFileName)
+            self.autobackupFile.open()
+            self.autobackupFile.setAutoRemove(False)
+            # The same data becomes the checkpoint of the new autobackup file
+            self.autobackupJournal.reset(self.autobackupFile.fileName(), listOfItems, origin)
+            logger.info('Saving to file %s', saveFile)
+            self.autobackupWriter.save(
+                snapshot,
+                saveFile,
+                self.autobackupFile.fileName(),
+                self.revision,
+                recording,
+                iconRect,
+                myIconProvider())
+            oldAutobackupFiles = []
+            if self.autobackupFile is not oldAutobackupFile:
+                oldAutobackupFiles.append(oldAutobackupFile)
+                logger.info('New autobackup file created at %s', self.autobackupFile.fileName())
+            self.pendingSaves.append({
+                'fileName': saveFile,
+                'autobackupFile': self.autobackupFile,
+                'oldAutobackupFiles': oldAutobackupFiles,
+                'oldFileNames': oldFileNames,
+                'undoIndex': self.undoStack.index()})
             return True
 
+    def saveFinished(self, fileName, succeeded):
+        """Marks the document as saved once the oldest queued save is on
+        disk, or goes back to the file and autobackup file from before it
+        if it could not be written"""
+        save = self.pendingSaves.pop(0)
+        self.lastSaveSucceeded = succeeded
+        if succeeded is True:
+            for oldAutobackupFile in save['oldAutobackupFiles']:
+                logger.info('Closing old autobackup file')
+                oldAutobackupFile.close()
+                oldAutobackupFile.remove()
+            # Edits made while the file was written are not in it
+            if self.undoStack.index() == save['undoIndex']:
+                self.undoStack.setClean()
+                logger.info('Setting undo stack to clean')
+            return
+        if len(self.pendingSaves) > 0:
+            # The next save replaces the autobackup file of this one, and
+            # goes back to the files from before this one if it fails too
+            nextSave = self.pendingSaves[0]
+            nextSave['oldAutobackupFiles'][:0] = save['oldAutobackupFiles']
+            nextSave['oldFileNames'] = save['oldFileNames']
+            return
+        oldAutobackupFiles = save['oldAutobackupFiles']
+        if len(oldAutobackupFiles) > 0:
+            for autobackupFile in [save['autobackupFile']] + oldAutobackupFiles[1:]:
+                autobackupFile.close()
+                autobackupFile.remove()
+            self.autobackupFile = oldAutobackupFiles[0]
+        self.schematicFileName, self.symbolFileName = save['oldFileNames']
+        self.autobackupRevision = None
+        self.autobackupJournal.close()
+
+    def waitForSaves(self):
+        """Blocks until the queued saves are on disk. Returns False if the
+        last of them could not be written."""
+        self.autobackupWriter.waitForDone()
+        return self.lastSaveSucceeded
+
+    def itemUnderMouse(self):
+        """Returns the top level item under the mouse, if there is one"""
+        if self.itemAt(self.currentPos):
+            item = self.itemAt(self.currentPos).topLevelItem()
+            if item != self.mouseRect:
+                return item
+        return None
+
+    def saveFailed(self, fileName):
+        """Reports a saved file that could not be written"""
+        if fileName == self.autobackupFile.fileName():
+            return
+        self.statusbarMessage.emit('Could not save to ' + fileName, 5000)
+
     def exportRoutine(self, export_filename):
         """
         For images, a rect slightly larger than the bounding rect of all items is
@@ -751,6 +881,10 @@ class DrawingArea(QtWidgets.QGraphicsView):
                 hidePins=True,
                 transparentBackground=False
             )
+            if exportWindow.exec_() == 0:
+                self.restoreAfterExport(showItemCenters)
+                return
+            # The dialog stores the chosen options when it is accepted
             exportFormat = exportWindow.exportFormat
             exportArea = exportWindow.exportArea
             sourceRect = exportWindow.sourceRect
@@ -760,20 +894,6 @@ class DrawingArea(QtWidgets.QGraphicsView):
             quality = exportWindow.quality
             hidePins = exportWindow.hidePins
             transparentBackground = exportWindow.transparentBackground
-            if exportWindow.exec_() == 0:
-                # Add the grid back to the scene
-                if self._grid.enableGrid is True:
-                    self._grid.createGrid()
-                if self.showMouseRect is True:
-                    self.scene().addItem(self.mouseRect)
-                if self.showPins is exportWindow.hidePins:
-                    self.showPins = not self.showPins
-                    self.togglePinsRoutine()
-                if showItemCenters is True:
-                    self.toggleItemCentersRoutine(True)
-                # Reselect items after exporting is completed
-                for item in self._selectedItems:
-                    item.setSelected(True)
         if export_filename:
             saveFile = os.path.join(self.defaultExportFolder, export_filename)
             saveFilter = 'PDF files (*.pdf)'
@@ -806,112 +926,47 @@ class DrawingArea(QtWidgets.QGraphicsView):
             if not saveFile.endswith('.' + saveFilter):
                 saveFile = str(saveFile) + '.' + saveFilter
         else:
-            # Add the grid back to the scene
-            if self._grid.enableGrid is True:
-                self._grid.createGrid()
-            if self.showMouseRect is True:
-                self.scene().addItem(self.mouseRect)
-            if self.showPins is exportWindow.hidePins:
-                self.showPins = not self.showPins
-                self.togglePinsRoutine(True)
-            if showItemCenters is True:
-                self.toggleItemCentersRoutine()
+            self.restoreAfterExport(showItemCenters)
             return
-        logger.info('Exporting to file %s', saveFile)
-        if saveFilter == 'pdf':
-            mode = 'pdf'
-        elif saveFilter == 'svg':
-            mode = 'svg'
-        elif saveFilter in ['jpg', 'png', 'bmp', 'tiff']:
-            mode = 'image'
-        elif saveFilter == 'tex':
-            mode = 'tex'
-        logger.info('Source rectangle set to %s', sourceRect)
-        if mode == 'pdf':
-            # Initialize printer
-            printer = QtPrintSupport.QPrinter(QtPrintSupport.QPrinter.HighResolution)
-            # Choose appropriate format
-            printer.setOutputFormat(printer.PdfFormat)
-            printer.setOutputFileName(saveFile)
-            printer.setFullPage(True)
-            pageSize = QtGui.QPageSize(QtCore.QSize(width, height), matchPolicy=QtGui.QPageSize.ExactMatch)
-            printer.setPageSize(pageSize)
-            painter = QtGui.QPainter(printer)
-            self.scene().render(painter, source=sourceRect)
-            logger.info('Rendering PDF')
-        elif mode == 'svg':
-            svgGenerator = QtSvg.QSvgGenerator()
-            svgGenerator.setFileName(saveFile)
-            svgGenerator.setSize(QtCore.QSize(width, height))
-            svgGenerator.setResolution(96)
-            svgGenerator.setViewBox(QtCore.QRect(0, 0, width, height))
-            painter = QtGui.QPainter(svgGenerator)
-            self.scene().render(painter, source=sourceRect)
-            logger.info('Rendering SVG')
-        elif mode == 'image':
-            # Create an image object
-            img = QtGui.QImage(
-                QtCore.QSize(scaleFactor * width, scaleFactor * height), QtGui.QImage.Format_ARGB32_Premultiplied)
-            # Set background to white if required
-            if transparentBackground is False:
-                img.fill(QtGui.QColor('white'))
-                logger.info('Setting exported background to white')
+        if exportArea in ['full', 'visible']:
+            itemsToExport = self.scene().items()
+        elif exportArea == 'selected':
+            itemsToExport = self._selectedItems
+        # The grid, selection and pins stay hidden for the whole plan
+        target = ExportTarget(
+            saveFile,
+            saveFilter,
+            sourceRect,
+            scaleFactor=scaleFactor,
+            quality=quality,
+            transparentBackground=transparentBackground,
+            exportArea=exportArea,
+            itemsToExport=itemsToExport)
+        try:
+            exportPlan(self.scene(), [target])
+        finally:
+            if export_filename:
+                # Everything but the selection was put back before saving
+                for item in self._selectedItems:
+                    item.setSelected(True)
             else:
-                img.fill(QtCore.Qt.transparent)
-            painter = QtGui.QPainter(img)
-            painter.setRenderHint(painter.SmoothPixmapTransform, True)
-            painter.setRenderHint(painter.Antialiasing, True)
-            painter.setRenderHint(painter.TextAntialiasing, True)
-            targetRect = QtCore.QRectF(img.rect())
-            self.scene().render(painter, targetRect, sourceRect)
-            img.save(saveFile, saveFilter, quality=quality)
-            logger.info('Rendering %s to target rectangle %s', saveFilter.upper(), targetRect)
-        elif mode == 'tex':
-            latex = '\\scalebox{%s}{\\begin{tikzpicture}\n' %(scaleFactor)
-            if exportArea in ['full', 'visible']:
-                itemsToExport = self.scene().items()
-            elif exportArea == 'selected':
-                itemsToExport = self._selectedItems
-            min_ = int(min([item.zValue() for item in itemsToExport]))
-            max_ = int(max([item.zValue() for item in itemsToExport])) + 1
-            for i in range(min_, max_):
-                latex += '\\pgfdeclarelayer{%d}\n' %i
-            latex += '\\pgfsetlayers{'
-            for i in range(min_, max_):
-                latex += str(i) + ','
-            latex = latex[:-1] + '}\n'
-            for item in itemsToExport:
-                if item.parentItem() is None:
-                    latex += '% Drawing ' + str(item) + '\n'
-                    latex += '\\begin{pgfonlayer}{%d}\n' %int(item.zValue())
-                    if exportArea == 'visible':
-                        latex += '\\clip ' + xyFromPoint(sourceRect.topLeft()) + \
-                            ' rectangle ' + xyFromPoint(sourceRect.bottomRight()) + ';\n'
-                    latex += item.exportToLatex() + '\n'
-                    latex += '\\end{pgfonlayer}\n'
-                    latex += '% End drawing ' + str(item) + '\n'
-            latex += '\\end{tikzpicture}}\n'
-            with open(saveFile, 'w') as f:
-                f.write(latex)
-            logger.info('Writing TEX file')
-
-        # Need to stop painting to avoid errors about painter getting deleted
-        if mode != 'tex':
-            painter.end()
-        # Add the grid back to the scene when saving is done
-        # if self._grid.enableGrid is True:
-        #     self._grid.createGrid()
-        # if self.showMouseRect is True:
-        #     self.scene().addItem(self.mouseRect)
-        # if self.showPins is exportWindow.hidePins:
-        #     self.showPins = not self.showPins
-        #     self.togglePinsRoutine()
-        # if showItemCenters is True:
-        #     self.toggleItemCentersRoutine(True)
-        # Reselect items after exporting is completed
+                self.restoreAfterExport(showItemCenters)
+        logger.info('Finishing export')
+
+    def restoreAfterExport(self, showItemCenters):
+        """Shows the grid, mouse rect, pins, item centers and selection
+        again once an export is done or cancelled"""
+        if self._grid.enableGrid is True:
+            self._grid.createGrid()
+        if self.showMouseRect is True and self.mouseRect not in self.scene().items():
+            self.scene().addItem(self.mouseRect)
+        # The export preview hides pins without updating showPins
+        self.showPins = not self.showPins
+        self.togglePinsRoutine()
+        if showItemCenters is True:
+            self.toggleItemCentersRoutine(True)
         for item in self._selectedItems:
             item.setSelected(True)
-        logger.info('Finishing export')
 
     def loadAutobackupRoutine(self, loadFile=None):
         """Convenience function that generates a message box asking the user
@@ -978,8 +1033,14 @@ class DrawingArea(QtWidgets.QGraphicsView):
                 if mode == 'schematic' or mode == 'symbolModify':
                     if glob.glob(loadFile + '.*') != []:
                         loadFile = self.loadAutobackupRoutine(loadFile)
-                with open(loadFile, 'rb') as file:
-                    loadItem = pickle.load(file)
+                if mode == 'symbol':
+                    # Symbols are built from cached prototypes
+                    loadItem = instantiateSymbol(loadFile, self.mapToGrid(self.currentPos))
+                elif not loadFile.endswith(('.sch', '.sym')):
+                    # Autobackup files are checkpoints followed by a journal
+                    loadItem = loadAutobackupFile(loadFile, QtCore.QPointF(0, 0))
+                else:
+                    loadItem = loadSchematicFile(loadFile, QtCore.QPointF(0, 0))
                 if mode == 'schematic' or mode == 'symbolModify':
                     # Remove trailing characters from autobackup file .XXXXXX
                     if not loadFile.endswith(('.sch', '.sym')):
@@ -989,14 +1050,20 @@ class DrawingArea(QtWidgets.QGraphicsView):
                         os.remove(glob.glob(loadFile + '.*')[0])
             elif loadItem is None:
                 return False
+            else:
+                # Pasted items are unpickled and still need to be set up
+                loadItem.__init__(
+                    None,
+                    self.mapToGrid(self.currentPos),
+                    loadItem.listOfItems,
+                    mode='symbol')
             if mode == 'schematic' or mode == 'symbolModify':
                 self.schematicFileName = None
                 self.symbolFileName = None
                 # Remove old autobackup file if it exists
                 # This will not exist when recovering from unsaved crash
                 if hasattr(self, 'autobackupFile'):
-                    self.autobackupFile.close()
-                    self.autobackupFile.remove()
+                    self.closeAutobackupFile()
                     logger.info('Closing old autobackup file')
                 if mode == 'schematic':
                     self.schematicFileName = loadFile
@@ -1013,23 +1080,14 @@ class DrawingArea(QtWidgets.QGraphicsView):
                 self.scene().clear()
                 if self.showMouseRect is True:
                     self.scene().addItem(self.mouseRect)
-                loadItem.__init__(
-                    None,
-                    QtCore.QPointF(0, 0),
-                    loadItem.listOfItems,
-                    mode='symbol')
                 self.scene().addItem(loadItem)
                 # loadItem.loadItems(mode)
             elif mode == 'symbol':
                 logger.info('Loading item %s as a symbol', loadItem)
                 self.loadItem = loadItem
-                loadItem.__init__(
-                    None,
-                    self.mapToGrid(self.currentPos),
-                    loadItem.listOfItems,
-                    mode='symbol')
                 self.scene().addItem(self.loadItem)
-                self.loadItem.pinVisibility(self.showPins)
+                if isinstance(self.loadItem, myGraphicsItemGroup):
+                    self.loadItem.pinVisibility(self.showPins)
                 self.loadItem.showItemCenter = self.showItemCenters
                 self.window().recentSymbolsModel.setData(QtCore.QModelIndex(), loadFile)
                 # loadItem.loadItems('symbol')
@@ -1184,7 +1242,11 @@ class DrawingArea(QtWidgets.QGraphicsView):
         """Copy items to the clipboard"""
         listOfItems = []
         for item in copiedItems:
-            listOfItems.append(item.createCopy())
+            itemCopy = item.createCopy()
+            # Shared definitions cannot be pickled
+            if isinstance(itemCopy, myGraphicsItemGroup):
+                itemCopy.materialize(True)
+            listOfItems.append(itemCopy)
             item.setSelected(False)
         x = min([item.scenePos().x() for item in listOfItems])
         y = min([item.scenePos().y() for item in listOfItems])
@@ -1212,30 +1274,24 @@ class DrawingArea(QtWidgets.QGraphicsView):
             return
         self.undoStack.beginMacro('')
         itemsToDelete = self.scene().selectedItems()
-        for item2 in self.scene().selectedItems():
-            if isinstance(item2, Net):
-                netList = [item for item in self.scene().items() if
-                           (isinstance(item, Net) and
-                            item.collidesWithItem(item2)) and
-                           item not in self.scene().selectedItems() and
-                           item.parentItem() is None
-                ]
-                pinList = [item for item in self.scene().items() if
-                            (isinstance(item, myGraphicsItemGroup) and
-                            hasattr(item, 'isPin') and
-                            item.isPin is True)
-                ]
-                if item2 in netList:
-                    netList.remove(item2)
-                for item in netList[:]:
-                    mergedNet = item.mergeNets(netList[:], self.undoStack)
-                    if mergedNet is not None:
-                        mergedNet.splitNets(netList[:], pinList, self.undoStack)
+        # Join the nets that the deleted nets split
+        deletedNets = [item for item in itemsToDelete if isinstance(item, Net)]
+        self.netGraph.reconnect(deletedNets, self.undoStack, ignore=set(itemsToDelete))
         del1 = Delete(None, self.scene(), itemsToDelete)
         self.undoStack.push(del1)
         self.undoStack.endMacro()
         self.statusbarMessage.emit("Delete", 2000)
 
+    def cleanupNetsRoutine(self):
+        """Merges, splits and adds dots to all nets of the schematic as a
+        single undoable command"""
+        self.escapeRoutine()
+        summary = cleanupNets(self.scene(), self.undoStack)
+        self.statusbarMessage.emit(
+            'Replaced %d nets with %d, removed %d dots and added %d' % (
+                summary['netsRemoved'], summary['netsAdded'],
+                summary['dotsRemoved'], summary['dotsAdded']), 3000)
+
     def fitToViewRoutine(self):
         """Resizes viewport so that all items drawn are visible"""
         if len(self.scene().items()) == 1:
@@ -1702,25 +1758,9 @@ class DrawingArea(QtWidgets.QGraphicsView):
                 # Evaluate if any new nets need to be split/merged
                 # Only do this check if moving and *not* for copying
                 if self._keys['c'] is False:
-                    for item2 in self.moveItems:
-                        if isinstance(item2, Net):
-                            netList = [item for item in self.scene().items() if
-                                       (isinstance(item, Net) and
-                                        item.collidesWithItem(item2)) and
-                                       item not in self.scene().selectedItems() and
-                                       item.parentItem() is None
-                            ]
-                            pinList = [item for item in self.scene().items() if
-                                    (isinstance(item, myGraphicsItemGroup) and
-                                        hasattr(item, 'isPin') and
-                                        item.isPin is True)
-                            ]
-                            if item2 in netList:
-                                netList.remove(item2)
-                            for item in netList[:]:
-                                mergedNet = item.mergeNets(netList, self.undoStack)
-                                if mergedNet is not None:
-                                    mergedNet.splitNets(netList, pinList, self.undoStack)
+                    movedNets = [item for item in self.moveItems if isinstance(item, Net)]
+                    self.netGraph.reconnect(
+                        movedNets, self.undoStack, ignore=set(self.scene().selectedItems()))
             # End moving if LMB is clicked again and selection is not empty
             elif self.moveItems != []:
                 point = self.mapToGrid(event.pos())
@@ -1744,24 +1784,11 @@ class DrawingArea(QtWidgets.QGraphicsView):
                 # Evaluate if any new nets need to be split/merged
                 # if self._keys['c'] is False:
                 if True:
+                    # The graph only hears of the move once the macro ends
+                    self.netGraph.update(self.moveItems)
                     for item2 in self.moveItems:
-                        if isinstance(item2, Net):
-                            netList = [item for item in self.scene().items() if
-                                       (isinstance(item, Net) and
-                                        item.collidesWithItem(item2)) and
-                                       item not in self.scene().selectedItems() and
-                                       item.parentItem() is None
-                            ]
-                            pinList = [item for item in self.scene().items() if
-                                    (isinstance(item, myGraphicsItemGroup) and
-                                        hasattr(item, 'isPin') and
-                                        item.isPin is True)
-                            ]
-                            mergedNet = item2.mergeNets(netList, self.undoStack)
-                            if mergedNet is not None:
-                                mergedNet.splitNets(netList, pinList, self.undoStack)
-                            elif item2.scene() is not None:
-                                item2.splitNets(netList, pinList, self.undoStack)
+                        if isinstance(item2, Net) and item2.scene() is not None:
+                            self.netGraph.placeNet(item2, self.undoStack)
                 # End move command once item has been placed
                 self._keys['m'] = False
                 self._keys['c'] = False
@@ -2025,18 +2052,6 @@ class DrawingArea(QtWidgets.QGraphicsView):
             else:
                 self.statusbarMessage.emit('Left click to begin drawing a new net (press ' + self.window().ui.action_snapNetToPin.shortcut().toString() + ' to toggle snapping to pins or press ESC to cancel)', 0)
                 if self.currentNet is not None:
-                    netList = [item for item in self.scene().items() if
-                               (isinstance(item, Net) and
-                                item.collidesWithItem(self.currentNet)) and
-                               item.parentItem() is None
-                    ]
-                    pinList = [item for item in self.scene().items() if
-                               (isinstance(item, myGraphicsItemGroup) and
-                                hasattr(item, 'isPin') and
-                                item.isPin is True and
-                                item.collidesWithItem(self.currentNet))
-                    ]
-                    netList.remove(self.currentNet)
                     self.scene().removeItem(self.currentNet)
                     # Only do this if current net is not 0 length
                     if self.currentNet.line().length() > 0.01:
@@ -2044,43 +2059,18 @@ class DrawingArea(QtWidgets.QGraphicsView):
                         add = Add(None, self.scene(), self.currentNet)
                         self.currentNet.showItemCenter = self.showItemCenters
                         self.undoStack.push(add)
-                        mergedNet = self.currentNet.mergeNets(netList, self.undoStack)
-                        if mergedNet is not None:
-                            mergedNet.splitNets(netList, pinList, self.undoStack)
-                        else:
-                            self.currentNet.splitNets(netList, pinList, self.undoStack)
+                        self.netGraph.placeNet(self.currentNet, self.undoStack)
                         # Add the perpendicular line properly, if it exists
                         if self.currentNet.perpLine is not None:
-                            netList = [item for item in self.scene().items() if
-                                       (isinstance(item, Net) and
-                                        item.collidesWithItem(self.currentNet.perpLine)) and
-                                       item.parentItem() is None
-                            ]
-                            pinList = [item for item in self.scene().items() if
-                                    (isinstance(item, myGraphicsItemGroup) and
-                                        hasattr(item, 'isPin') and
-                                        item.isPin is True and
-                                        item.collidesWithItem(self.currentNet.perpLine))
-                            ]
-                            netList.remove(self.currentNet.perpLine)
-                            perpLineObscured = False
-                            for net in netList:
-                                p1 = self.currentNet.perpLine.mapToItem(net, self.currentNet.perpLine.line().p1())
-                                p2 = self.currentNet.perpLine.mapToItem(net, self.currentNet.perpLine.line().p2())
-                                if (net.contains(p1) and net.contains(p2)) and net != self.currentNet.perpLine:
-                                    perpLineObscured = True
                             self.scene().removeItem(self.currentNet.perpLine)
+                            perpLineObscured = self.netGraph.covered(self.currentNet.perpLine)
                             if perpLineObscured is False:
                                 self.undoStack.endMacro()
                                 self.undoStack.beginMacro('')
                                 add = Add(None, self.scene(), self.currentNet.perpLine)
                                 self.currentNet.perpLine.showItemCenter = self.showItemCenters
                                 self.undoStack.push(add)
-                                mergedNet = self.currentNet.perpLine.mergeNets(netList, self.undoStack)
-                                if mergedNet is not None:
-                                    mergedNet.splitNets(netList, pinList, self.undoStack)
-                                else:
-                                    self.currentNet.perpLine.splitNets(netList, pinList, self.undoStack)
+                                self.netGraph.placeNet(self.currentNet.perpLine, self.undoStack)
                         self.undoStack.endMacro()
                     self.currentNet = None
                     logger.info('Finish drawing net')
@@ -1,6 +1,5 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 from src.gui.textEditor_gui import Ui_Dialog
-import pickle
 import sympy
 from io import BytesIO
 from distutils.spawn import find_executable
@@ -35,7 +34,8 @@ class Grid(QtCore.QObject):
         self.yMinorPoints = list(range(0, self.yLength + self.minorSpacing, self.minorSpacing))
         self.xMajorPoints = list(range(0, self.xLength + self.majorSpacing, self.majorSpacing))
         self.yMajorPoints = list(range(0, self.yLength + self.majorSpacing, self.majorSpacing))
-        self.pinsPos = []
+        # Answers nearestPin(point, radius) queries when snapping nets
+        self.pinIndex = None
 
     def createGrid(self):
         self.xMinorPoints = list(range(0, self.xLength + self.minorSpacing, self.minorSpacing))
@@ -79,18 +79,78 @@ class Grid(QtCore.QObject):
             newX = round(point.x()/snapToGridSpacing)*snapToGridSpacing
             newY = round(point.y()/snapToGridSpacing)*snapToGridSpacing
         if pin is True:
-            if self.pinsPos == []:
+            if self.pinIndex is None:
                 return QtCore.QPointF(newX, newY)
             if self.snapNetToPin is False:
                 return QtCore.QPointF(newX, newY)
-            pinsPos = [pos-QtCore.QPointF(newX, newY) for pos in self.pinsPos]
-            dist = [pin.x()**2 + pin.y()**2 for pin in pinsPos]
-            if min(dist) < 25*self.snapToGridSpacing**2:
-                closestPin = dist.index(min(dist))
-                newX, newY = self.pinsPos[closestPin].x(), self.pinsPos[closestPin].y()
+            pinPos = self.pinIndex.nearestPin(
+                QtCore.QPointF(newX, newY), 5*self.snapToGridSpacing)
+            if pinPos is not None:
+                newX, newY = pinPos.x(), pinPos.y()
         return QtCore.QPointF(newX, newY)
 
 
+def latexModifiers(format_):
+    """Returns the LaTeX commands that reproduce the formatting in format_"""
+    modifiers = []
+    if format_.fontWeight() == 75:
+        modifiers.append('\\textbf{')
+    if format_.fontItalic() is True:
+        modifiers.append('\\textit{')
+    if format_.fontUnderline() is True:
+        modifiers.append('\\underline{')
+    if format_.fontOverline() is True:
+        modifiers.append('\\={')
+    if format_.verticalAlignment() == format_.AlignSubScript:
+        modifiers.append('\\textsubscript{')
+    if format_.verticalAlignment() == format_.AlignSuperScript:
+        modifiers.append('\\textsuperscript{')
+    return ''.join(modifiers), '}' * len(modifiers)
+
+
+def latexEscape(char):
+    if char in ['{', '}', '%']:
+        return '\\' + char
+    elif char == '\\':
+        return '\\textbackslash '
+    elif char == '\u00a0':
+        return ' '
+    elif char == '\u2028':
+        # Line separators (Shift+Enter) break the line like paragraphs do
+        return '\n'
+    return char
+
+
+def richTextToLatex(document):
+    """Converts the rich text in a QTextDocument to LaTeX by walking its
+    blocks and fragments. No widgets are needed, so this works headless.
+
+    Every character is wrapped in its own formatting commands, the same way
+    the text editor has always exported it."""
+    latex = []
+    block = document.begin()
+    while block.isValid():
+        if block != document.begin():
+            # Paragraph breaks pick up the format of the text that follows
+            it = block.begin()
+            if not it.atEnd():
+                format_ = it.fragment().charFormat()
+            else:
+                format_ = block.charFormat()
+            prefix, suffix = latexModifiers(format_)
+            latex.append(prefix + '\n' + suffix)
+        it = block.begin()
+        while not it.atEnd():
+            fragment = it.fragment()
+            if fragment.isValid():
+                prefix, suffix = latexModifiers(fragment.charFormat())
+                for char in fragment.text():
+                    latex.append(prefix + latexEscape(char) + suffix)
+            it += 1
+        block = block.next()
+    return ''.join(latex)
+
+
 class TextEditor(QtWidgets.QDialog):
     def __init__(self, textBox=None, **kwargs):
         super().__init__()
@@ -345,40 +405,7 @@ class TextEditor(QtWidgets.QDialog):
         return obj
 
     def exportToLatex(self):
-        cursor = self.ui.textEdit.textCursor()
-        cursor.setPosition(0)
-        latex = ''
-        while cursor.position() < len(self.ui.textEdit.toPlainText()):
-            cursor.movePosition(cursor.NextCharacter)
-            format_ = cursor.charFormat()
-            char = self.ui.textEdit.toPlainText()[cursor.position()-1]
-            modifiers = 0
-            if format_.fontWeight() == 75:
-                latex += '\\textbf{'
-                modifiers += 1
-            if format_.fontItalic() is True:
-                latex += '\\textit{'
-                modifiers += 1
-            if format_.fontUnderline() is True:
-                latex += '\\underline{'
-                modifiers += 1
-            if format_.fontOverline() is True:
-                latex += '\\={'
-                modifiers += 1
-            if format_.verticalAlignment() == format_.AlignSubScript:
-                latex += '\\textsubscript{'
-                modifiers += 1
-            if format_.verticalAlignment() == format_.AlignSuperScript:
-                latex += '\\textsuperscript{'
-                modifiers += 1
-            if char in ['{', '}', '%']:
-                char = '\\' + char
-            elif char == '\\':
-                char = '\\textbackslash '
-            latex += char
-            for i in range(modifiers):
-                latex += '}'
-        return latex
+        return richTextToLatex(self.ui.textEdit.document())
 
 
 class myFileDialog(QtWidgets.QFileDialog):
@@ -393,6 +420,8 @@ class myFileDialog(QtWidgets.QFileDialog):
         listView.setUniformItemSizes(True)
         listView.setSpacing(10)
         self.iconProvider_ = myIconProvider()
+        from src.thumbnails import IconRenderer
+        self.iconProvider_.renderer = IconRenderer(self.iconProvider_, parent=self)
         self.setIconProvider(self.iconProvider_)
         if 'mode' in kwargs:
             self.mode = kwargs['mode']
@@ -417,6 +446,12 @@ class myFileDialog(QtWidgets.QFileDialog):
         screenSize = QtWidgets.QDesktopWidget().screenGeometry(QtWidgets.QDesktopWidget().screenNumber()).size()
         self.resize(screenSize*0.8)
 
+    def done(self, result):
+        # The icon thread is waited for when the dialog is deleted, so it
+        # must not be left waiting for a preview from the GUI thread
+        self.iconProvider_.renderer.stop()
+        super().done(result)
+
 
 class myIconProvider(QtWidgets.QFileIconProvider):
     def __init__(self, parent=None):
@@ -424,6 +459,11 @@ class myIconProvider(QtWidgets.QFileIconProvider):
         super().__init__()
         self.showSchematicPreview = True
         self.showSymbolPreview = True
+        # Maximum dimension of the previews
+        self.iconSize = 320
+        # Renders previews on the GUI thread for the icon thread of a file
+        # dialog
+        self.renderer = None
 
     def icon(self, fileInfo):
         if type(fileInfo) == QtCore.QFileInfo:
@@ -434,17 +474,30 @@ class myIconProvider(QtWidgets.QFileIconProvider):
                 if self.showSymbolPreview is False:
                     return super().icon(fileInfo)
             if str(fileInfo.filePath())[-3:] in ['sch', 'sym']:
-                with open(str(fileInfo.filePath()), 'rb') as f:
+                from src.thumbnails import thumbnailCache
+                filePath = str(fileInfo.filePath())
+                try:
+                    key = thumbnailCache.key(filePath, self.iconSize)
+                except OSError:
+                    return super().icon(fileInfo)
+                pix = thumbnailCache.find(key)
+                if pix is None:
+                    # File dialogs ask for icons on a worker thread, where
+                    # files without a stored preview cannot be rendered
+                    guiThread = QtWidgets.QApplication.instance().thread()
                     try:
-                        loadItem = pickle.load(f)
+                        if QtCore.QThread.currentThread() is guiThread:
+                            image = self.iconImage(filePath)
+                        else:
+                            image = self.storedIconImage(filePath)
+                            if image is None and self.renderer is not None:
+                                image = self.renderer.render(filePath)
                     except:
+                        image = None
+                    if image is None or image.isNull():
                         return super().icon(fileInfo)
-
-                if not hasattr(loadItem, 'icon'):
-                    pix = self.createIconPixmap(loadItem)
-                else:
-                    pix = QtGui.QPixmap()
-                    pix.loadFromData(loadItem.icon, 'png')
+                    pix = QtGui.QPixmap.fromImage(image)
+                    thumbnailCache.insert(key, pix)
                 icon = QtGui.QIcon()
                 icon.addPixmap(pix)
                 return icon
@@ -454,32 +507,36 @@ class myIconProvider(QtWidgets.QFileIconProvider):
             return super().icon(fileInfo)
 
     def createIconPixmap(self, loadItem, scene=None):
+        return QtGui.QPixmap.fromImage(self.createIconImage(loadItem, scene))
+
+    def createIconImage(self, loadItem, scene=None):
+        """Renders loadItem into a QImage. Unlike pixmaps, images can be
+        painted outside the GUI thread."""
         if scene is None:
             scene = QtWidgets.QGraphicsScene()
-            # Load the file
-            loadItem.__init__(
-                None,
-                QtCore.QPointF(0, 0),
-                loadItem.listOfItems,
-                mode='symbol')
             scene.addItem(loadItem)
-        rect = loadItem.sceneBoundingRect()
+        return self.renderIconImage(scene, loadItem.sceneBoundingRect())
+
+    def renderIconImage(self, scene, rect):
+        """Renders the area rect of scene into a QImage. scene can also be a
+        SceneRecording, which can be rendered outside the GUI thread."""
         # Set the maximum icon dimension
-        maxDim = 320
+        maxDim = self.iconSize
         maxSize = QtCore.QSizeF(maxDim, maxDim)
         pixRect = QtCore.QRectF(QtCore.QPointF(), maxSize)
-        # Create a pixmap and fill it with a white background
-        pix = QtGui.QPixmap(pixRect.toRect().size())
-        pix.fill()
+        # Create an image and fill it with a white background
+        image = QtGui.QImage(
+            pixRect.toRect().size(), QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.fill(QtCore.Qt.white)
 
         # Find out the painter's starting position to have the icon drawn in the
-        # center of the pixmap
+        # center of the image
         actualSize = rect.size()
         actualSize.scale(maxSize, QtCore.Qt.KeepAspectRatio)
         width, height = actualSize.width(), actualSize.height()
         startX, startY = (maxDim - width) / 2, (maxDim - height) / 2
 
-        painter = QtGui.QPainter(pix)
+        painter = QtGui.QPainter(image)
         pen = QtGui.QPen()
         pen.setWidth(2)
         painter.setPen(pen)
@@ -487,4 +544,23 @@ class myIconProvider(QtWidgets.QFileIconProvider):
         scene.render(painter, pixRect, rect)
         painter.end()
 
-        return pix
+        return image
+
+    def iconImage(self, filePath):
+        """Returns the preview of a schematic or symbol file as a QImage,
+        rendering the file if it has no stored preview. Rendering has to
+        happen on the GUI thread."""
+        from src.fileformat import loadSchematicFile
+        image = self.storedIconImage(filePath)
+        if image is None:
+            return self.createIconImage(loadSchematicFile(filePath))
+        return image
+
+    def storedIconImage(self, filePath):
+        """Returns the preview stored in a schematic or symbol file as a
+        QImage, or None if it has none. Can be called from any thread."""
+        from src.fileformat import readIcon
+        iconData = readIcon(filePath)
+        if iconData is None:
+            return None
+        return QtGui.QImage.fromData(iconData, 'png')
@@ -0,0 +1,410 @@
+from PyQt5 import QtCore, QtGui, QtPrintSupport, QtSvg
+from .tikz import TikzWriter
+from .imagewriters import PngWriter, TiffWriter
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import logging
+import threading
+
+logger = logging.getLogger('YCircuit.export')
+
+imageFormats = ['png', 'jpg', 'bmp', 'tiff']
+exportFormats = ['pdf', 'svg', 'tex'] + imageFormats
+# Formats that can be written band by band
+tiledImageFormats = ['png', 'tiff']
+# Images with more pixels than this are rendered in bands
+maxUntiledPixels = 64 * 1024 * 1024
+# Images with fewer pixels than this are not worth splitting across threads
+minThreadedPixels = 4 * 1024 * 1024
+
+
+def exportMode(exportFormat):
+    """Returns the renderer used for a given file extension"""
+    exportFormat = exportFormat.lower()
+    if exportFormat in imageFormats:
+        return 'image'
+    if exportFormat in ['pdf', 'svg', 'tex']:
+        return exportFormat
+    raise ValueError('Unsupported export format %s' % exportFormat)
+
+
+def paddedRect(rect, whitespacePadding=1.):
+    """Grows rect by whitespacePadding about its center, in the same way as
+    the export preview does"""
+    rect = QtCore.QRectF(rect)
+    width, height = rect.width(), rect.height()
+    rect.setWidth(int(whitespacePadding * width))
+    rect.setHeight(int(whitespacePadding * height))
+    if whitespacePadding > 1:
+        width, height = rect.width(), rect.height()
+        rect.translate(-width * (whitespacePadding - 1) / (whitespacePadding * 2.),
+                       -height * (whitespacePadding - 1) / (whitespacePadding * 2.))
+    return rect
+
+
+class SceneRecording(object):
+    """A display list of part of a scene, recorded once into a QPicture.
+
+    It can be passed anywhere a scene is expected by the render functions in
+    this module, so that several targets can be produced without painting
+    the scene items again."""
+
+    def __init__(self, scene, sourceRect, picture=None):
+        self.scene = scene
+        self.sourceRect = QtCore.QRectF(sourceRect)
+        if picture is None:
+            picture = QtGui.QPicture()
+            painter = QtGui.QPainter(picture)
+            # Rendering onto an identical target rect keeps scene coordinates
+            scene.render(painter, self.sourceRect, self.sourceRect)
+            painter.end()
+            logger.info('Recorded scene area %s', self.sourceRect)
+        self.picture = picture
+
+    def items(self):
+        return self.scene.items()
+
+    def copy(self):
+        """Returns a recording with its own copy of the picture data.
+        QPicture playback reads from a shared buffer, so every thread
+        replaying a recording needs its own copy."""
+        data = QtCore.QByteArray()
+        buf = QtCore.QBuffer(data)
+        buf.open(QtCore.QIODevice.WriteOnly)
+        self.picture.save(buf)
+        buf.close()
+        buf.open(QtCore.QIODevice.ReadOnly)
+        picture = QtGui.QPicture()
+        picture.load(buf)
+        return SceneRecording(self.scene, self.sourceRect, picture)
+
+    def render(self, painter, target=QtCore.QRectF(), source=QtCore.QRectF(),
+               aspectRatioMode=QtCore.Qt.KeepAspectRatio):
+        """Replays the recording with the same semantics as
+        QGraphicsScene.render"""
+        if source.isNull():
+            source = self.sourceRect
+        if target.isNull():
+            device = painter.device()
+            target = QtCore.QRectF(0, 0, device.width(), device.height())
+        xScale = target.width() / source.width()
+        yScale = target.height() / source.height()
+        dx, dy = 0., 0.
+        if aspectRatioMode == QtCore.Qt.KeepAspectRatio:
+            xScale = yScale = min(xScale, yScale)
+        elif aspectRatioMode == QtCore.Qt.KeepAspectRatioByExpanding:
+            xScale = yScale = max(xScale, yScale)
+        if aspectRatioMode != QtCore.Qt.IgnoreAspectRatio:
+            dx = (target.width() - source.width() * xScale) / 2.
+            dy = (target.height() - source.height() * yScale) / 2.
+        painter.save()
+        painter.setClipRect(target, QtCore.Qt.IntersectClip)
+        painter.translate(target.left() + dx, target.top() + dy)
+        painter.scale(xScale, yScale)
+        painter.translate(-source.left(), -source.top())
+        # QPicture.play scales by the resolution of the target device, so
+        # undo that to keep the recording in scene coordinates
+        device = painter.device()
+        painter.scale(self.picture.logicalDpiX() / device.logicalDpiX(),
+                      self.picture.logicalDpiY() / device.logicalDpiY())
+        painter.drawPicture(0, 0, self.picture)
+        painter.restore()
+
+
+class ExportTarget(object):
+    """One output of an export plan. The format is taken from the file
+    extension unless given explicitly. sourceRect defaults to the padded
+    bounding rect of the scene."""
+
+    def __init__(self, saveFile, exportFormat=None, sourceRect=None, scaleFactor=1., **kwargs):
+        self.saveFile = saveFile
+        if exportFormat is None:
+            exportFormat = saveFile.rsplit('.', 1)[-1]
+        self.exportFormat = exportFormat.lower()
+        self.mode = exportMode(self.exportFormat)
+        self.sourceRect = sourceRect
+        self.scaleFactor = scaleFactor
+        self.options = kwargs
+
+    def __repr__(self):
+        return 'ExportTarget(%r, %r, %s, %s)' %(
+            self.saveFile, self.exportFormat, self.sourceRect, self.scaleFactor)
+
+
+def exportPlan(scene, targets, whitespacePadding=1.):
+    """Exports scene to every ExportTarget in targets.
+
+    The scene is painted once into a SceneRecording covering every requested
+    area, which is then replayed to each PDF, SVG and image target. A single
+    such target is rendered from the scene directly. TEX targets are still
+    generated from the items themselves. The caller is responsible for
+    hiding the grid, pins and selection beforehand."""
+    defaultRect = paddedRect(scene.itemsBoundingRect(), whitespacePadding)
+    recordRect = QtCore.QRectF()
+    painted = 0
+    for target in targets:
+        if target.sourceRect is None:
+            target.sourceRect = defaultRect
+        if target.mode != 'tex':
+            recordRect = recordRect.united(target.sourceRect)
+            painted += 1
+    recording = scene
+    if painted > 1:
+        recording = SceneRecording(scene, recordRect)
+    for target in targets:
+        renderScene(
+            recording,
+            target.saveFile,
+            target.exportFormat,
+            target.sourceRect,
+            scaleFactor=target.scaleFactor,
+            **target.options)
+    return [target.saveFile for target in targets]
+
+
+def renderPdf(scene, saveFile, sourceRect):
+    """Renders sourceRect of scene to a PDF page of the same size"""
+    width, height = int(sourceRect.width()), int(sourceRect.height())
+    printer = QtPrintSupport.QPrinter(QtPrintSupport.QPrinter.HighResolution)
+    printer.setOutputFormat(printer.PdfFormat)
+    printer.setOutputFileName(saveFile)
+    printer.setFullPage(True)
+    pageSize = QtGui.QPageSize(QtCore.QSize(width, height), matchPolicy=QtGui.QPageSize.ExactMatch)
+    printer.setPageSize(pageSize)
+    painter = QtGui.QPainter(printer)
+    scene.render(painter, source=sourceRect)
+    # Need to stop painting to avoid errors about painter getting deleted
+    painter.end()
+    logger.info('Rendering PDF')
+
+
+def renderSvg(scene, saveFile, sourceRect):
+    """Renders sourceRect of scene to an SVG file"""
+    width, height = int(sourceRect.width()), int(sourceRect.height())
+    svgGenerator = QtSvg.QSvgGenerator()
+    svgGenerator.setFileName(saveFile)
+    svgGenerator.setSize(QtCore.QSize(width, height))
+    svgGenerator.setResolution(96)
+    svgGenerator.setViewBox(QtCore.QRect(0, 0, width, height))
+    painter = QtGui.QPainter(svgGenerator)
+    scene.render(painter, source=sourceRect)
+    painter.end()
+    logger.info('Rendering SVG')
+
+
+def imageSize(sourceRect, scaleFactor):
+    return int(scaleFactor * sourceRect.width()), int(scaleFactor * sourceRect.height())
+
+
+def defaultThreadCount(width, height):
+    """Uses every core for large images and a single thread otherwise"""
+    if width * height < minThreadedPixels:
+        return 1
+    return max(1, QtCore.QThread.idealThreadCount())
+
+
+def rasterize(scene, sourceRect, width, height, transparentBackground=False, threads=1):
+    """Renders sourceRect of scene into a width x height QImage. With more
+    than one thread the image is split into bands that are rendered
+    concurrently and then composited."""
+    # Create an image object
+    img = QtGui.QImage(
+        QtCore.QSize(width, height),
+        QtGui.QImage.Format_ARGB32_Premultiplied)
+    # Set background to white if required
+    if transparentBackground is False:
+        img.fill(QtGui.QColor('white'))
+        logger.info('Setting exported background to white')
+    else:
+        img.fill(QtCore.Qt.transparent)
+    painter = QtGui.QPainter(img)
+    if threads > 1:
+        # A few bands per thread keeps the threads busy when the drawing is
+        # denser in some places than others
+        tileHeight = max(1, -(-height // (4 * threads)))
+        painter.setCompositionMode(painter.CompositionMode_Source)
+        for top, band in rasterBands(
+                scene, sourceRect, width, height, tileHeight, transparentBackground, threads):
+            painter.drawImage(0, top, band)
+    else:
+        setImageRenderHints(painter)
+        scene.render(painter, QtCore.QRectF(img.rect()), sourceRect)
+    painter.end()
+    return img
+
+
+def renderImage(scene, saveFile, sourceRect, imageFormat='png', scaleFactor=1.,
+                quality=None, transparentBackground=False, tileHeight=None, threads=None):
+    """Renders sourceRect of scene to an image scaled up by scaleFactor.
+
+    PNG and TIFF images are rendered in horizontal bands of tileHeight rows
+    when tileHeight is given or the image would be larger than
+    maxUntiledPixels. threads defaults to one per core for large images."""
+    width, height = imageSize(sourceRect, scaleFactor)
+    if threads is None:
+        threads = defaultThreadCount(width, height)
+    if imageFormat in tiledImageFormats:
+        if tileHeight is None and width * height > maxUntiledPixels:
+            tileHeight = 512
+        if tileHeight is not None:
+            return renderImageTiled(
+                scene, saveFile, sourceRect, imageFormat, scaleFactor,
+                transparentBackground, tileHeight, threads)
+    elif width * height > maxUntiledPixels:
+        logger.warning('%s export cannot be tiled, allocating a %dx%d image',
+                       imageFormat.upper(), width, height)
+    img = rasterize(scene, sourceRect, width, height, transparentBackground, threads)
+    if quality is None:
+        quality = -1
+    img.save(saveFile, imageFormat, quality=quality)
+    logger.info('Rendering %s to a %dx%d image using %d threads',
+                imageFormat.upper(), width, height, threads)
+
+
+def setImageRenderHints(painter):
+    painter.setRenderHint(painter.SmoothPixmapTransform, True)
+    painter.setRenderHint(painter.Antialiasing, True)
+    painter.setRenderHint(painter.TextAntialiasing, True)
+
+
+def renderBand(scene, sourceRect, width, height, top, bandHeight, transparentBackground=False):
+    """Renders rows top to top + bandHeight of a width x height image of
+    sourceRect and returns them as a QImage"""
+    img = QtGui.QImage(
+        QtCore.QSize(width, bandHeight),
+        QtGui.QImage.Format_ARGB32_Premultiplied)
+    if transparentBackground is False:
+        img.fill(QtGui.QColor('white'))
+    else:
+        img.fill(QtCore.Qt.transparent)
+    yScale = height / sourceRect.height()
+    bandSource = QtCore.QRectF(
+        sourceRect.left(),
+        sourceRect.top() + top / yScale,
+        sourceRect.width(),
+        bandHeight / yScale)
+    painter = QtGui.QPainter(img)
+    setImageRenderHints(painter)
+    scene.render(painter, QtCore.QRectF(img.rect()), bandSource, QtCore.Qt.IgnoreAspectRatio)
+    painter.end()
+    return img
+
+
+def bandRows(img, alpha=True):
+    """Yields the rows of img as packed RGB(A) bytes"""
+    if alpha is True:
+        img = img.convertToFormat(QtGui.QImage.Format_RGBA8888)
+        rowLength = img.width() * 4
+    else:
+        img = img.convertToFormat(QtGui.QImage.Format_RGB888)
+        rowLength = img.width() * 3
+    bytesPerLine = img.bytesPerLine()
+    bits = img.constBits()
+    bits.setsize(bytesPerLine * img.height())
+    data = bits.asstring()
+    for row in range(img.height()):
+        yield data[row * bytesPerLine:row * bytesPerLine + rowLength]
+
+
+def rasterBands(scene, sourceRect, width, height, tileHeight, transparentBackground=False, threads=1):
+    """Yields (top, QImage) for each band of tileHeight rows, in order.
+
+    Scene items must only be painted from the GUI thread, so for more than
+    one thread the scene is first recorded into a SceneRecording, which each
+    worker then replays into its own band. At most two bands per thread are
+    in flight at any time to keep memory bounded."""
+    tops = list(range(0, height, tileHeight))
+    if threads <= 1 or len(tops) == 1:
+        for top in tops:
+            yield top, renderBand(
+                scene, sourceRect, width, height, top,
+                min(tileHeight, height - top), transparentBackground)
+        return
+    if not isinstance(scene, SceneRecording):
+        scene = SceneRecording(scene, sourceRect)
+    local = threading.local()
+
+    def work(top):
+        if not hasattr(local, 'recording'):
+            local.recording = scene.copy()
+        return renderBand(
+            local.recording, sourceRect, width, height, top,
+            min(tileHeight, height - top), transparentBackground)
+
+    with ThreadPoolExecutor(threads) as executor:
+        pending = collections.deque()
+        for top in tops:
+            pending.append((top, executor.submit(work, top)))
+            if len(pending) >= 2 * threads:
+                top, future = pending.popleft()
+                yield top, future.result()
+        while pending:
+            top, future = pending.popleft()
+            yield top, future.result()
+
+
+def renderImageTiled(scene, saveFile, sourceRect, imageFormat='png', scaleFactor=1.,
+                     transparentBackground=False, tileHeight=512, threads=1):
+    """Renders sourceRect of scene in bands of tileHeight rows and streams
+    them into a PNG or TIFF file. Only a few bands are held in memory at a
+    time."""
+    width, height = imageSize(sourceRect, scaleFactor)
+    alpha = transparentBackground is not False
+    if imageFormat == 'png':
+        writer = PngWriter(saveFile, width, height, alpha)
+    elif imageFormat == 'tiff':
+        writer = TiffWriter(saveFile, width, height, alpha, rowsPerStrip=min(tileHeight, 64))
+    else:
+        raise ValueError('Tiled export does not support %s' % imageFormat)
+    with writer:
+        for top, img in rasterBands(
+                scene, sourceRect, width, height, tileHeight, transparentBackground, threads):
+            writer.writeRows(bandRows(img, alpha))
+    logger.info('Rendering %s in bands of %d rows to a %dx%d image using %d threads',
+                imageFormat.upper(), tileHeight, width, height, threads)
+
+
+def renderTex(itemsToExport, saveFile, sourceRect, scaleFactor=1., exportArea='full'):
+    """Streams the top level items in itemsToExport to saveFile as a TikZ
+    picture"""
+    clipRect = sourceRect if exportArea == 'visible' else None
+    with open(saveFile, 'w') as f:
+        TikzWriter(f, scaleFactor, clipRect).write(itemsToExport)
+    logger.info('Writing TEX file')
+
+
+def renderScene(scene, saveFile, exportFormat, sourceRect, **kwargs):
+    """Exports sourceRect of scene to saveFile in the given format.
+
+    Recognised keyword arguments are scaleFactor, quality,
+    transparentBackground, tileHeight and threads (images only), exportArea and
+    itemsToExport (TEX only)."""
+    mode = exportMode(exportFormat)
+    scaleFactor = kwargs.get('scaleFactor', 1.)
+    logger.info('Exporting to file %s', saveFile)
+    logger.info('Source rectangle set to %s', sourceRect)
+    if mode == 'pdf':
+        renderPdf(scene, saveFile, sourceRect)
+    elif mode == 'svg':
+        renderSvg(scene, saveFile, sourceRect)
+    elif mode == 'image':
+        renderImage(
+            scene,
+            saveFile,
+            sourceRect,
+            exportFormat.lower(),
+            scaleFactor,
+            kwargs.get('quality'),
+            kwargs.get('transparentBackground', False),
+            kwargs.get('tileHeight'),
+            kwargs.get('threads'))
+    elif mode == 'tex':
+        itemsToExport = kwargs.get('itemsToExport')
+        if itemsToExport is None:
+            itemsToExport = scene.items()
+        renderTex(
+            itemsToExport,
+            saveFile,
+            sourceRect,
+            scaleFactor,
+            kwargs.get('exportArea', 'full'))
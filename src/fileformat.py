@@ -0,0 +1,930 @@
+"""Compact, versioned file format for schematics and symbols.
+
+Older files are a pickle of the top level myGraphicsItemGroup. Loading one
+unpickles live Qt objects and then replays every constructor through
+myGraphicsItemGroup.loadItems. Files in this format hold plain data instead
+and are built into items in a single pass.
+
+Layout (all integers little endian):
+
+    magic            8 bytes, b'YCIRCUIT'
+    version          uint16
+    section count    uint16
+    section table    section count entries of
+                         tag     4 bytes
+                         offset  uint64, from the start of the file
+                         length  uint64
+    sections         the section data
+
+Sections:
+
+    META    UTF-8 JSON object {"bbox": [x, y, w, h], "pins": count, "items":
+            {class name: count}} describing the top level group, so that
+            file browsers do not have to build the scene.
+    ICON    PNG preview of the file, stored as is.
+    BODY    zlib compressed UTF-8 JSON object {"root": index, "items": [...]}.
+            Each item record is {"t": class name, "a": attributes, "c": child
+            indices}. Children are listed before their parents, so the root is
+            always the last record. Attributes are the pickled state of the
+            item, minus the parent and child references. The icon of the root
+            is kept in ICON instead. Symbols placed in
+            the schematic are instance records {"t", "a", "d": definition
+            index} that only hold the transform, position and other
+            attributes of the group itself. Junction records only hold
+            their origin and the options that differ from the defaults.
+    SYMS    zlib compressed UTF-8 JSON list of symbol definitions. Each is
+            {"path": library file or null, "hash": content hash, "c": child
+            indices, "items": [...]}, where items are records as in BODY
+            and indices refer to the items of the definition. A definition
+            is stored once for every distinct (path, hash) pair.
+    BLOB    Raw binary data (icons, images, rendered LaTeX) referenced from
+            BODY and SYMS as {"B": [offset, length]} or {"IO": [offset,
+            length]}. Identical data is only stored once.
+
+Attribute values are JSON scalars and lists, or single key objects that
+describe Qt values. No other object in BODY or SYMS has exactly one key.
+
+    {"P": [x, y]}                       QPointF
+    {"Pi": [x, y]}                      QPoint
+    {"R": [x, y, w, h]}                 QRectF
+    {"Ri": [x, y, w, h]}                QRect
+    {"L": [x1, y1, x2, y2]}             QLineF
+    {"S": [w, h]}                       QSizeF
+    {"Si": [w, h]}                      QSize
+    {"T": [m11, m12, ..., m33]}         QTransform
+    {"C": "#aarrggbb"}                  QColor
+    {"F": "font description"}           QFont
+    {"PP": [[point, ...], ...]}         QPainterPath, as subpath polygons
+    {"I": index}                        Reference to another item record
+    {"tuple": [...]}                    tuple
+    {"dict": [[key, value], ...]}       dict
+
+META and ICON come before the other sections, so both can be read with a
+few small reads from the start of the file (see readSections).
+
+Readers must ignore sections they do not recognise. The version only
+changes when existing sections change meaning. Junction dots that older
+files hold as instances of Dot.sym are converted to Junction items on load.
+"""
+from PyQt5 import QtCore, QtGui, QtWidgets
+from . import components
+from .components import myGraphicsItemGroup
+from collections import OrderedDict
+from io import BytesIO
+import hashlib
+import json
+import logging
+import os
+import pickle
+import struct
+import sys
+import zlib
+
+logger = logging.getLogger('YCircuit.fileformat')
+
+MAGIC = b'YCIRCUIT'
+VERSION = 1
+headerFormat = '<8sHH'
+sectionFormat = '<4sQQ'
+
+# Only these classes can be created when loading a file
+itemClasses = {
+    cls.__name__: cls for cls in [
+        components.myGraphicsItemGroup,
+        components.Wire,
+        components.Net,
+        components.Rectangle,
+        components.Ellipse,
+        components.Circle,
+        components.Junction,
+        components.TextBox,
+        components.Arc,
+        components.Image]}
+
+# Attributes that are rebuilt from the structure of the file
+structuralAttributes = ['listOfItems', 'pins', 'parent']
+
+
+class FileFormatError(Exception):
+    pass
+
+
+def isSchematicFile(data):
+    """Returns True if data starts with the header of this format"""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def packSections(sections):
+    """Returns the bytes of a file holding sections, a list of
+    (tag, data) tuples"""
+    headerSize = struct.calcsize(headerFormat)
+    entrySize = struct.calcsize(sectionFormat)
+    offset = headerSize + entrySize * len(sections)
+    table = []
+    for tag, data in sections:
+        table.append(struct.pack(sectionFormat, tag, offset, len(data)))
+        offset += len(data)
+    header = struct.pack(headerFormat, MAGIC, VERSION, len(sections))
+    return b''.join([header] + table + [data for tag, data in sections])
+
+
+def unpackSections(data):
+    """Returns a dictionary mapping section tags to their data"""
+    if not isSchematicFile(data):
+        raise FileFormatError('Not a YCircuit file')
+    headerSize = struct.calcsize(headerFormat)
+    entrySize = struct.calcsize(sectionFormat)
+    magic, version, count = struct.unpack_from(headerFormat, data)
+    if version > VERSION:
+        raise FileFormatError('File version %d is newer than %d' % (version, VERSION))
+    sections = {}
+    for i in range(count):
+        tag, offset, length = struct.unpack_from(
+            sectionFormat, data, headerSize + i*entrySize)
+        if offset + length > len(data):
+            raise FileFormatError('Section %r is truncated' % tag)
+        sections[tag] = data[offset:offset + length]
+    return sections
+
+
+def sectionsEnd(data):
+    """Returns the offset just past the last section of data. Anything
+    after it is not part of the file itself, eg. an autobackup journal."""
+    if not isSchematicFile(data):
+        raise FileFormatError('Not a YCircuit file')
+    headerSize = struct.calcsize(headerFormat)
+    entrySize = struct.calcsize(sectionFormat)
+    magic, version, count = struct.unpack_from(headerFormat, data)
+    end = headerSize + count*entrySize
+    for i in range(count):
+        tag, offset, length = struct.unpack_from(
+            sectionFormat, data, headerSize + i*entrySize)
+        end = max(end, offset + length)
+    return end
+
+
+class BlobWriter(object):
+    """Collects the BLOB section. Identical data is only stored once, so
+    every symbol instance can share the same icon."""
+
+    def __init__(self):
+        self.blob = []
+        self.blobSize = 0
+        self.offsets = {}
+        self.digests = {}
+
+    def addBlob(self, data):
+        if data not in self.offsets:
+            self.offsets[data] = self.blobSize
+            self.digests[self.blobSize] = hashlib.sha1(data).hexdigest()
+            self.blob.append(data)
+            self.blobSize += len(data)
+        return [self.offsets[data], len(data)]
+
+    def data(self):
+        return b''.join(self.blob)
+
+
+class SymbolTable(object):
+    """Symbol definitions keyed by library path and content hash. Every
+    distinct definition is encoded once and shared by all of its
+    instances."""
+
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.definitions = []
+        self.indices = {}
+        self.shared = {}
+
+    def addSymbol(self, group):
+        """Returns the index of the definition matching the children of
+        group, adding a new definition if there is none"""
+        path = getattr(group, 'symbolFile', None)
+        if group.definition is not None:
+            # Instances drawn from one shared definition have equal children
+            key = (id(group.definition), path)
+            if key not in self.shared:
+                self.shared[key] = self.encodeSymbol(group, path)
+            return self.shared[key]
+        return self.encodeSymbol(group, path)
+
+    def encodeSymbol(self, group, path):
+        encoder = Encoder(self.blobs)
+        children = [encoder.encodeTree(item) for item in group.contentItems()]
+        records = encoder.encodeRecords()
+        key = (path, self.contentHash(children, records))
+        if key not in self.indices:
+            self.indices[key] = len(self.definitions)
+            self.definitions.append(
+                {'path': path, 'hash': key[1], 'c': children, 'items': records})
+        return self.indices[key]
+
+    def contentHash(self, children, records):
+        """Hashes the definition with blob references replaced by the hash of
+        their data, so the result does not depend on where the data is
+        stored in the file"""
+        def replaceBlobs(value):
+            if isinstance(value, list):
+                return [replaceBlobs(item) for item in value]
+            if isinstance(value, dict):
+                if len(value) == 1 and ('B' in value or 'IO' in value):
+                    tag, (offset, length) = next(iter(value.items()))
+                    return {tag: self.blobs.digests[offset]}
+                return {key: replaceBlobs(item) for key, item in value.items()}
+            return value
+        content = json.dumps(
+            [children, replaceBlobs(records)], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class Encoder(object):
+    """Turns a tree of items into item records, storing binary data in
+    blobs. If symbols is a SymbolTable, the top level groups below the root
+    are stored as instances of its definitions. omit maps items to the
+    attributes of theirs that are stored elsewhere, and overrides maps
+    items to attribute values that replace their own."""
+
+    def __init__(self, blobs, symbols=None, omit=None, overrides=None):
+        self.blobs = blobs
+        self.symbols = symbols
+        self.omit = omit if omit is not None else {}
+        self.overrides = overrides if overrides is not None else {}
+        self.records = []
+        self.indices = {}
+
+    def encodeTree(self, root, items=None):
+        """Numbers every item below root, children first, and returns the
+        index of root. If items is given, they are stored as the children
+        of root instead of its own."""
+        children = []
+        if items is None and isinstance(root, myGraphicsItemGroup):
+            items = root.contentItems()
+        if items is not None:
+            for item in items:
+                children.append(self.encodeItem(item))
+        index = len(self.records)
+        self.indices[id(root)] = index
+        self.records.append((root, children, None))
+        return index
+
+    def encodeItem(self, item):
+        """Numbers a top level item, storing groups as instances if there
+        is a symbol table, and returns its index"""
+        if self.symbols is not None and isinstance(item, myGraphicsItemGroup):
+            return self.encodeInstance(item)
+        return self.encodeTree(item)
+
+    def encodeInstance(self, group):
+        definition = self.symbols.addSymbol(group)
+        index = len(self.records)
+        self.indices[id(group)] = index
+        self.records.append((group, None, definition))
+        return index
+
+    def encodeRecords(self):
+        records = []
+        for item, children, definition in self.records:
+            state = item.__getstate__()
+            if item in self.overrides:
+                state.update(self.overrides[item])
+            omit = self.omit.get(item, [])
+            attributes = {}
+            for key, value in state.items():
+                if key in structuralAttributes or key in omit:
+                    continue
+                if definition is not None and key == 'symbolFile':
+                    continue
+                try:
+                    attributes[key] = self.encodeValue(value)
+                except TypeError:
+                    logger.warning('Not saving attribute %s of %s', key, item)
+            record = {'t': type(item).__name__, 'a': attributes}
+            if definition is not None:
+                record['d'] = definition
+            elif isinstance(item, myGraphicsItemGroup):
+                record['c'] = children
+            records.append(record)
+        return records
+
+    def encodeValue(self, value):
+        if value is None or isinstance(value, (bool, str)):
+            return value
+        if isinstance(value, int):
+            # Also covers Qt enums
+            return int(value)
+        if isinstance(value, float):
+            return value
+        if isinstance(value, list):
+            return [self.encodeValue(item) for item in value]
+        if isinstance(value, tuple):
+            return {'tuple': [self.encodeValue(item) for item in value]}
+        if isinstance(value, dict):
+            return {'dict': [[self.encodeValue(key), self.encodeValue(item)]
+                             for key, item in value.items()]}
+        if isinstance(value, QtCore.QPointF):
+            return {'P': [value.x(), value.y()]}
+        if isinstance(value, QtCore.QPoint):
+            return {'Pi': [value.x(), value.y()]}
+        if isinstance(value, QtCore.QRectF):
+            return {'R': [value.x(), value.y(), value.width(), value.height()]}
+        if isinstance(value, QtCore.QRect):
+            return {'Ri': [value.x(), value.y(), value.width(), value.height()]}
+        if isinstance(value, QtCore.QLineF):
+            return {'L': [value.x1(), value.y1(), value.x2(), value.y2()]}
+        if isinstance(value, QtCore.QSizeF):
+            return {'S': [value.width(), value.height()]}
+        if isinstance(value, QtCore.QSize):
+            return {'Si': [value.width(), value.height()]}
+        if isinstance(value, QtGui.QTransform):
+            return {'T': [
+                value.m11(), value.m12(), value.m13(),
+                value.m21(), value.m22(), value.m23(),
+                value.m31(), value.m32(), value.m33()]}
+        if isinstance(value, QtGui.QColor):
+            return {'C': value.name(QtGui.QColor.HexArgb)}
+        if isinstance(value, QtGui.QFont):
+            return {'F': value.toString()}
+        if isinstance(value, QtGui.QPainterPath):
+            return {'PP': [[self.encodeValue(poly.at(i)) for i in range(poly.count())]
+                           for poly in value.toSubpathPolygons(QtGui.QTransform())]}
+        if isinstance(value, QtCore.QByteArray):
+            return {'B': self.blobs.addBlob(bytes(value))}
+        if isinstance(value, BytesIO):
+            return {'IO': self.blobs.addBlob(value.getvalue())}
+        if isinstance(value, QtWidgets.QGraphicsItem):
+            # Only references to items in the file can be kept
+            return {'I': self.indices.get(id(value))}
+        raise TypeError('Cannot encode %r' % (value,))
+
+
+def countItems(item, counts):
+    """Adds the number of items of each class below item to counts and
+    returns the number of pins among them"""
+    name = type(item).__name__
+    counts[name] = counts.get(name, 0) + 1
+    pins = 0
+    if hasattr(item, 'isPin') and item.isPin is True:
+        pins += 1
+    if isinstance(item, myGraphicsItemGroup):
+        for child in item.contentItems():
+            pins += countItems(child, counts)
+    return pins
+
+
+def encodeMetadata(root, items=None):
+    """Describes root, or root holding items if they are given"""
+    if items is None:
+        rect = root.boundingRect()
+        items = root.contentItems()
+    else:
+        rect = QtCore.QRectF()
+        for item in items:
+            rect = rect.united(item.sceneBoundingRect())
+        rect.translate(-root.pos())
+    counts = {}
+    pins = 0
+    for item in items:
+        pins += countItems(item, counts)
+    metadata = {
+        'bbox': [rect.x(), rect.y(), rect.width(), rect.height()],
+        'pins': pins,
+        'items': counts}
+    return json.dumps(metadata, separators=(',', ':')).encode('utf-8')
+
+
+class Snapshot(object):
+    """The contents of a file, taken from the items as plain data. Taking a
+    snapshot has to happen on the GUI thread, but encode no longer touches
+    any item and can run on a worker thread.
+
+    If items is given, they are stored as the children of root without
+    being reparented, with their origins relative to the position of
+    root. Otherwise root and its own children are stored."""
+
+    def __init__(self, root, items=None):
+        blobs = BlobWriter()
+        symbols = SymbolTable(blobs)
+        overrides = {}
+        if items is not None:
+            overrides = {item: {'origin': item.pos() - root.pos()} for item in items}
+        encoder = Encoder(blobs, symbols, omit={root: ['icon']}, overrides=overrides)
+        rootIndex = encoder.encodeTree(root, items)
+        self.body = {'root': rootIndex, 'items': encoder.encodeRecords()}
+        self.definitions = symbols.definitions
+        self.metadata = encodeMetadata(root, items)
+        icon = getattr(root, 'icon', None)
+        self.icon = bytes(icon) if icon is not None else None
+        self.blobs = blobs
+
+    def encode(self):
+        """Returns the bytes of the file"""
+        body = json.dumps(self.body, separators=(',', ':')).encode('utf-8')
+        definitions = json.dumps(self.definitions, separators=(',', ':')).encode('utf-8')
+        sections = [(b'META', self.metadata)]
+        if self.icon is not None:
+            sections.append((b'ICON', self.icon))
+        sections += [
+            (b'BODY', zlib.compress(body)),
+            (b'SYMS', zlib.compress(definitions)),
+            (b'BLOB', self.blobs.data())]
+        return packSections(sections)
+
+
+def encodeItems(root):
+    """Returns the bytes of a file holding root and all of its children.
+    root should be set up the way saveRoutine sets up its save object."""
+    return Snapshot(root).encode()
+
+
+def writeSchematicFile(fileName, root):
+    data = encodeItems(root)
+    with open(fileName, 'wb') as file:
+        file.write(data)
+
+
+class ItemReference(object):
+    """Placeholder for a reference to an item that may not be built yet"""
+    __slots__ = ['index']
+
+    def __init__(self, index):
+        self.index = index
+
+
+def fontFromString(description):
+    font = QtGui.QFont()
+    font.fromString(description)
+    return font
+
+
+def pathFromPolygons(polygons):
+    path = QtGui.QPainterPath()
+    for poly in polygons:
+        path.addPolygon(QtGui.QPolygonF(poly))
+    return path
+
+
+valueDecoders = {
+    'P': lambda data: QtCore.QPointF(*data),
+    'Pi': lambda data: QtCore.QPoint(*data),
+    'R': lambda data: QtCore.QRectF(*data),
+    'Ri': lambda data: QtCore.QRect(*data),
+    'L': lambda data: QtCore.QLineF(*data),
+    'S': lambda data: QtCore.QSizeF(*data),
+    'Si': lambda data: QtCore.QSize(*data),
+    'T': lambda data: QtGui.QTransform(*data),
+    'C': QtGui.QColor,
+    'F': fontFromString,
+    'PP': pathFromPolygons,
+    'I': ItemReference,
+    'tuple': tuple,
+    'dict': dict}
+
+
+class RecordScope(object):
+    """Item records that child indices and item references point into.
+    Records of symbol definitions are shared by all instances, so they are
+    decoded again for every instance instead of being used in place."""
+
+    def __init__(self, records, shared=False):
+        self.records = records
+        self.shared = shared
+        self.items = {}
+
+
+class Decoder(object):
+    """Builds items from the records of a file"""
+
+    def __init__(self, blob):
+        self.blob = blob
+        self.scope = None
+        self.definitions = []
+        self.sharedDefinitions = {}
+        # References to items that may be built later in the pass
+        self.pendingReferences = []
+
+    def decodeObject(self, obj):
+        """Used as the JSON object hook, so values are converted while the
+        body is parsed. Tagged values are the only single key objects."""
+        if len(obj) != 1:
+            return obj
+        tag, data = next(iter(obj.items()))
+        if tag in valueDecoders:
+            return valueDecoders[tag](data)
+        if tag == 'B':
+            offset, length = data
+            return QtCore.QByteArray(self.blob[offset:offset + length])
+        if tag == 'IO':
+            offset, length = data
+            return BytesIO(self.blob[offset:offset + length])
+        return obj
+
+    def decodeValue(self, value):
+        """Converts a value of a symbol definition that was parsed without
+        the object hook"""
+        if isinstance(value, list):
+            return [self.decodeValue(item) for item in value]
+        if isinstance(value, dict):
+            return self.decodeObject(
+                {key: self.decodeValue(item) for key, item in value.items()})
+        return value
+
+    def parseBody(self, body):
+        body = json.loads(body.decode('utf-8'), object_hook=self.decodeObject)
+        self.scope = RecordScope(body['items'])
+        return body['root']
+
+    def parseSymbols(self, symbols):
+        """The definitions are parsed once. Their values are converted for
+        each instance in createItem."""
+        self.definitions = json.loads(symbols.decode('utf-8'))
+
+    def createItem(self, index, scope):
+        """Returns the item of record index with its state restored, but
+        without calling its constructor"""
+        record = scope.records[index]
+        if record['t'] not in itemClasses:
+            raise FileFormatError('Unknown item type %s' % record['t'])
+        cls = itemClasses[record['t']]
+        item = cls.__new__(cls)
+        if scope.shared is True:
+            state = {key: self.decodeValue(value) for key, value in record['a'].items()}
+        else:
+            state = record['a']
+        for key, value in state.items():
+            if isinstance(value, ItemReference):
+                self.pendingReferences.append((item, key, value.index, scope))
+                state[key] = None
+            elif type(value) is str and len(value) < 32:
+                # Colours and modes repeat across items, so share them
+                state[key] = sys.intern(value)
+        item.__setstate__(state)
+        scope.items[index] = item
+        return item
+
+    def buildItem(self, index, parent, start=None, scope=None):
+        """Creates the item of record index and, for groups, all of its
+        children. This does what myGraphicsItemGroup.loadItems does after
+        unpickling, in one pass."""
+        if scope is None:
+            scope = self.scope
+        item = self.createItem(index, scope)
+        if start is None:
+            start = item.origin
+        if not isinstance(item, myGraphicsItemGroup):
+            # Files from before cap and join styles were saved
+            item.__dict__.setdefault('localPenCapStyle', 0x10)
+            item.__dict__.setdefault('localPenJoinStyle', 0x80)
+            item.__init__(
+                parent,
+                start,
+                penColour=item.localPenColour,
+                width=item.localPenWidth,
+                penStyle=item.localPenStyle,
+                penCapStyle=item.localPenCapStyle,
+                penJoinStyle=item.localPenJoinStyle,
+                brushColour=item.localBrushColour,
+                brushStyle=item.localBrushStyle)
+            return item
+        record = scope.records[index]
+        if 'd' in record:
+            # Symbol instance
+            if not 0 <= record['d'] < len(self.definitions):
+                raise FileFormatError('Unknown symbol definition %s' % record['d'])
+            definition = self.definitions[record['d']]
+            if definition['path'] is not None:
+                item.symbolFile = definition['path']
+            shared = self.sharedDefinition(record['d'])
+            if shared is not None:
+                item.__init__(parent, start, [])
+                item.definition = shared
+                pins = shared.createPins()
+                item.setItems(pins)
+                item.pins = pins
+                return item
+            childScope = RecordScope(definition['items'], shared=True)
+            childIndices = definition['c']
+        else:
+            childScope = scope
+            childIndices = record['c']
+        # Children are added after the group is set up
+        item.__init__(parent, start, [])
+        children = [
+            self.buildItem(child, item, scope=childScope) for child in childIndices]
+        item.setItems(children)
+        item.pins = [
+            child for child in children
+            if hasattr(child, 'isPin') and child.isPin is True]
+        return item
+
+    def sharedDefinition(self, index):
+        """Returns the SymbolDefinition that the instances of definition
+        index are drawn from, or None if they need their own items"""
+        if index not in self.sharedDefinitions:
+            definition = self.definitions[index]
+            template = myGraphicsItemGroup(None, QtCore.QPointF(0, 0), [])
+            scope = RecordScope(definition['items'], shared=True)
+            children = [
+                self.buildItem(child, template, scope=scope) for child in definition['c']]
+            template.setItems(children)
+            template.pins = [
+                child for child in children
+                if hasattr(child, 'isPin') and child.isPin is True]
+            shared = components.SymbolDefinition(template)
+            if shareDefinitions is False or shared.shareable is False:
+                shared = None
+            self.sharedDefinitions[index] = shared
+        return self.sharedDefinitions[index]
+
+    def resolveReferences(self):
+        for owner, key, index, scope in self.pendingReferences:
+            setattr(owner, key, scope.items.get(index))
+
+
+def decodeItems(data, start=None):
+    """Builds the items stored in data and returns the top level group. The
+    group is in the same state as an unpickled one after
+    loadItem.__init__(None, start, loadItem.listOfItems, mode='symbol')"""
+    if start is None:
+        start = QtCore.QPointF(0, 0)
+    sections = unpackSections(data)
+    if b'BODY' not in sections:
+        raise FileFormatError('File has no BODY section')
+    decoder = Decoder(sections.get(b'BLOB', b''))
+    if b'SYMS' in sections:
+        decoder.parseSymbols(zlib.decompress(sections[b'SYMS']))
+    rootIndex = decoder.parseBody(zlib.decompress(sections[b'BODY']))
+    root = decoder.buildItem(rootIndex, None, start)
+    decoder.resolveReferences()
+    if b'ICON' in sections:
+        root.icon = QtCore.QByteArray(sections[b'ICON'])
+    return root
+
+
+def symbolPath(fileName):
+    """Returns the path a symbol is recorded under in the symbol table.
+    Library symbols are usually inside the working directory, so their path
+    is kept relative to it where possible."""
+    fileName = os.path.abspath(fileName)
+    relativePath = os.path.relpath(fileName)
+    if relativePath.startswith('..'):
+        return fileName.replace(os.sep, '/')
+    return relativePath.replace(os.sep, '/')
+
+
+def isDotSymbol(path):
+    return path is not None and path.replace('\\', '/').endswith('Symbols/Standard/Dot.sym')
+
+
+def dotCircle(group):
+    """Returns the circle of group if group is an instance of the dot
+    symbol, or None. Files written before instances remembered their symbol
+    file do not say which groups are dots, so those are recognised by their
+    single filled circle."""
+    if not isinstance(group, myGraphicsItemGroup):
+        return None
+    children = group.contentItems()
+    if len(children) != 1 or not isinstance(children[0], components.Circle):
+        return None
+    circle = children[0]
+    if isDotSymbol(getattr(group, 'symbolFile', None)):
+        return circle
+    if not hasattr(group, 'symbolFile') and circle.localBrushStyle == 1 and \
+            circle.oldRect == QtCore.QRectF(0, -4, 8, 8):
+        return circle
+    return None
+
+
+def convertDots(root):
+    """Replaces the instances of the dot symbol among the children of root
+    with junctions at the centres of their circles"""
+    converted = 0
+    items = []
+    for item in root.listOfItems:
+        circle = dotCircle(item)
+        if circle is None:
+            items.append(item)
+            continue
+        centre = item.mapToParent(circle.mapToParent(circle.rect().center()))
+        junction = components.Junction(
+            None,
+            centre,
+            width=circle.localPenWidth,
+            penColour=circle.localPenColour,
+            brushColour=circle.localBrushColour)
+        junction.origin = centre
+        item.setParentItem(None)
+        items.append(junction)
+        converted += 1
+    if converted > 0:
+        logger.info('Converted %d dot symbols to junctions', converted)
+        root.setItems(items)
+
+
+# Value types that are copied with their copy constructor
+copiedTypes = (
+    QtCore.QPointF, QtCore.QPoint, QtCore.QRectF, QtCore.QRect, QtCore.QLineF,
+    QtCore.QSizeF, QtCore.QSize, QtGui.QTransform, QtGui.QColor, QtGui.QFont,
+    QtGui.QPainterPath, QtCore.QByteArray)
+# Most attributes are of these types and can be shared between copies
+immutableTypes = frozenset([bool, int, float, str, type(None)])
+
+
+class ItemCopier(object):
+    """Copies the state of a tree of items into records that a Decoder can
+    build new items from. Values are copied directly instead of going
+    through their file form."""
+
+    def __init__(self):
+        self.items = []
+        self.indices = {}
+        self.definitions = []
+
+    def numberTree(self, root, definition=None):
+        """Numbers every item below root, children first, and returns the
+        index of root. Groups drawn from a shared definition only have their
+        pins copied and are drawn from the same definition. If definition
+        is given, root becomes an instance of it."""
+        children = []
+        if definition is None:
+            definition = getattr(root, 'definition', None)
+        if isinstance(root, myGraphicsItemGroup):
+            if definition is None:
+                children = [self.numberTree(item) for item in root.listOfItems]
+            elif root is definition.template:
+                children = [
+                    self.numberTree(pin, pinDefinition) for pin, pinDefinition
+                    in zip(root.pins, definition.pinDefinitions)]
+            else:
+                children = [self.numberTree(pin) for pin in root.pins]
+        index = len(self.items)
+        self.indices[id(root)] = index
+        self.items.append((root, children))
+        self.definitions.append(definition)
+        return index
+
+    def copyRecords(self):
+        records = []
+        for item, children in self.items:
+            state = item.__getstate__()
+            attributes = {
+                key: self.copyValue(value) for key, value in state.items()
+                if key not in structuralAttributes}
+            records.append({'t': type(item).__name__, 'a': attributes, 'c': children})
+        return records
+
+    def copyValue(self, value):
+        if type(value) in immutableTypes:
+            return value
+        if isinstance(value, copiedTypes):
+            return type(value)(value)
+        if isinstance(value, list):
+            return [self.copyValue(item) for item in value]
+        if isinstance(value, tuple):
+            return tuple(self.copyValue(item) for item in value)
+        if isinstance(value, dict):
+            return {key: self.copyValue(item) for key, item in value.items()}
+        if isinstance(value, BytesIO):
+            return BytesIO(value.getvalue())
+        if isinstance(value, QtWidgets.QGraphicsItem):
+            # Only references to items in the tree can be kept
+            index = self.indices.get(id(value))
+            if index is None:
+                return None
+            return ItemReference(index)
+        return value
+
+
+def cloneItem(item, start=None, definition=None):
+    """Returns a copy of item and all of its children, built in one pass.
+    This replaces copy.deepcopy followed by replaying every constructor
+    through loadItems. If definition is given, the copy is drawn from it
+    and only the pins of item are copied."""
+    if start is None:
+        start = QtCore.QPointF(0, 0)
+    copier = ItemCopier()
+    rootIndex = copier.numberTree(item, definition)
+    decoder = Decoder(b'')
+    decoder.scope = RecordScope(copier.copyRecords())
+    root = decoder.buildItem(rootIndex, None, start)
+    decoder.resolveReferences()
+    for index, definition in enumerate(copier.definitions):
+        if definition is not None:
+            copy = decoder.scope.items[index]
+            copy.prepareGeometryChange()
+            copy.definition = definition
+    return root
+
+
+# Set to False to give every symbol instance its own items
+shareDefinitions = True
+
+# Definitions of the symbols loaded from files, keyed by absolute path. Their
+# templates are never added to a scene and only serve as prototypes for
+# cloneItem.
+prototypeCache = OrderedDict()
+maxPrototypes = 64
+
+
+def loadSymbolPrototype(fileName):
+    """Returns the SymbolDefinition of a file in either format. Files are
+    only read again when their modification time or size changes."""
+    path = os.path.abspath(fileName)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if path in prototypeCache and prototypeCache[path][0] == signature:
+        prototypeCache.move_to_end(path)
+        return prototypeCache[path][1]
+    logger.info('Caching prototype of %s', path)
+    definition = components.SymbolDefinition(loadSchematicFile(path))
+    prototypeCache[path] = (signature, definition)
+    while len(prototypeCache) > maxPrototypes:
+        prototypeCache.popitem(last=False)
+    return definition
+
+
+def instantiateSymbol(fileName, start=None):
+    """Returns a new instance of the symbol in fileName, cloned from its
+    cached prototype. Instances are drawn from the shared definition where
+    possible. The instance remembers the library file it came from."""
+    if isDotSymbol(symbolPath(fileName)):
+        # Junctions have taken the place of the dot symbol
+        return components.Junction(None, start)
+    definition = loadSymbolPrototype(fileName)
+    if shareDefinitions is True and definition.shareable is True:
+        item = cloneItem(definition.template, start, definition)
+    else:
+        item = cloneItem(definition.template, start)
+    item.symbolFile = symbolPath(fileName)
+    return item
+
+
+def readSections(fileName, tags):
+    """Returns a dictionary mapping the tags in tags to the data of those
+    sections in a file. Only the header, the section table and the requested
+    sections are read. Returns None if the file is not in this format."""
+    headerSize = struct.calcsize(headerFormat)
+    entrySize = struct.calcsize(sectionFormat)
+    with open(fileName, 'rb') as file:
+        header = file.read(headerSize)
+        if not isSchematicFile(header):
+            return None
+        if len(header) < headerSize:
+            raise FileFormatError('Header is truncated')
+        magic, version, count = struct.unpack(headerFormat, header)
+        if version > VERSION:
+            raise FileFormatError('File version %d is newer than %d' % (version, VERSION))
+        table = file.read(count*entrySize)
+        if len(table) < count*entrySize:
+            raise FileFormatError('Section table is truncated')
+        sections = {}
+        for i in range(count):
+            tag, offset, length = struct.unpack_from(sectionFormat, table, i*entrySize)
+            if tag in tags:
+                file.seek(offset)
+                data = file.read(length)
+                if len(data) < length:
+                    raise FileFormatError('Section %r is truncated' % tag)
+                sections[tag] = data
+    return sections
+
+
+def readIcon(fileName):
+    """Returns the PNG preview stored in a file, or None if it has none.
+    Files in the old format have to be unpickled completely."""
+    sections = readSections(fileName, [b'ICON'])
+    if sections is None:
+        with open(fileName, 'rb') as file:
+            icon = getattr(pickle.load(file), 'icon', None)
+        if icon is None:
+            return None
+        return bytes(icon)
+    return sections.get(b'ICON')
+
+
+def readMetadata(fileName):
+    """Returns the bounding rect, pin count and item counts of a file as a
+    dictionary, or None for files in the old format"""
+    sections = readSections(fileName, [b'META'])
+    if sections is None or b'META' not in sections:
+        return None
+    return json.loads(sections[b'META'].decode('utf-8'))
+
+
+def loadSchematicFile(fileName, start=None):
+    """Loads a schematic or symbol file in either format and returns the top
+    level group, ready to be added to a scene"""
+    if start is None:
+        start = QtCore.QPointF(0, 0)
+    with open(fileName, 'rb') as file:
+        data = file.read()
+    if isSchematicFile(data):
+        loadItem = decodeItems(data, start)
+    else:
+        loadItem = pickle.loads(data)
+        loadItem.__init__(
+            None,
+            start,
+            loadItem.listOfItems,
+            mode='symbol')
+    convertDots(loadItem)
+    return loadItem
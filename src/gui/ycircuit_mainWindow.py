@@ -697,6 +697,8 @@ class Ui_MainWindow(object):
         self.action_zoomOut.setObjectName("action_zoomOut")
         self.action_setScale = QtWidgets.QAction(MainWindow)
         self.action_setScale.setObjectName("action_setScale")
+        self.action_cleanupNets = QtWidgets.QAction(MainWindow)
+        self.action_cleanupNets.setObjectName("action_cleanupNets")
         self.action_showItemCenters = QtWidgets.QAction(MainWindow)
         self.action_showItemCenters.setCheckable(True)
         self.action_showItemCenters.setObjectName("action_showItemCenters")
@@ -779,6 +781,7 @@ class Ui_MainWindow(object):
         self.menu_Edit.addAction(self.menuHeight.menuAction())
         self.menu_Edit.addAction(self.menuGroup.menuAction())
         self.menu_Edit.addAction(self.action_setScale)
+        self.menu_Edit.addAction(self.action_cleanupNets)
         self.menu_Edit.addSeparator()
         self.menu_Edit.addAction(self.menu_setPenWidth.menuAction())
         self.menu_Edit.addAction(self.menu_setPenColour.menuAction())
@@ -1251,6 +1254,8 @@ class Ui_MainWindow(object):
         self.action_zoomOut.setShortcut(_translate("MainWindow", "Shift+Z"))
         self.action_setScale.setText(_translate("MainWindow", "&Scale"))
         self.action_setScale.setToolTip(_translate("MainWindow", "Set the scale for the selected item(s)"))
+        self.action_cleanupNets.setText(_translate("MainWindow", "Clean &up nets"))
+        self.action_cleanupNets.setToolTip(_translate("MainWindow", "Merge overlapping nets, split nets at junctions and fix connection dots"))
         self.action_showItemCenters.setText(_translate("MainWindow", "Show item center(s)"))
         self.action_showItemCenters.setShortcut(_translate("MainWindow", "Shift+C"))
         self.action_minorGridPointSpacing50.setText(_translate("MainWindow", "50"))
@@ -0,0 +1,559 @@
+"""Command line entry points that work without the main window.
+
+Usage:
+    python -m src export in.sch -o out.pdf --format pdf,svg,png
+    python -m src export in.sch -t fig.png -t fig@2x.png:4 -t detail.pdf:1:0,0,400,300
+    python -m src batch figures/ 'more/**/*.sch' -o build/ --format pdf,png -j 8
+    python -m src benchmark in.sch --scale 8 --threads 1,2,4,8
+    python -m src convert old/ -o converted/
+    python -m src cleanup legacy/ -o cleaned/
+"""
+from PyQt5 import QtCore, QtWidgets
+from .components import myGraphicsItemGroup
+from .connectivity import cleanupNets
+from .drawingitems import myIconProvider
+from .export import ExportTarget, SceneRecording, exportFormats, exportPlan, imageSize, paddedRect, rasterize
+from .fileformat import Snapshot, isSchematicFile, loadSchematicFile, writeSchematicFile
+import argparse
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+logger = logging.getLogger('YCircuit.headless')
+
+
+def createApplication():
+    """Returns the running QApplication, creating one on the offscreen
+    platform if needed"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QtWidgets.QApplication.instance()
+    if app is None:
+        app = QtWidgets.QApplication(['ycircuit'])
+    return app
+
+
+def loadSchematic(fileName, scene=None, showPins=False):
+    """Loads a schematic or symbol file into a bare QGraphicsScene, the same
+    way the drawing area does when a file is opened"""
+    if scene is None:
+        scene = QtWidgets.QGraphicsScene()
+    loadItem = loadSchematicFile(fileName)
+    scene.addItem(loadItem)
+    loadItem.setPos(loadItem.origin)
+    loadItem.reparentItems()
+    scene.removeItem(loadItem)
+    # Save a copy locally so that items don't disappear
+    scene._items = scene.items()
+    for item in scene.items():
+        if isinstance(item, myGraphicsItemGroup):
+            item.pinVisibility(showPins)
+    return scene
+
+
+def outputFileNames(inputFile, output, formats):
+    """Works out the file name of each requested format.
+
+    output may be None (write next to the input), a directory or a file name
+    whose extension is replaced for every format."""
+    stem = os.path.splitext(os.path.basename(inputFile))[0]
+    if output is None:
+        base = os.path.join(os.path.dirname(inputFile), stem)
+    elif os.path.isdir(output) or output.endswith(os.sep):
+        base = os.path.join(output, stem)
+    else:
+        base = os.path.splitext(output)[0]
+    return [(exportFormat, base + '.' + exportFormat) for exportFormat in formats]
+
+
+def exportFile(inputFile, outputs, **kwargs):
+    """Loads inputFile once and writes it out once per (format, fileName) in
+    outputs. An output can also give its own scale factor and source rect
+    as (format, fileName, scaleFactor, sourceRect), where None falls back to
+    the defaults. The scene is only painted once for all of the outputs."""
+    scene = loadSchematic(inputFile, showPins=kwargs.get('showPins', False))
+    if len(scene.items()) == 0:
+        raise ValueError('%s contains nothing to export' % inputFile)
+    targets = []
+    for output in outputs:
+        exportFormat, saveFile = output[:2]
+        scaleFactor, sourceRect = (tuple(output[2:]) + (None, None))[:2]
+        if scaleFactor is None:
+            scaleFactor = kwargs.get('scaleFactor', 2.0)
+        directory = os.path.dirname(saveFile)
+        if directory != '' and not os.path.isdir(directory):
+            os.makedirs(directory)
+        targets.append(ExportTarget(
+            saveFile,
+            exportFormat,
+            sourceRect,
+            scaleFactor=scaleFactor,
+            quality=kwargs.get('quality'),
+            transparentBackground=kwargs.get('transparentBackground', False),
+            tileHeight=kwargs.get('tileHeight'),
+            threads=kwargs.get('threads')))
+    savedFiles = exportPlan(scene, targets, kwargs.get('whitespacePadding', 1.1))
+    scene.clear()
+    return savedFiles
+
+
+def parseFormats(formats, output):
+    """Splits a comma separated format list, defaulting to the extension of
+    output and then to PDF"""
+    if formats is None:
+        if output is not None and os.path.splitext(output)[1] != '':
+            formats = os.path.splitext(output)[1][1:]
+        else:
+            formats = 'pdf'
+    formats = [f.strip().lower() for f in formats.split(',') if f.strip() != '']
+    for exportFormat in formats:
+        if exportFormat not in exportFormats:
+            raise argparse.ArgumentTypeError(
+                'unsupported format %s (choose from %s)' % (exportFormat, ', '.join(exportFormats)))
+    return formats
+
+
+def parseTarget(spec):
+    """Parses an export target given as file[:scale[:x,y,width,height]]
+    into (format, fileName, scaleFactor, sourceRect). The area is in scene
+    coordinates. Missing or empty parts are None."""
+    parts = spec.split(':')
+    sourceRect = None
+    scaleFactor = None
+    if len(parts) > 1 and parts[-1].count(',') == 3:
+        try:
+            x, y, width, height = [float(value) for value in parts.pop().split(',')]
+        except ValueError:
+            raise argparse.ArgumentTypeError('invalid area in target %s' % spec)
+        sourceRect = QtCore.QRectF(x, y, width, height)
+        if parts[-1] == '':
+            parts.pop()
+        elif len(parts) == 1:
+            raise argparse.ArgumentTypeError('missing scale in target %s' % spec)
+        else:
+            try:
+                scaleFactor = float(parts.pop())
+            except ValueError:
+                raise argparse.ArgumentTypeError('invalid scale in target %s' % spec)
+    elif len(parts) > 1:
+        # A colon can also be part of the file name, e.g. a drive letter
+        try:
+            scaleFactor = float(parts[-1])
+            parts.pop()
+        except ValueError:
+            pass
+    saveFile = ':'.join(parts)
+    exportFormat = os.path.splitext(saveFile)[1][1:].lower()
+    if exportFormat not in exportFormats:
+        raise argparse.ArgumentTypeError(
+            'unsupported format of target %s (choose from %s)' % (spec, ', '.join(exportFormats)))
+    return exportFormat, saveFile, scaleFactor, sourceRect
+
+
+def addExportArguments(parser):
+    parser.add_argument('-o', '--output', default=None,
+                        help='output file or directory (default: next to the input)')
+    parser.add_argument('-f', '--format', dest='formats', default=None,
+                        help='comma separated list of formats, e.g. pdf,svg,png')
+    parser.add_argument('--scale', dest='scaleFactor', type=float, default=2.0,
+                        help='scale factor for raster images and TikZ (default: 2.0)')
+    parser.add_argument('--padding', dest='whitespacePadding', type=float, default=1.1,
+                        help='whitespace padding around the drawing (default: 1.1)')
+    parser.add_argument('--quality', type=int, default=None,
+                        help='quality for lossy image formats (0-100)')
+    parser.add_argument('--transparent', dest='transparentBackground', action='store_true',
+                        help='use a transparent background for raster images')
+    parser.add_argument('--show-pins', dest='showPins', action='store_true',
+                        help='keep symbol pins visible')
+    parser.add_argument('--tile-height', dest='tileHeight', type=int, default=None,
+                        help='render PNG/TIFF images in bands of this many rows')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='threads used to rasterize images (default: one per core for large images)')
+
+
+def exportCommand(args):
+    formats = parseFormats(args.formats, args.output)
+    if len(args.inputs) > 1 and args.output is not None and \
+       not (os.path.isdir(args.output) or args.output.endswith(os.sep)):
+        raise SystemExit('--output must be a directory when exporting several files')
+    if len(args.inputs) > 1 and len(args.targets) > 0:
+        raise SystemExit('--target can only be used when exporting a single file')
+    app = createApplication()
+    failed = 0
+    for inputFile in args.inputs:
+        outputs = []
+        # Targets replace the default output unless one is asked for
+        if len(args.targets) == 0 or args.output is not None or args.formats is not None:
+            outputs = outputFileNames(inputFile, args.output, formats)
+        outputs += args.targets
+        try:
+            for saveFile in exportFile(
+                    inputFile,
+                    outputs,
+                    scaleFactor=args.scaleFactor,
+                    whitespacePadding=args.whitespacePadding,
+                    quality=args.quality,
+                    transparentBackground=args.transparentBackground,
+                    showPins=args.showPins,
+                    tileHeight=args.tileHeight,
+                    threads=args.threads):
+                print(saveFile)
+        except Exception:
+            logger.exception('Could not export %s', inputFile)
+            failed += 1
+    return 1 if failed > 0 else 0
+
+
+def globPrefix(pattern):
+    """Returns the leading folders of a glob pattern that hold no
+    wildcards"""
+    prefix = os.path.dirname(pattern)
+    while glob.has_magic(prefix):
+        prefix = os.path.dirname(prefix)
+    return prefix
+
+
+def collectInputFiles(patterns, outputFolder=None):
+    """Expands directories (recursively) and glob patterns into a list of
+    (inputFile, relativeName) pairs. relativeName is used to mirror the
+    directory structure in the output folder. It is relative to the
+    directory, or to the folders of a glob pattern before its first
+    wildcard. Raises ValueError if outputFolder is given and two files
+    would be written to the same file in it."""
+    inputFiles = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                for fileName in sorted(files):
+                    if fileName.endswith(('.sch', '.sym')):
+                        inputFile = os.path.join(root, fileName)
+                        inputFiles.append((inputFile, os.path.relpath(inputFile, pattern)))
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if matches == [] and os.path.isfile(pattern):
+                matches = [pattern]
+            prefix = globPrefix(pattern) or os.curdir
+            for inputFile in matches:
+                if os.path.isfile(inputFile) and inputFile.endswith(('.sch', '.sym')):
+                    inputFiles.append((inputFile, os.path.relpath(inputFile, prefix)))
+    # Drop duplicates while keeping the order
+    seen = set()
+    names = {}
+    uniqueFiles = []
+    for inputFile, relativeName in inputFiles:
+        key = os.path.abspath(inputFile)
+        if key in seen:
+            continue
+        seen.add(key)
+        if outputFolder is not None:
+            name = os.path.normcase(os.path.normpath(relativeName))
+            if name in names:
+                raise ValueError('%s and %s would both be written to %s' % (
+                    names[name], inputFile, os.path.join(outputFolder, relativeName)))
+            names[name] = inputFile
+        uniqueFiles.append((inputFile, relativeName))
+    return uniqueFiles
+
+
+def collectInputFilesOrExit(patterns, outputFolder=None):
+    """collectInputFiles for the commands, which exit if there is nothing
+    to do"""
+    try:
+        inputFiles = collectInputFiles(patterns, outputFolder)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if inputFiles == []:
+        raise SystemExit('No .sch or .sym files found')
+    return inputFiles
+
+
+def initialiseWorker():
+    """Creates one offscreen application per worker process"""
+    global _workerApp
+    _workerApp = createApplication()
+
+
+def exportJob(job):
+    """Runs in a worker process. Exports one file to every requested format
+    and reports how long it took"""
+    inputFile, outputs, kwargs = job
+    result = {'input': inputFile, 'outputs': [], 'error': None}
+    start = time.perf_counter()
+    try:
+        result['outputs'] = exportFile(inputFile, outputs, **kwargs)
+    except Exception as e:
+        logger.exception('Could not export %s', inputFile)
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def batchExport(inputFiles, outputFolder, formats, processes=None, **kwargs):
+    """Exports every (inputFile, relativeName) pair in inputFiles across a
+    pool of worker processes and returns a summary dictionary. Raises
+    ValueError if two files would be exported to the same file."""
+    jobs = []
+    owners = {}
+    for inputFile, relativeName in inputFiles:
+        if outputFolder is None:
+            output = None
+        else:
+            output = os.path.join(outputFolder, relativeName)
+        outputs = outputFileNames(inputFile, output, formats)
+        for exportFormat, saveFile in outputs:
+            key = os.path.normcase(os.path.abspath(saveFile))
+            if key in owners:
+                raise ValueError('%s and %s would both be exported to %s' % (
+                    owners[key], inputFile, saveFile))
+            owners[key] = inputFile
+        jobs.append((inputFile, outputs, kwargs))
+    start = time.perf_counter()
+    results = []
+    if processes == 1:
+        initialiseWorker()
+        for job in jobs:
+            results.append(exportJob(job))
+    else:
+        with multiprocessing.Pool(processes, initializer=initialiseWorker) as pool:
+            for result in pool.imap_unordered(exportJob, jobs):
+                results.append(result)
+    order = {job[0]: i for i, job in enumerate(jobs)}
+    results.sort(key=lambda result: order[result['input']])
+    failures = [result for result in results if result['error'] is not None]
+    return {
+        'files': results,
+        'total': len(results),
+        'failed': len(failures),
+        'formats': formats,
+        'processes': processes if processes is not None else os.cpu_count(),
+        'seconds': time.perf_counter() - start
+    }
+
+
+def batchCommand(args):
+    formats = parseFormats(args.formats, None)
+    inputFiles = collectInputFilesOrExit(args.inputs)
+    try:
+        summary = batchExport(
+            inputFiles,
+            args.output,
+            formats,
+            processes=args.processes,
+            scaleFactor=args.scaleFactor,
+            whitespacePadding=args.whitespacePadding,
+            quality=args.quality,
+            transparentBackground=args.transparentBackground,
+            showPins=args.showPins,
+            tileHeight=args.tileHeight,
+            threads=args.threads)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if args.summary is None or args.summary == '-':
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    logger.info('Exported %d files (%d failed) in %.2f s',
+                summary['total'], summary['failed'], summary['seconds'])
+    return 1 if summary['failed'] > 0 else 0
+
+
+def benchmarkRasterization(inputFile, scaleFactor, threadCounts, repeat=3, whitespacePadding=1.1):
+    """Times banded rasterization of inputFile for each thread count.
+    Returns a list of dictionaries with the best time of each run."""
+    scene = loadSchematic(inputFile)
+    sourceRect = paddedRect(scene.itemsBoundingRect(), whitespacePadding)
+    width, height = imageSize(sourceRect, scaleFactor)
+    recording = SceneRecording(scene, sourceRect)
+    results = []
+    for threads in threadCounts:
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            rasterize(recording, sourceRect, width, height, threads=threads)
+            times.append(time.perf_counter() - start)
+        results.append({'threads': threads, 'seconds': min(times)})
+    for result in results:
+        result['speedup'] = results[0]['seconds'] / result['seconds']
+    scene.clear()
+    return {'input': inputFile, 'width': width, 'height': height, 'runs': results}
+
+
+def benchmarkCommand(args):
+    threadCounts = [int(t) for t in args.threads.split(',')]
+    app = createApplication()
+    summary = benchmarkRasterization(
+        args.input, args.scaleFactor, threadCounts, args.repeat, args.whitespacePadding)
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        return 0
+    print('%s at %dx%d pixels' % (summary['input'], summary['width'], summary['height']))
+    print('%8s %10s %8s' % ('threads', 'seconds', 'speedup'))
+    for run in summary['runs']:
+        print('%8d %10.3f %7.2fx' % (run['threads'], run['seconds'], run['speedup']))
+    return 0
+
+
+def convertFile(inputFile, outputFile):
+    """Rewrites a pickled schematic or symbol in the current file format.
+    Returns the sizes of the old and new files in bytes."""
+    with open(inputFile, 'rb') as file:
+        data = file.read()
+    if isSchematicFile(data):
+        if os.path.abspath(inputFile) != os.path.abspath(outputFile):
+            with open(outputFile, 'wb') as file:
+                file.write(data)
+        return len(data), len(data)
+    loadItem = loadSchematicFile(inputFile)
+    writeSchematicFile(outputFile, loadItem)
+    return len(data), os.path.getsize(outputFile)
+
+
+def convertCommand(args):
+    inputFiles = collectInputFilesOrExit(args.inputs, args.output)
+    app = createApplication()
+    failed = 0
+    for inputFile, relativeName in inputFiles:
+        if args.output is None:
+            outputFile = inputFile
+        else:
+            outputFile = os.path.join(args.output, relativeName)
+            os.makedirs(os.path.dirname(outputFile) or '.', exist_ok=True)
+        try:
+            oldSize, newSize = convertFile(inputFile, outputFile)
+            print('%s: %d -> %d bytes' % (outputFile, oldSize, newSize))
+        except Exception:
+            logger.exception('Could not convert %s', inputFile)
+            failed += 1
+    return 1 if failed > 0 else 0
+
+
+def saveScene(scene, outputFile):
+    """Writes the top level items of scene to outputFile, the same way the
+    drawing area saves a schematic"""
+    listOfItems = [item for item in scene.items() if item.parentItem() is None]
+    x = min([item.scenePos().x() for item in listOfItems])
+    y = min([item.scenePos().y() for item in listOfItems])
+    origin = QtCore.QPointF(x, y)
+    saveObject = myGraphicsItemGroup(None, origin, [])
+    saveObject.origin = origin
+    snapshot = Snapshot(saveObject, listOfItems)
+    iconRect = QtCore.QRectF()
+    for item in listOfItems:
+        iconRect = iconRect.united(item.sceneBoundingRect())
+    img = myIconProvider().renderIconImage(scene, iconRect)
+    icon = QtCore.QByteArray()
+    buf = QtCore.QBuffer(icon)
+    buf.open(QtCore.QIODevice.WriteOnly)
+    img.save(buf, 'PNG', quality=10)
+    buf.close()
+    snapshot.icon = bytes(icon)
+    with open(outputFile, 'wb') as file:
+        file.write(snapshot.encode())
+
+
+def cleanupFile(inputFile, outputFile):
+    """Cleans up the nets of inputFile and writes the result to outputFile.
+    Returns the summary of cleanupNets."""
+    scene = loadSchematic(inputFile)
+    summary = cleanupNets(scene)
+    if len(scene.items()) > 0:
+        saveScene(scene, outputFile)
+    scene.clear()
+    return summary
+
+
+def cleanupCommand(args):
+    inputFiles = collectInputFilesOrExit(args.inputs, args.output)
+    app = createApplication()
+    failed = 0
+    for inputFile, relativeName in inputFiles:
+        if args.output is None:
+            outputFile = inputFile
+        else:
+            outputFile = os.path.join(args.output, relativeName)
+            os.makedirs(os.path.dirname(outputFile) or '.', exist_ok=True)
+        try:
+            summary = cleanupFile(inputFile, outputFile)
+            print('%s: replaced %d nets with %d, removed %d dots and added %d' % (
+                outputFile, summary['netsRemoved'], summary['netsAdded'],
+                summary['dotsRemoved'], summary['dotsAdded']))
+        except Exception:
+            logger.exception('Could not clean up %s', inputFile)
+            failed += 1
+    return 1 if failed > 0 else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='ycircuit',
+        description='Work with YCircuit schematics without opening the main window.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log progress to stderr')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    exportParser = subparsers.add_parser('export', help='export schematics or symbols')
+    exportParser.add_argument('inputs', nargs='+', help='.sch or .sym files')
+    addExportArguments(exportParser)
+    exportParser.add_argument('-t', '--target', dest='targets', action='append', default=[],
+                              type=parseTarget, metavar='FILE[:SCALE[:X,Y,WIDTH,HEIGHT]]',
+                              help='export to FILE with its own scale and scene area, '
+                                   'e.g. detail.png:4:0,0,400,300 (can be repeated)')
+    exportParser.set_defaults(func=exportCommand)
+
+    batchParser = subparsers.add_parser(
+        'batch', help='export directories or globs of files in parallel')
+    batchParser.add_argument('inputs', nargs='+', help='directories, glob patterns or files')
+    addExportArguments(batchParser)
+    batchParser.add_argument('-j', '--processes', type=int, default=None,
+                             help='number of worker processes (default: one per core)')
+    batchParser.add_argument('--summary', default=None,
+                             help='write the JSON summary to this file instead of stdout')
+    batchParser.set_defaults(func=batchCommand)
+
+    benchmarkParser = subparsers.add_parser(
+        'benchmark', help='time multi-threaded rasterization of a file')
+    benchmarkParser.add_argument('input', help='.sch or .sym file')
+    benchmarkParser.add_argument('--scale', dest='scaleFactor', type=float, default=8.0,
+                                 help='scale factor of the rendered image (default: 8.0)')
+    benchmarkParser.add_argument('--padding', dest='whitespacePadding', type=float, default=1.1,
+                                 help='whitespace padding around the drawing (default: 1.1)')
+    benchmarkParser.add_argument('--threads', default='1,2,4,8',
+                                 help='comma separated thread counts to compare (default: 1,2,4,8)')
+    benchmarkParser.add_argument('--repeat', type=int, default=3,
+                                 help='runs per thread count, the best is reported (default: 3)')
+    benchmarkParser.add_argument('--json', action='store_true', help='print the results as JSON')
+    benchmarkParser.set_defaults(func=benchmarkCommand)
+
+    convertParser = subparsers.add_parser(
+        'convert', help='rewrite pickled files in the current file format')
+    convertParser.add_argument('inputs', nargs='+', help='directories, glob patterns or files')
+    convertParser.add_argument('-o', '--output', default=None,
+                               help='output folder (default: convert the files in place)')
+    convertParser.set_defaults(func=convertCommand)
+
+    cleanupParser = subparsers.add_parser(
+        'cleanup', help='merge, split and add connection dots to the nets of files')
+    cleanupParser.add_argument('inputs', nargs='+', help='directories, glob patterns or files')
+    cleanupParser.add_argument('-o', '--output', default=None,
+                               help='output folder (default: clean up the files in place)')
+    cleanupParser.set_defaults(func=cleanupCommand)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(name)s - %(levelname)s - %(message)s')
+    try:
+        return args.func(args)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
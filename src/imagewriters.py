@@ -0,0 +1,180 @@
+"""Minimal PNG and TIFF encoders that accept pixel rows incrementally.
+
+QImage.save needs the whole image in memory. These writers let the tiled
+exporter hand over one band of rows at a time, so peak memory only depends
+on the band size. Rows are 8 bit RGB or RGBA with straight (not
+premultiplied) alpha.
+"""
+import struct
+import zlib
+
+
+class PngWriter(object):
+    """Writes a PNG file row by row. Rows are deflated as they arrive and
+    flushed to disk in IDAT chunks of roughly chunkSize bytes."""
+
+    def __init__(self, fileName, width, height, alpha=True, compressionLevel=6, chunkSize=1 << 16):
+        self.width = width
+        self.height = height
+        self.channels = 4 if alpha else 3
+        self.rowsWritten = 0
+        self.chunkSize = chunkSize
+        self.compressor = zlib.compressobj(compressionLevel)
+        self.pending = []
+        self.pendingSize = 0
+        self.file = open(fileName, 'wb')
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        colourType = 6 if alpha else 2
+        self.writeChunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, colourType, 0, 0, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, value, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def writeChunk(self, chunkType, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunkType)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunkType)) & 0xffffffff))
+
+    def addCompressed(self, data):
+        if data:
+            self.pending.append(data)
+            self.pendingSize += len(data)
+        if self.pendingSize >= self.chunkSize:
+            self.writeChunk(b'IDAT', b''.join(self.pending))
+            self.pending = []
+            self.pendingSize = 0
+
+    def writeRows(self, rows):
+        """rows is an iterable of bytes objects, each width*channels long"""
+        for row in rows:
+            # Filter type 0 (None) for every scanline
+            self.addCompressed(self.compressor.compress(b'\x00'))
+            self.addCompressed(self.compressor.compress(row))
+            self.rowsWritten += 1
+
+    def close(self):
+        if self.rowsWritten != self.height:
+            self.file.close()
+            raise ValueError('Expected %d rows but got %d' % (self.height, self.rowsWritten))
+        self.pending.append(self.compressor.flush())
+        self.writeChunk(b'IDAT', b''.join(self.pending))
+        self.pending = []
+        self.writeChunk(b'IEND', b'')
+        self.file.close()
+
+
+class TiffWriter(object):
+    """Writes a baseline little-endian TIFF file strip by strip. Every strip
+    except the last holds rowsPerStrip rows and is deflate compressed."""
+
+    SHORT, LONG, RATIONAL = 3, 4, 5
+
+    def __init__(self, fileName, width, height, alpha=True, rowsPerStrip=64, compressionLevel=6):
+        self.width = width
+        self.height = height
+        self.alpha = alpha
+        self.channels = 4 if alpha else 3
+        self.rowsPerStrip = rowsPerStrip
+        self.compressionLevel = compressionLevel
+        self.rowsWritten = 0
+        self.stripRows = []
+        self.stripOffsets = []
+        self.stripByteCounts = []
+        self.file = open(fileName, 'wb')
+        # The IFD offset is patched in close()
+        self.file.write(b'II*\x00' + struct.pack('<I', 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, value, traceback):
+        if excType is None:
+            self.close()
+        else:
+            self.file.close()
+
+    def flushStrip(self):
+        if self.stripRows == []:
+            return
+        data = zlib.compress(b''.join(self.stripRows), self.compressionLevel)
+        self.stripOffsets.append(self.file.tell())
+        self.stripByteCounts.append(len(data))
+        self.file.write(data)
+        if len(data) % 2 == 1:
+            self.file.write(b'\x00')
+        self.stripRows = []
+
+    def writeRows(self, rows):
+        for row in rows:
+            self.stripRows.append(row)
+            self.rowsWritten += 1
+            if len(self.stripRows) == self.rowsPerStrip:
+                self.flushStrip()
+
+    def writeValues(self, fieldType, values):
+        """Writes values out of line and returns their offset"""
+        offset = self.file.tell()
+        if fieldType == self.SHORT:
+            self.file.write(struct.pack('<%dH' % len(values), *values))
+        elif fieldType == self.LONG:
+            self.file.write(struct.pack('<%dI' % len(values), *values))
+        elif fieldType == self.RATIONAL:
+            for numerator, denominator in values:
+                self.file.write(struct.pack('<II', numerator, denominator))
+        if self.file.tell() % 2 == 1:
+            self.file.write(b'\x00')
+        return offset
+
+    def entry(self, tag, fieldType, values):
+        """Packs one IFD entry, writing values out of line if they do not fit
+        in four bytes"""
+        size = {self.SHORT: 2, self.LONG: 4, self.RATIONAL: 8}[fieldType]
+        if fieldType != self.RATIONAL and size * len(values) <= 4:
+            if fieldType == self.SHORT:
+                value = struct.pack('<%dH' % len(values), *values).ljust(4, b'\x00')
+            else:
+                value = struct.pack('<I', values[0])
+        else:
+            value = struct.pack('<I', self.writeValues(fieldType, values))
+        return struct.pack('<HHI', tag, fieldType, len(values)) + value
+
+    def close(self):
+        self.flushStrip()
+        if self.rowsWritten != self.height:
+            self.file.close()
+            raise ValueError('Expected %d rows but got %d' % (self.height, self.rowsWritten))
+        entries = [
+            self.entry(256, self.LONG, [self.width]),
+            self.entry(257, self.LONG, [self.height]),
+            self.entry(258, self.SHORT, [8] * self.channels),
+            # Adobe deflate
+            self.entry(259, self.SHORT, [8]),
+            # RGB
+            self.entry(262, self.SHORT, [2]),
+            self.entry(273, self.LONG, self.stripOffsets),
+            self.entry(277, self.SHORT, [self.channels]),
+            self.entry(278, self.LONG, [self.rowsPerStrip]),
+            self.entry(279, self.LONG, self.stripByteCounts),
+            self.entry(282, self.RATIONAL, [(72, 1)]),
+            self.entry(283, self.RATIONAL, [(72, 1)]),
+            self.entry(284, self.SHORT, [1]),
+            # Inches
+            self.entry(296, self.SHORT, [2]),
+        ]
+        if self.alpha:
+            # Unassociated alpha
+            entries.append(self.entry(338, self.SHORT, [2]))
+        ifdOffset = self.file.tell()
+        self.file.write(struct.pack('<H', len(entries)))
+        self.file.write(b''.join(entries))
+        self.file.write(struct.pack('<I', 0))
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', ifdOffset))
+        self.file.close()
@@ -3,6 +3,8 @@ sys.path.append('./Resources/icons/')
 from .drawingarea import DrawingArea
 from .components import TextBox, myGraphicsItemGroup
 from .drawingitems import myIconProvider
+from .symbollibrary import SymbolLibrary
+from .thumbnails import ThumbnailLoader
 from PyQt5 import QtCore, QtGui, QtWidgets, QtNetwork
 from .gui.ycircuit_mainWindow import Ui_MainWindow
 import zipfile
@@ -109,6 +111,8 @@ class myMainWindow(QtWidgets.QMainWindow):
         self.ui.menu_Edit.hovered.connect(self.menu_Edit_hovered)
         self.ui.action_setScale.triggered.connect(
             self.action_setScale_triggered)
+        self.ui.action_cleanupNets.triggered.connect(
+            self.ui.drawingArea.cleanupNetsRoutine)
         self.ui.action_setWidth2.triggered.connect(
             lambda: self.action_setWidth_triggered(2))
         self.ui.action_setWidth4.triggered.connect(
@@ -361,8 +365,7 @@ class myMainWindow(QtWidgets.QMainWindow):
         if sys.exc_info()[0] != None:
             self.logger.error(exc_info=sys.exc_info())
         if self.ui.drawingArea.undoStack.isClean():
-            self.ui.drawingArea.autobackupFile.close()
-            self.ui.drawingArea.autobackupFile.remove()
+            self.ui.drawingArea.closeAutobackupFile()
             self.logger.info('Closing with a clean undo stack')
             event.accept()
         elif self.ui.drawingArea.schematicFileName is not None:
@@ -382,23 +385,28 @@ class myMainWindow(QtWidgets.QMainWindow):
             ret = msgBox.exec_()
             if ret == msgBox.Save:
                 saved = self.ui.drawingArea.saveRoutine(modified)
+                if saved is True:
+                    saved = self.ui.drawingArea.waitForSaves()
                 if saved is False:
-                    self.logger.info('Not closing since a save file was not specified')
+                    self.logger.info('Not closing since the file was not saved')
                     event.ignore()
                     return
                 self.logger.info('Deleting autobackup file %s', self.ui.drawingArea.autobackupFile.fileName())
-                self.ui.drawingArea.autobackupFile.close()
-                self.ui.drawingArea.autobackupFile.remove()
+                self.ui.drawingArea.closeAutobackupFile()
                 self.logger.info('Closing with changes saved as %s', modified)
                 event.accept()
             elif ret == msgBox.Discard:
                 self.logger.info('Deleting autobackup file %s', self.ui.drawingArea.autobackupFile.fileName())
-                self.ui.drawingArea.autobackupFile.close()
-                self.ui.drawingArea.autobackupFile.remove()
+                self.ui.drawingArea.closeAutobackupFile()
                 self.logger.info('Closing with unsaved changes')
                 event.accept()
             else:
                 event.ignore()
+        if event.isAccepted():
+            # Stop rendering previews and indexing symbols before the window
+            # goes away
+            self.thumbnailLoader.shutdown()
+            self.symbolLibrary.threadPool.waitForDone()
 
     def action_newSchematic_triggered(self):
         self.logger.info('Creating a new window')
@@ -846,35 +854,44 @@ class myMainWindow(QtWidgets.QMainWindow):
         else:
             index = self.fileSystemModel.setRootPath('./Resources/Symbols/Standard/')
         self.logger.info('Initialising symbol viewer directory to %s', self.fileSystemModel.rootPath())
-        self.fileSystemModel.setIconProvider(myIconProvider())
+        # Previews are created on a thread pool so that large folders do not
+        # block the list views while they paint
+        self.thumbnailLoader = ThumbnailLoader(myIconProvider(), parent=self)
+        self.fileSystemModel.setThumbnailLoader(self.thumbnailLoader)
         self.fileSystemModel.setNameFilterDisables(False)
         self.fileSystemModel.setNameFilters(['*.sym'])
         self.ui.listView_symbolPreview.setModel(self.fileSystemModel)
         self.ui.listView_symbolPreview.setRootIndex(index)
         self.ui.listView_symbolPreview.setIconSize(QtCore.QSize(100, 100))
+        self.thumbnailLoader.watchView(self.ui.listView_symbolPreview)
         # Set double click behaviour in the list view
         self.ui.listView_symbolPreview.doubleClicked.connect(
             self.ui.drawingArea.escapeRoutine)
         self.ui.listView_symbolPreview.doubleClicked.connect(
             self.ui.drawingArea.setFocus)
+        # The list view shows either the folder or the search results
         self.ui.listView_symbolPreview.doubleClicked.connect(
             lambda x: self.ui.drawingArea.loadRoutine(
                 mode='symbol',
-                loadFile=self.fileSystemModel.filePath(x)))
+                loadFile=x.model().filePath(x)))
         # Set shortcut for the search filter
         shortcut = QtWidgets.QShortcut(QtGui.QKeySequence('Ctrl+F'), self)
         shortcut.activated.connect(self.ui.lineEdit_symbolPreviewFilter.selectAll)
         shortcut.activated.connect(self.ui.lineEdit_symbolPreviewFilter.setFocus)
-        self.ui.lineEdit_symbolPreviewFilter.textChanged.connect(
-            lambda: self.fileSystemModel.setNameFilters(
-                ['*' + self.ui.lineEdit_symbolPreviewFilter.text() + '*.sym']
-            )
-        )
+        # The filter searches an index of all symbol folders
+        self.symbolLibrary = SymbolLibrary(parent=self)
+        self.updateSymbolLibraryFolders()
+        self.symbolSearchModel = SymbolSearchModel()
+        self.symbolSearchModel.setThumbnailLoader(self.thumbnailLoader)
+        self.symbolLibrary.changed.connect(self.searchSymbols)
+        self.ui.lineEdit_symbolPreviewFilter.textChanged.connect(self.searchSymbols)
         # Set up the recent symbols list view and model
         self.recentSymbolsModel = RecentSymbolsListModel()
         self.recentSymbolsModel.setIconProvider(myIconProvider())
+        self.recentSymbolsModel.setThumbnailLoader(self.thumbnailLoader)
         self.ui.listView_recentSymbols.setModel(self.recentSymbolsModel)
         self.ui.listView_recentSymbols.setIconSize(QtCore.QSize(100, 100))
+        self.thumbnailLoader.watchView(self.ui.listView_recentSymbols)
         self.ui.listView_recentSymbols.doubleClicked.connect(
             self.ui.drawingArea.escapeRoutine)
         self.ui.listView_recentSymbols.doubleClicked.connect(
@@ -884,6 +901,30 @@ class myMainWindow(QtWidgets.QMainWindow):
                 mode='symbol',
                 loadFile=self.recentSymbolsModel.filePath(x)))
 
+    def updateSymbolLibraryFolders(self):
+        drawingArea = self.ui.drawingArea
+        self.symbolLibrary.setFolders([
+            'Resources/Symbols/Standard',
+            'Resources/Symbols/Custom',
+            drawingArea.defaultSymbolPreviewFolder,
+            drawingArea.symbolPreviewFolder1,
+            drawingArea.symbolPreviewFolder2,
+            drawingArea.symbolPreviewFolder3])
+
+    def searchSymbols(self):
+        """Shows the symbols matching the filter text, or the symbol preview
+        folder if the filter is empty"""
+        text = self.ui.lineEdit_symbolPreviewFilter.text()
+        listView = self.ui.listView_symbolPreview
+        if text.strip() == '':
+            if listView.model() is not self.fileSystemModel:
+                listView.setModel(self.fileSystemModel)
+                listView.setRootIndex(self.fileSystemModel.index(self.fileSystemModel.rootPath()))
+            return
+        self.symbolSearchModel.setResults(self.symbolLibrary.search(text))
+        if listView.model() is not self.symbolSearchModel:
+            listView.setModel(self.symbolSearchModel)
+
     def pickSymbolPreviewDirectory(self, dir_=None):
         if dir_ is None:
             dir_ = QtWidgets.QFileDialog().getExistingDirectory(
@@ -892,7 +933,8 @@ class myMainWindow(QtWidgets.QMainWindow):
                 self.fileSystemModel.rootPath())
         if dir_ != '':
             index = self.fileSystemModel.setRootPath(dir_)
-            self.ui.listView_symbolPreview.setRootIndex(index)
+            if self.ui.listView_symbolPreview.model() is self.fileSystemModel:
+                self.ui.listView_symbolPreview.setRootIndex(index)
             self.logger.info('Set symbol viewer directory to %s', dir_)
 
     def updateYCircuit(self):
@@ -972,14 +1014,27 @@ class SymbolsListModel(QtWidgets.QFileSystemModel):
     def __init__(self, parent=None):
         "Initialize the symbols list model"
         super().__init__(parent)
+        self.thumbnailLoader = None
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
         if role == QtCore.Qt.ToolTipRole:
             fileName = self.fileName(index)
             return 'Double-click to add ' + fileName + ' to the schematic'
+        elif role == QtCore.Qt.DecorationRole and self.thumbnailLoader is not None \
+                and index.column() == 0 and not self.isDir(index):
+            return self.thumbnailLoader.icon(self.filePath(index), index)
         else:
             return super().data(index, role)
 
+    def setThumbnailLoader(self, thumbnailLoader):
+        self.thumbnailLoader = thumbnailLoader
+        self.thumbnailLoader.iconReady.connect(self.updateIcon)
+
+    def updateIcon(self, filePath):
+        index = self.index(filePath)
+        if index.isValid():
+            self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
 
 class RecentSymbolsListModel(QtCore.QAbstractListModel):
     """Provides an implementation of the list model in order to show the most
@@ -989,6 +1044,7 @@ class RecentSymbolsListModel(QtCore.QAbstractListModel):
         super().__init__(parent)
         self.recentsList = []
         self.maxRecents = 100
+        self.thumbnailLoader = None
 
     def filePath(self, x):
         return self.recentsList[x.row()]
@@ -1004,6 +1060,8 @@ class RecentSymbolsListModel(QtCore.QAbstractListModel):
         if role == QtCore.Qt.DisplayRole:
             return fileInfo.fileName()
         elif role == QtCore.Qt.DecorationRole:
+            if self.thumbnailLoader is not None:
+                return self.thumbnailLoader.icon(self.recentsList[index.row()], index)
             icon = self.iconProvider.icon(fileInfo)
             return icon
         elif role == QtCore.Qt.ToolTipRole:
@@ -1026,6 +1084,16 @@ class RecentSymbolsListModel(QtCore.QAbstractListModel):
         if isinstance(iconProvider, myIconProvider):
             self.iconProvider = iconProvider
 
+    def setThumbnailLoader(self, thumbnailLoader):
+        self.thumbnailLoader = thumbnailLoader
+        self.thumbnailLoader.iconReady.connect(self.updateIcon)
+
+    def updateIcon(self, filePath):
+        for row, recent in enumerate(self.recentsList):
+            if recent == filePath:
+                self.dataChanged.emit(
+                    self.index(row), self.index(row), [QtCore.Qt.DecorationRole])
+
     def insertRows(self, row):
         self.beginInsertRows(QtCore.QModelIndex(), 0, 0)
         self.recentsList.insert(0, row)
@@ -1037,3 +1105,13 @@ class RecentSymbolsListModel(QtCore.QAbstractListModel):
         self.recentsList.pop(row)
         self.endRemoveRows()
         return True
+
+
+class SymbolSearchModel(RecentSymbolsListModel):
+    """Lists the results of a symbol search in the same way as the recent
+    symbols"""
+
+    def setResults(self, filePaths):
+        self.beginResetModel()
+        self.recentsList = list(filePaths)
+        self.endResetModel()
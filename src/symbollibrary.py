@@ -0,0 +1,332 @@
+"""Index of the symbol libraries used by the symbol browser search.
+
+The index holds the name, folder, pin count, bounding box, tags and text
+of every symbol in the library folders. It is saved to a single file and
+brought up to date incrementally: only symbols whose modification time or
+size changed are read again. Searching only looks at the index, so it
+never has to scan the folders.
+
+The folders are scanned and the symbols are read on a worker thread. Files
+in the old format cannot be measured without building their items, so their
+pin count and bounding box are filled in afterwards on the GUI thread, one
+file per turn of the event loop.
+"""
+from PyQt5 import QtCore, QtGui
+from .fileformat import encodeMetadata, loadSchematicFile, readSections
+import json
+import logging
+import os
+import pickle
+import re
+import zlib
+
+logger = logging.getLogger('YCircuit.symbollibrary')
+
+INDEX_VERSION = 1
+
+
+def splitWords(text):
+    """Splits names like Resistor_variable or doubleFeedback into lower
+    case words"""
+    text = re.sub(r'([a-z0-9])([A-Z])', r'\1 \2', text)
+    return [word.lower() for word in re.split(r'[^A-Za-z0-9]+', text) if word != '']
+
+
+def plainText(html):
+    return QtGui.QTextDocumentFragment.fromHtml(html).toPlainText()
+
+
+def recordTexts(records, texts):
+    """Adds the text of the text box records in records to texts"""
+    for record in records:
+        if record['t'] == 'TextBox':
+            texts.append(record['a'].get('latexExpression') or
+                         plainText(record['a'].get('htmlText', '')))
+
+
+def readSymbol(fileName):
+    """Returns the index entry of a symbol file, without its path, size and
+    modification time. Can be called from any thread. The pin count and
+    bounding box of files in the old format are None, see measureSymbol."""
+    sections = readSections(fileName, [b'META', b'BODY', b'SYMS'])
+    texts = []
+    if sections is not None and b'META' in sections and b'BODY' in sections:
+        metadata = json.loads(sections[b'META'].decode('utf-8'))
+        body = json.loads(zlib.decompress(sections[b'BODY']).decode('utf-8'))
+        recordTexts(body['items'], texts)
+        # Text inside shared symbol definitions
+        if b'SYMS' in sections:
+            definitions = json.loads(zlib.decompress(sections[b'SYMS']).decode('utf-8'))
+            for definition in definitions:
+                recordTexts(definition['items'], texts)
+    else:
+        # Unpickling only restores the attributes of the items, which is
+        # enough to find their text but not their size
+        with open(fileName, 'rb') as file:
+            root = pickle.load(file)
+        metadata = {'pins': None, 'bbox': None}
+        items = list(root.listOfItems)
+        while len(items) > 0:
+            state = items.pop().__dict__
+            if 'listOfItems' in state:
+                items.extend(state['listOfItems'])
+            elif 'htmlText' in state:
+                texts.append(state.get('latexExpression') or plainText(state['htmlText']))
+    name = os.path.splitext(os.path.basename(fileName))[0]
+    folder = os.path.basename(os.path.dirname(os.path.abspath(fileName)))
+    text = ' '.join(text for text in texts if text)
+    tags = sorted(set(splitWords(name) + splitWords(folder) + splitWords(text)))
+    return {
+        'name': name,
+        'folder': folder,
+        'pins': metadata['pins'],
+        'bbox': metadata['bbox'],
+        'tags': tags,
+        'text': text}
+
+
+def measureSymbol(fileName):
+    """Returns the pin count and bounding box of a symbol file by building
+    it. Must be called from the GUI thread."""
+    metadata = json.loads(encodeMetadata(loadSchematicFile(fileName)).decode('utf-8'))
+    return metadata['pins'], metadata['bbox']
+
+
+def scanFolders(folders, entries):
+    """Returns the entries of the symbols in folders that are not in
+    entries or changed since, and the paths of all symbols found"""
+    seen = set()
+    changed = {}
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for fileName in files:
+                if not fileName.endswith('.sym'):
+                    continue
+                path = os.path.join(root, fileName)
+                seen.add(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entry = entries.get(path)
+                if entry is not None and entry['mtime'] == stat.st_mtime_ns \
+                        and entry['size'] == stat.st_size:
+                    continue
+                try:
+                    entry = readSymbol(path)
+                except:
+                    logger.warning('Could not index symbol %s', path)
+                    continue
+                entry['mtime'], entry['size'] = stat.st_mtime_ns, stat.st_size
+                changed[path] = entry
+    return changed, seen
+
+
+def isSubsequence(query, text):
+    """Returns the number of characters skipped in text to find all of query
+    in order, or None if it cannot be found"""
+    position = 0
+    skipped = 0
+    for char in query:
+        found = text.find(char, position)
+        if found == -1:
+            return None
+        skipped += found - position
+        position = found + 1
+    return skipped
+
+
+def scoreWord(word, name, words, tags, text):
+    """Scores how well one query word matches a symbol. Matches on the name
+    rank above matches on its tags and text."""
+    if name == word:
+        return 100
+    if name.startswith(word):
+        return 80
+    if any(nameWord.startswith(word) for nameWord in words):
+        return 60
+    if word in name:
+        return 40
+    if any(tag.startswith(word) for tag in tags):
+        return 30
+    if word in text:
+        return 20
+    skipped = isSubsequence(word, name)
+    if skipped is not None:
+        return max(1, 10 - skipped)
+    return 0
+
+
+class IndexSignals(QtCore.QObject):
+    # Entries that changed and the paths of all symbols found
+    finished = QtCore.pyqtSignal(object, object)
+
+
+class IndexTask(QtCore.QRunnable):
+    """Scans the symbol folders on a worker thread"""
+
+    def __init__(self, folders, entries, signals):
+        super().__init__()
+        self.folders = folders
+        self.entries = entries
+        self.signals = signals
+
+    def run(self):
+        changed, seen = scanFolders(self.folders, self.entries)
+        self.signals.finished.emit(changed, seen)
+
+
+class SymbolLibrary(QtCore.QObject):
+    """Keeps the index of all symbols in folders. changed is emitted when
+    the index is updated because files were added, removed or edited."""
+
+    changed = QtCore.pyqtSignal()
+
+    def __init__(self, indexFile='.symbolindex', parent=None):
+        super().__init__(parent)
+        self.indexFile = indexFile
+        self.folders = []
+        self.entries = {}
+        # Lower case copies used for searching
+        self.searchData = {}
+        self.watcher = QtCore.QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(lambda x: self.updateTimer.start())
+        self.updateTimer = QtCore.QTimer(self)
+        self.updateTimer.setInterval(500)
+        self.updateTimer.setSingleShot(True)
+        self.updateTimer.timeout.connect(self.update)
+        self.threadPool = QtCore.QThreadPool(self)
+        self.threadPool.setMaxThreadCount(1)
+        self.signals = IndexSignals(self)
+        self.signals.finished.connect(self.scanFinished)
+        self.scanning = False
+        # Set if the folders changed while they were being scanned
+        self.scanAgain = False
+        # Files in the old format that still have to be measured
+        self.measureQueue = []
+        self.measureTimer = QtCore.QTimer(self)
+        self.measureTimer.setInterval(0)
+        self.measureTimer.timeout.connect(self.measureNext)
+        self.loadIndex()
+
+    def setFolders(self, folders):
+        """Sets the folders to index, ignoring duplicates and folders that
+        do not exist, and updates the index"""
+        self.folders = []
+        for folder in folders:
+            folder = os.path.abspath(folder)
+            if os.path.isdir(folder) and folder not in self.folders:
+                self.folders.append(folder)
+        if len(self.watcher.directories()) > 0:
+            self.watcher.removePaths(self.watcher.directories())
+        if len(self.folders) > 0:
+            self.watcher.addPaths(self.folders)
+        logger.info('Indexing symbol folders %s', self.folders)
+        self.update()
+
+    def loadIndex(self):
+        try:
+            with open(self.indexFile, 'rb') as file:
+                index = json.loads(zlib.decompress(file.read()).decode('utf-8'))
+        except (OSError, ValueError, zlib.error):
+            return
+        if index.get('version') != INDEX_VERSION:
+            return
+        self.entries = index['entries']
+        for path, entry in self.entries.items():
+            self.addSearchData(path, entry)
+            if entry['bbox'] is None:
+                self.measureQueue.append(path)
+        if len(self.measureQueue) > 0:
+            self.measureTimer.start()
+
+    def saveIndex(self):
+        index = {'version': INDEX_VERSION, 'entries': self.entries}
+        data = zlib.compress(json.dumps(index, separators=(',', ':')).encode('utf-8'))
+        try:
+            with open(self.indexFile + '.tmp', 'wb') as file:
+                file.write(data)
+            os.replace(self.indexFile + '.tmp', self.indexFile)
+        except OSError:
+            logger.warning('Could not save the symbol index to %s', self.indexFile)
+
+    def addSearchData(self, path, entry):
+        name = entry['name'].lower()
+        self.searchData[path] = (
+            name, splitWords(entry['name']), entry['tags'], entry['text'].lower())
+
+    def update(self):
+        """Starts reading the symbols that were added or changed since the
+        last update on the worker thread. The ones that were removed are
+        forgotten once it is done."""
+        if self.scanning is True:
+            self.scanAgain = True
+            return
+        self.scanning = True
+        self.scanAgain = False
+        entries = {path: {'mtime': entry['mtime'], 'size': entry['size']}
+                   for path, entry in self.entries.items()}
+        self.threadPool.start(IndexTask(list(self.folders), entries, self.signals))
+
+    def scanFinished(self, changed, seen):
+        self.scanning = False
+        modified = len(changed) > 0
+        for path, entry in changed.items():
+            self.entries[path] = entry
+            self.addSearchData(path, entry)
+            if entry['bbox'] is None and path not in self.measureQueue:
+                self.measureQueue.append(path)
+        for path in list(self.entries):
+            if path not in seen:
+                del self.entries[path]
+                self.searchData.pop(path, None)
+                modified = True
+        if modified is True:
+            logger.info('Symbol index updated, %d symbols', len(self.entries))
+            self.saveIndex()
+            self.changed.emit()
+        if len(self.measureQueue) > 0:
+            self.measureTimer.start()
+        if self.scanAgain is True:
+            self.update()
+
+    def measureNext(self):
+        """Measures the next file in the old format"""
+        path = self.measureQueue.pop(0)
+        entry = self.entries.get(path)
+        if entry is not None:
+            try:
+                entry['pins'], entry['bbox'] = measureSymbol(path)
+            except:
+                logger.warning('Could not measure symbol %s', path)
+        if len(self.measureQueue) == 0:
+            self.measureTimer.stop()
+            self.saveIndex()
+
+    def waitForDone(self):
+        """Blocks until the folders are scanned and delivers the result"""
+        self.threadPool.waitForDone()
+        QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.MetaCall)
+
+    def search(self, query, limit=None):
+        """Returns the paths of the symbols matching every word of query,
+        best matches first"""
+        queryWords = query.lower().split()
+        if len(queryWords) == 0:
+            return []
+        results = []
+        for path, (name, words, tags, text) in self.searchData.items():
+            total = 0
+            for word in queryWords:
+                score = scoreWord(word, name, words, tags, text)
+                if score == 0:
+                    break
+                total += score
+            else:
+                results.append((-total, len(name), name, path))
+        results.sort()
+        paths = [result[3] for result in results]
+        if limit is not None:
+            paths = paths[:limit]
+        return paths
@@ -0,0 +1,464 @@
+"""Persistent cache of the previews shown in the symbol browser, the recent
+symbols list and the file dialogs.
+
+Thumbnails are stored as PNG files in the cache directory of the user, or in
+another directory given to ThumbnailCache. They are named after a hash
+of the path, modification time, size and content hash of the file they show
+and the icon size. Editing a file therefore never shows a stale preview. A
+file's modification time is updated whenever its thumbnail is used, and the
+least recently used thumbnails are deleted once the directory grows beyond
+its size cap.
+
+ThumbnailLoader produces thumbnails for list models on a thread pool. Only
+QImages are used off the GUI thread; they become pixmaps once they arrive.
+The workers only decode previews stored in the files. Files without one are
+rendered on the GUI thread, one per turn of the event loop. They are mostly
+legacy pickled files, which have to be built into items before they can be
+drawn, and text boxes and images create pixmaps and QObjects while they are
+built. Neither is safe outside the GUI thread. File dialogs ask for icons on
+a thread of their own and hand such files to an IconRenderer.
+"""
+from PyQt5 import QtCore, QtGui, QtWidgets
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger('YCircuit.thumbnails')
+
+
+class ThumbnailCache(object):
+    """Looks up and stores thumbnails in directory. Up to maxSize bytes are
+    kept on disk and the maxPixmaps most recently used thumbnails are also
+    kept in memory. key, findImage and storeImage can be called from worker
+    threads, and so can find and insert, which file dialogs call from their
+    icon thread. Everything else must run on the GUI thread.
+
+    directory defaults to a folder in the standard cache location of the
+    application, which is looked up when it is first needed so that the
+    application name has been set by then."""
+
+    def __init__(self, directory=None, maxSize=32*1024*1024, maxPixmaps=500):
+        self._directory = directory
+        self.maxSize = maxSize
+        self.maxPixmaps = maxPixmaps
+        self.pixmaps = OrderedDict()
+        # Content hashes of files, keyed by path, modification time and size
+        self.contentHashes = {}
+        # Total size of the cache directory, found when it is first needed
+        self.totalSize = None
+        self.lock = threading.Lock()
+        self.pixmapLock = threading.Lock()
+
+    @property
+    def directory(self):
+        if self._directory is None:
+            cacheLocation = QtCore.QStandardPaths.writableLocation(
+                QtCore.QStandardPaths.CacheLocation)
+            self._directory = os.path.join(cacheLocation, 'thumbnails')
+        return self._directory
+
+    def key(self, fileName, iconSize):
+        """Returns the cache key of the thumbnail of fileName. Raises OSError
+        if the file cannot be read."""
+        signature = self.signature(fileName)
+        if signature not in self.contentHashes:
+            with open(fileName, 'rb') as file:
+                self.contentHashes[signature] = hashlib.sha1(file.read()).hexdigest()
+        return self.keyFromSignature(signature, iconSize)
+
+    def knownKey(self, fileName, iconSize):
+        """Returns the cache key of the thumbnail of fileName if its content
+        hash is already known, without reading the file, or None"""
+        try:
+            signature = self.signature(fileName)
+        except OSError:
+            return None
+        if signature not in self.contentHashes:
+            return None
+        return self.keyFromSignature(signature, iconSize)
+
+    def signature(self, fileName):
+        stat = os.stat(fileName)
+        return (os.path.abspath(fileName), stat.st_mtime_ns, stat.st_size)
+
+    def keyFromSignature(self, signature, iconSize):
+        key = '%s|%d|%d|%s|%d' % (signature + (self.contentHashes[signature], iconSize))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def thumbnailFile(self, key):
+        return os.path.join(self.directory, key + '.png')
+
+    def find(self, key):
+        """Returns the cached QPixmap for key, or None"""
+        pix = self.findPixmap(key)
+        if pix is not None:
+            return pix
+        image = self.findImage(key)
+        if image is None:
+            return None
+        pix = QtGui.QPixmap.fromImage(image)
+        self.remember(key, pix)
+        return pix
+
+    def findPixmap(self, key):
+        """Returns the QPixmap for key if it is kept in memory, or None"""
+        with self.pixmapLock:
+            if key not in self.pixmaps:
+                return None
+            self.pixmaps.move_to_end(key)
+            return self.pixmaps[key]
+
+    def findImage(self, key):
+        """Returns the thumbnail stored on disk for key as a QImage, or
+        None"""
+        thumbnailFile = self.thumbnailFile(key)
+        if not os.path.isfile(thumbnailFile):
+            return None
+        image = QtGui.QImage()
+        if image.load(thumbnailFile, 'PNG') is False:
+            return None
+        try:
+            # Mark the thumbnail as recently used
+            os.utime(thumbnailFile, None)
+        except OSError:
+            pass
+        return image
+
+    def insert(self, key, pix):
+        """Stores pix under key in memory and on disk"""
+        self.remember(key, pix)
+        self.storeImage(key, pix.toImage())
+
+    def storeImage(self, key, image):
+        """Stores image under key on disk"""
+        thumbnailFile = self.thumbnailFile(key)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first so that a partly written
+            # thumbnail is never picked up
+            temporaryFile = '%s.%d.tmp' % (thumbnailFile, threading.get_ident())
+            if image.save(temporaryFile, 'PNG') is False:
+                return
+            os.replace(temporaryFile, thumbnailFile)
+            size = os.path.getsize(thumbnailFile)
+        except OSError:
+            logger.warning('Could not write thumbnail %s', thumbnailFile)
+            return
+        with self.lock:
+            if self.totalSize is None:
+                self.totalSize = sum(size for path, mtime, size in self.entries())
+            else:
+                self.totalSize += size
+            if self.totalSize > self.maxSize:
+                self.evict()
+
+    def remember(self, key, pix):
+        with self.pixmapLock:
+            self.pixmaps[key] = pix
+            self.pixmaps.move_to_end(key)
+            while len(self.pixmaps) > self.maxPixmaps:
+                self.pixmaps.popitem(last=False)
+
+    def entries(self):
+        """Returns (path, modification time, size) for every thumbnail on
+        disk"""
+        entries = []
+        try:
+            fileNames = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for fileName in fileNames:
+            if not fileName.endswith('.png'):
+                continue
+            path = os.path.join(self.directory, fileName)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def evict(self):
+        """Deletes the least recently used thumbnails until the cache is
+        below three quarters of its size cap"""
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        self.totalSize = sum(size for path, mtime, size in entries)
+        removed = 0
+        for path, mtime, size in entries:
+            if self.totalSize <= self.maxSize*0.75:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.totalSize -= size
+            removed += 1
+        logger.info('Evicted %d thumbnails from %s', removed, self.directory)
+
+    def clear(self):
+        with self.pixmapLock:
+            self.pixmaps.clear()
+        with self.lock:
+            for path, mtime, size in self.entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.totalSize = 0
+
+
+class ThumbnailSignals(QtCore.QObject):
+    # File path, cache key and thumbnail. The key is empty if the file could
+    # not be read.
+    finished = QtCore.pyqtSignal(str, str, QtGui.QImage)
+    # File path and cache key of a file without a stored preview, which has
+    # to be rendered on the GUI thread
+    unrendered = QtCore.pyqtSignal(str, str)
+
+
+class ThumbnailTask(QtCore.QRunnable):
+    """Finds the thumbnail of one file on a worker thread, in the cache or
+    in the preview stored in the file"""
+
+    def __init__(self, filePath, iconProvider, cache, signals):
+        super().__init__()
+        self.filePath = filePath
+        self.iconProvider = iconProvider
+        self.cache = cache
+        self.signals = signals
+        self.cancelled = False
+
+    def run(self):
+        if self.cancelled is True:
+            return
+        image = QtGui.QImage()
+        try:
+            key = self.cache.key(self.filePath, self.iconProvider.iconSize)
+        except OSError:
+            self.signals.finished.emit(self.filePath, '', image)
+            return
+        cachedImage = self.cache.findImage(key)
+        if cachedImage is not None:
+            image = cachedImage
+        else:
+            if self.cancelled is True:
+                return
+            try:
+                storedImage = self.iconProvider.storedIconImage(self.filePath)
+            except:
+                logger.warning('Could not read the preview of %s', self.filePath)
+                storedImage = image
+            if storedImage is None:
+                self.signals.unrendered.emit(self.filePath, key)
+                return
+            image = storedImage
+            if not image.isNull():
+                self.cache.storeImage(key, image)
+        self.signals.finished.emit(self.filePath, key, image)
+
+
+class ThumbnailLoader(QtCore.QObject):
+    """Hands out thumbnails to list models without blocking the GUI thread.
+    Until a thumbnail is ready, a placeholder icon is returned and the file
+    is queued on a thread pool. iconReady is emitted with the file path once
+    the thumbnail is available, so models can emit dataChanged for it.
+
+    Views passed to watchView cancel the queued work of rows that are
+    scrolled out of sight."""
+
+    iconReady = QtCore.pyqtSignal(str)
+
+    def __init__(self, iconProvider, cache=None, parent=None):
+        super().__init__(parent)
+        self.iconProvider = iconProvider
+        self.cache = cache if cache is not None else thumbnailCache
+        self.placeholder = QtWidgets.QFileIconProvider().icon(QtWidgets.QFileIconProvider.File)
+        self.threadPool = QtCore.QThreadPool(self)
+        self.threadPool.setMaxThreadCount(max(1, QtCore.QThread.idealThreadCount() - 1))
+        self.signals = ThumbnailSignals(self)
+        self.signals.finished.connect(self.taskFinished)
+        self.signals.unrendered.connect(self.queueRender)
+        # Queued and running tasks, and the model indexes that asked for them
+        self.pending = {}
+        self.failed = set()
+        # Files and cache keys waiting to be rendered on the GUI thread
+        self.renderQueue = []
+        self.renderTimer = QtCore.QTimer(self)
+        self.renderTimer.setInterval(0)
+        self.renderTimer.timeout.connect(self.renderNext)
+        self.cancelTimer = QtCore.QTimer(self)
+        self.cancelTimer.setInterval(100)
+        self.cancelTimer.setSingleShot(True)
+        self.cancelTimer.timeout.connect(self.cancelHidden)
+        self.views = []
+
+    def icon(self, filePath, index=None):
+        """Returns the thumbnail of filePath as a QIcon if it is ready, and
+        the placeholder icon otherwise. index is the model index showing the
+        file."""
+        key = self.cache.knownKey(filePath, self.iconProvider.iconSize)
+        if key is not None:
+            if key in self.failed:
+                return self.placeholder
+            pix = self.cache.findPixmap(key)
+            if pix is not None:
+                icon = QtGui.QIcon()
+                icon.addPixmap(pix)
+                return icon
+        if filePath in self.pending:
+            task, indexes = self.pending[filePath]
+        else:
+            task = ThumbnailTask(filePath, self.iconProvider, self.cache, self.signals)
+            indexes = []
+            self.pending[filePath] = (task, indexes)
+            self.threadPool.start(task)
+        if index is not None and index.isValid():
+            index = QtCore.QPersistentModelIndex(index)
+            if index not in indexes:
+                indexes.append(index)
+        return self.placeholder
+
+    def taskFinished(self, filePath, key, image):
+        # Tasks that had already started when they were cancelled still
+        # finish. Their thumbnail is kept, but nobody is waiting for it.
+        requested = self.pending.pop(filePath, None) is not None
+        if key == '':
+            return
+        if image.isNull():
+            self.failed.add(key)
+        else:
+            self.cache.remember(key, QtGui.QPixmap.fromImage(image))
+        if requested is True:
+            self.iconReady.emit(filePath)
+
+    def queueRender(self, filePath, key):
+        if filePath not in self.pending:
+            return
+        self.renderQueue.append((filePath, key))
+        self.renderTimer.start()
+
+    def renderNext(self):
+        """Renders the next file without a stored preview"""
+        while len(self.renderQueue) > 0:
+            filePath, key = self.renderQueue.pop(0)
+            # Skip files that were cancelled meanwhile
+            if filePath in self.pending:
+                break
+        else:
+            self.renderTimer.stop()
+            return
+        image = QtGui.QImage()
+        try:
+            image = self.iconProvider.iconImage(filePath)
+        except:
+            logger.warning('Could not create a thumbnail for %s', filePath)
+        if not image.isNull():
+            self.cache.storeImage(key, image)
+        self.taskFinished(filePath, key, image)
+        if len(self.renderQueue) == 0:
+            self.renderTimer.stop()
+
+    def watchView(self, view):
+        """Cancels the thumbnails of rows that leave view when it is
+        scrolled or resized"""
+        self.views.append(view)
+        view.verticalScrollBar().valueChanged.connect(self.cancelTimer.start)
+        view.horizontalScrollBar().valueChanged.connect(self.cancelTimer.start)
+        view.verticalScrollBar().rangeChanged.connect(self.cancelTimer.start)
+
+    def cancelHidden(self):
+        for filePath, (task, indexes) in list(self.pending.items()):
+            visible = False
+            # Finding the rects can ask the models for icons again
+            for index in list(indexes):
+                for view in self.views:
+                    if index.model() is view.model() and index.isValid():
+                        rect = view.visualRect(QtCore.QModelIndex(index))
+                        if rect.intersects(view.viewport().rect()):
+                            visible = True
+            if visible is False and len(indexes) > 0:
+                self.cancel(filePath)
+
+    def cancel(self, filePath):
+        """Drops the thumbnail of filePath if it has not been produced yet.
+        It is queued again the next time it is asked for."""
+        if filePath not in self.pending:
+            return
+        task, indexes = self.pending.pop(filePath)
+        # Queued tasks stay in the thread pool, but return right away
+        task.cancelled = True
+        logger.info('Cancelled thumbnail of %s', filePath)
+
+    def shutdown(self):
+        """Cancels all queued work and waits for running tasks"""
+        for filePath in list(self.pending):
+            self.cancel(filePath)
+        self.renderTimer.stop()
+        self.renderQueue = []
+        self.threadPool.waitForDone()
+
+
+class IconRenderer(QtCore.QObject):
+    """Renders previews on the GUI thread for file dialogs, which ask for
+    icons on their own thread. render waits until the preview is ready, so
+    stop has to be called before the GUI thread can wait for the icon thread,
+    e.g. when the dialog is closed and torn down."""
+
+    requested = QtCore.pyqtSignal(object)
+
+    def __init__(self, iconProvider, timeout=10, parent=None):
+        super().__init__(parent)
+        self.iconProvider = iconProvider
+        self.timeout = timeout
+        self.stopped = False
+        # Requests that an icon thread is waiting for
+        self.waiting = []
+        self.lock = threading.Lock()
+        self.requested.connect(self.renderRequest)
+
+    def render(self, filePath):
+        """Returns the preview of filePath as a QImage, or None if it could
+        not be rendered in time or the renderer was stopped"""
+        if QtCore.QThread.currentThread() is self.thread():
+            return self.iconProvider.iconImage(filePath)
+        request = {'filePath': filePath, 'image': None, 'done': threading.Event()}
+        with self.lock:
+            if self.stopped is True:
+                return None
+            self.waiting.append(request)
+        self.requested.emit(request)
+        request['done'].wait(self.timeout)
+        with self.lock:
+            if request in self.waiting:
+                self.waiting.remove(request)
+            # Tell the GUI thread not to bother if it has not started yet
+            request['done'].set()
+            return request['image']
+
+    def renderRequest(self, request):
+        with self.lock:
+            if request['done'].is_set():
+                return
+        try:
+            image = self.iconProvider.iconImage(request['filePath'])
+        except:
+            logger.warning('Could not create a thumbnail for %s', request['filePath'])
+            image = None
+        with self.lock:
+            request['image'] = image
+            request['done'].set()
+
+    def stop(self):
+        """Releases the waiting icon threads and makes render return None
+        from now on"""
+        with self.lock:
+            self.stopped = True
+            for request in self.waiting:
+                request['done'].set()
+            self.waiting = []
+
+
+# Shared by all icon providers
+thumbnailCache = ThumbnailCache()
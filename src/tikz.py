@@ -0,0 +1,318 @@
+"""Streaming TikZ output.
+
+Items yield their TikZ code in fragments through latexFragments(). The
+writer passes those fragments straight to the output stream, so the whole
+document never has to be held in memory as one string.
+
+Symbols that are placed more than once are written a single time as a
+\\pic and every instance becomes one \\pic command with a transform. Top
+level nets that share a layer and a pen are joined into polylines and
+drawn with a single path, and so are the junctions of a layer.
+"""
+from PyQt5 import QtCore, QtGui
+from .components import Image, Junction, Net, TextBox, myGraphicsItemGroup, xyFromPoint
+import logging
+import math
+
+logger = logging.getLogger('YCircuit.tikz')
+
+
+class TikzWriter(object):
+    """Writes a TikZ picture to stream, one fragment at a time.
+
+    Top level items are bucketed by layer in a single pass and every layer is
+    emitted as one pgfonlayer block. If clipRect is given, each layer is
+    clipped to it. If reuseSymbols is True, repeated symbols are defined
+    once as pics. If mergeNets is True, connected nets are coalesced."""
+
+    def __init__(self, stream, scaleFactor=1., clipRect=None, reuseSymbols=True, mergeNets=True):
+        self.stream = stream
+        self.scaleFactor = scaleFactor
+        self.clipRect = clipRect
+        self.reuseSymbols = reuseSymbols
+        self.mergeNets = mergeNets
+        # Maps pic bodies to their names and top level items to their pics
+        self.pics = {}
+        self.picInstances = {}
+
+    def bucketLayers(self, itemsToExport):
+        """Returns the layer range spanned by itemsToExport and a dictionary
+        mapping each layer to its top level items, preserving their order"""
+        min_, max_ = None, None
+        layers = {}
+        for item in itemsToExport:
+            z = int(item.zValue())
+            if min_ is None or z < min_:
+                min_ = z
+            if max_ is None or z > max_:
+                max_ = z
+            if item.parentItem() is None:
+                layers.setdefault(z, []).append(item)
+        if min_ is None:
+            return range(0), layers
+        return range(min_, max_ + 1), layers
+
+    def collectSymbols(self, layers):
+        """Finds the symbols that are placed at least twice with identical
+        contents and names a pic for each of them"""
+        counts = {}
+        bodies = {}
+        for items in layers.values():
+            for item in items:
+                if canBePic(item):
+                    body = ''.join(item.latexFragments(item))
+                    # Share one copy of the string between identical symbols
+                    body = bodies.setdefault(body, body)
+                    counts[body] = counts.get(body, 0) + 1
+                    self.picInstances[item] = body
+        for body in bodies:
+            if counts[body] > 1:
+                self.pics[body] = 'symbol' + str(len(self.pics) + 1)
+        self.picInstances = {
+            item: self.pics[body]
+            for item, body in self.picInstances.items()
+            if body in self.pics}
+        logger.info('Found %d symbols used more than once', len(self.pics))
+
+    def write(self, itemsToExport):
+        layerRange, layers = self.bucketLayers(itemsToExport)
+        if self.reuseSymbols is True:
+            self.collectSymbols(layers)
+        write = self.stream.write
+        write('\\scalebox{%s}{\\begin{tikzpicture}\n' %(self.scaleFactor))
+        for i in layerRange:
+            write('\\pgfdeclarelayer{%d}\n' %i)
+        if len(layerRange) > 0:
+            write('\\pgfsetlayers{' + ','.join(str(i) for i in layerRange) + '}\n')
+        for body, name in self.pics.items():
+            write('\\tikzset{' + name + '/.pic={\n' + body + '\n}}\n')
+        for layer in sorted(layers):
+            write('\\begin{pgfonlayer}{%d}\n' %layer)
+            if self.clipRect is not None:
+                write('\\clip ' + xyFromPoint(self.clipRect.topLeft()) +
+                      ' rectangle ' + xyFromPoint(self.clipRect.bottomRight()) + ';\n')
+            self.writeLayer(layers[layer])
+            write('\\end{pgfonlayer}\n')
+        write('\\end{tikzpicture}}\n')
+
+    def writeLayer(self, items):
+        """Writes items in order. Each group of nets that can be coalesced is
+        written in place of the first of its nets."""
+        netGroups = {}
+        if self.mergeNets is True:
+            netGroups = groupNets(items)
+        junctionGroups = groupJunctions(items)
+        # The members of every group, collected in one pass
+        netMembers, junctionMembers = {}, {}
+        for item in items:
+            if item in junctionGroups:
+                junctionMembers.setdefault(junctionGroups[item], []).append(item)
+            elif item in netGroups:
+                netMembers.setdefault(netGroups[item], []).append(item)
+        for item in items:
+            if item in junctionGroups:
+                junctions = junctionMembers.pop(junctionGroups[item], None)
+                if junctions is not None:
+                    self.writeJunctions(junctionGroups[item], junctions)
+            elif item in netGroups:
+                nets = netMembers.pop(netGroups[item], None)
+                if nets is not None:
+                    self.writeNets(netGroups[item], nets)
+            else:
+                self.writeItem(item)
+
+    def writeNets(self, options, nets):
+        write = self.stream.write
+        write('% Drawing ' + str(len(nets)) + ' nets\n')
+        write(options)
+        separator = ''
+        for polyline in netPolylines(nets, canChainCorners(nets[0])):
+            write(separator + ' -- '.join(xyFromPoint(point) for point in polyline))
+            separator = ' '
+        write(';\n')
+        write('% End drawing ' + str(len(nets)) + ' nets\n')
+
+    def writeJunctions(self, options, junctions):
+        write = self.stream.write
+        write('% Drawing ' + str(len(junctions)) + ' junctions\n')
+        write(options)
+        radius = ' circle [radius=' + tikzNumber(Junction.radius/100) + ']'
+        write(' '.join(
+            xyFromPoint(junction.mapToScene(QtCore.QPointF(0, 0))) + radius
+            for junction in junctions))
+        write(';\n')
+        write('% End drawing ' + str(len(junctions)) + ' junctions\n')
+
+    def writeItem(self, item):
+        write = self.stream.write
+        write('% Drawing ' + str(item) + '\n')
+        if item in self.picInstances:
+            write('\\pic[' + picTransform(item) + '] {' + self.picInstances[item] + '};')
+        else:
+            for fragment in item.latexFragments():
+                write(fragment)
+        write('\n')
+        write('% End drawing ' + str(item) + '\n')
+
+
+def canBePic(item):
+    """Symbols can only become pics if all of their contents follow the pic
+    transform. Text nodes and images do not, so those are drawn inline."""
+    if not isinstance(item, myGraphicsItemGroup):
+        return False
+    if hasattr(item, 'isPin') and item.isPin is True:
+        return False
+    return all(canBeInPic(child) for child in item.contentItems())
+
+
+def canBeInPic(item):
+    if isinstance(item, (TextBox, Image)):
+        return False
+    if isinstance(item, myGraphicsItemGroup):
+        return all(canBeInPic(child) for child in item.contentItems())
+    return True
+
+
+def tikzNumber(value):
+    """Formats value without exponents, which TikZ cannot parse"""
+    number = ('%.6f' % value).rstrip('0').rstrip('.')
+    if number == '-0':
+        number = '0'
+    return number
+
+
+def picTransform(item):
+    """Returns the cm option that maps the coordinates of item to the scene.
+    The y axis is inverted in TikZ, so the off-diagonal terms and the y
+    translation change sign."""
+    transform_ = item.sceneTransform()
+    values = [
+        transform_.m11(), -transform_.m12(), -transform_.m21(), transform_.m22()]
+    translation = (transform_.dx()/100, -transform_.dy()/100)
+    return 'cm={' + ','.join(tikzNumber(value) for value in values) + \
+        ',(' + tikzNumber(translation[0]) + ',' + tikzNumber(translation[1]) + ')}'
+
+
+def groupNets(items):
+    """Maps the top level solid, opaque nets in items to their TikZ options.
+    Nets with identical options can be drawn as one path. Dash patterns
+    would restart differently on a merged path, and a path is stroked once,
+    so translucent nets that overlap or meet would no longer blend where
+    they do. Such nets are left alone."""
+    groups = {}
+    for item in items:
+        if isinstance(item, Net) and item.localPenStyle == QtCore.Qt.SolidLine and \
+                QtGui.QColor(item.localPenColour).alpha() == 255:
+            groups[item] = item.latexOptions(rotate=False)
+    return groups
+
+
+def groupJunctions(items):
+    """Maps the top level junctions in items to their TikZ options. All
+    junctions with the same options are drawn as one path of circles."""
+    return {
+        item: item.latexOptions(rotate=False)
+        for item in items if isinstance(item, Junction)}
+
+
+def canChainCorners(net):
+    """Two segments meeting at a corner only look the same as a polyline
+    if the caps fill the corner the way the join would"""
+    cap, join = net.localPenCapStyle, net.localPenJoinStyle
+    if cap == QtCore.Qt.RoundCap and join == QtCore.Qt.RoundJoin:
+        return True
+    if cap == QtCore.Qt.SquareCap and join == QtCore.Qt.MiterJoin:
+        return 'rightAngles'
+    return False
+
+
+def pointKey(point):
+    return (round(point.x(), 3), round(point.y(), 3))
+
+
+def mergeCollinear(nets):
+    """Returns the segments of nets in scene coordinates, with segments that
+    lie on the same line and touch or overlap merged into one. This only
+    looks the same for opaque pens."""
+    lines = {}
+    segments = []
+    for net in nets:
+        line = net.line()
+        p1, p2 = net.mapToScene(line.p1()), net.mapToScene(line.p2())
+        dx, dy = p2.x() - p1.x(), p2.y() - p1.y()
+        length = math.hypot(dx, dy)
+        if length == 0:
+            segments.append((p1, p2))
+            continue
+        ux, uy = dx/length, dy/length
+        # Give every line a canonical direction
+        if ux < -1e-9 or (abs(ux) <= 1e-9 and uy < 0):
+            ux, uy = -ux, -uy
+        offset = p1.x()*uy - p1.y()*ux
+        key = (round(ux, 6), round(uy, 6), round(offset, 3))
+        t1, t2 = p1.x()*ux + p1.y()*uy, p2.x()*ux + p2.y()*uy
+        if t1 > t2:
+            t1, t2, p1, p2 = t2, t1, p2, p1
+        lines.setdefault(key, []).append((t1, t2, p1, p2))
+    for intervals in lines.values():
+        intervals.sort(key=lambda interval: interval[0])
+        start, end, startPoint, endPoint = intervals[0]
+        for t1, t2, p1, p2 in intervals[1:]:
+            if t1 <= end + 1e-3:
+                if t2 > end:
+                    end, endPoint = t2, p2
+            else:
+                segments.append((startPoint, endPoint))
+                start, end, startPoint, endPoint = t1, t2, p1, p2
+        segments.append((startPoint, endPoint))
+    return segments
+
+
+def isRightAngle(a, b, c):
+    return abs((a.x() - b.x())*(c.x() - b.x()) + (a.y() - b.y())*(c.y() - b.y())) < 1e-6
+
+
+def netPolylines(nets, chainCorners=False):
+    """Returns the nets as a list of polylines. Collinear segments are always
+    merged. Segments meeting at a corner that no other segment touches are
+    chained if chainCorners allows it."""
+    segments = mergeCollinear(nets)
+    if chainCorners is False:
+        return [[p1, p2] for p1, p2 in segments]
+    edges = {}
+    for index, (p1, p2) in enumerate(segments):
+        edges.setdefault(pointKey(p1), []).append(index)
+        edges.setdefault(pointKey(p2), []).append(index)
+    visited = set()
+    polylines = []
+
+    def walk(key, index):
+        p1, p2 = segments[index]
+        polyline = [p1, p2] if pointKey(p1) == key else [p2, p1]
+        visited.add(index)
+        while True:
+            key = pointKey(polyline[-1])
+            if len(edges[key]) != 2:
+                break
+            index = [i for i in edges[key] if i != index][0]
+            if index in visited:
+                break
+            p1, p2 = segments[index]
+            nextPoint = p2 if pointKey(p1) == key else p1
+            if chainCorners == 'rightAngles' and \
+                    not isRightAngle(polyline[-2], polyline[-1], nextPoint):
+                break
+            visited.add(index)
+            polyline.append(nextPoint)
+        return polyline
+
+    # Start from the ends of chains first so that they are not split
+    for key, indices in edges.items():
+        if len(indices) != 2:
+            for index in indices:
+                if index not in visited:
+                    polylines.append(walk(key, index))
+    for index, (p1, p2) in enumerate(segments):
+        if index not in visited:
+            polylines.append(walk(pointKey(p1), index))
+    return polylines
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+pytest.importorskip('PyQt5.QtWidgets')
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository)
+# Symbol paths are recorded relative to the working directory
+os.chdir(repository)
+
+examples = os.path.join(repository, 'Resources', 'Examples')
+
+
+def example(*path):
+    return os.path.join(examples, *path)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from src.headless import createApplication
+    return createApplication()
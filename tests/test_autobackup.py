@@ -0,0 +1,146 @@
+from PyQt5 import QtCore
+
+from conftest import example
+from src.autobackup import (
+    AutobackupJournal, AutobackupWriter, encodePut, encodeRemove, loadAutobackupFile)
+from src.commands import ChangePen, Move, Rotate
+from src.components import Junction, myGraphicsItemGroup
+from src.fileformat import Snapshot
+from src.headless import loadSchematic
+
+
+def topLevelItems(scene):
+    return [item for item in scene.items() if item.parentItem() is None]
+
+
+def takeSnapshot(items):
+    x = min([item.scenePos().x() for item in items])
+    y = min([item.scenePos().y() for item in items])
+    origin = QtCore.QPointF(x, y)
+    saveObject = myGraphicsItemGroup(None, origin, [])
+    saveObject.origin = origin
+    return Snapshot(saveObject, items), origin
+
+
+def test_waitForDoneDeliversResult(app, tmp_path):
+    scene = loadSchematic(example('Inverter', 'inverter.sch'))
+    items = topLevelItems(scene)
+    snapshot, origin = takeSnapshot(items)
+    writer = AutobackupWriter()
+    written = []
+    writer.written.connect(lambda revision, fileName: written.append((revision, fileName)))
+    fileName = str(tmp_path / 'backup')
+    assert writer.write(snapshot, fileName, 7) is True
+    writer.waitForDone()
+    assert writer.queued == 0
+    assert written == [(7, fileName)]
+    assert len(loadAutobackupFile(fileName).listOfItems) == len(items)
+
+
+def test_olderBackupIsNotReported(app, tmp_path):
+    scene = loadSchematic(example('Inverter', 'inverter.sch'))
+    snapshot, origin = takeSnapshot(topLevelItems(scene))
+    writer = AutobackupWriter()
+    written = []
+    writer.written.connect(lambda revision, fileName: written.append(revision))
+    writer.write(snapshot, str(tmp_path / 'old'), 1)
+    # A later task supersedes the first one before its result is delivered
+    writer.generation += 1
+    writer.waitForDone()
+    assert writer.queued == 0
+    assert written == []
+
+
+def test_closedJournalIgnoresWrittenCheckpoint(tmp_path):
+    journal = AutobackupJournal()
+    fileName = str(tmp_path / 'backup')
+    journal.reset(fileName, [], QtCore.QPointF(0, 0))
+    journal.close()
+    journal.checkpointWritten(fileName)
+    assert journal.ready is False
+
+
+def test_resetJournalWaitsForItsOwnCheckpoint(tmp_path):
+    oldFile, newFile = str(tmp_path / 'old'), str(tmp_path / 'new')
+    open(oldFile, 'wb').close()
+    journal = AutobackupJournal()
+    journal.reset(oldFile, [], QtCore.QPointF(0, 0))
+    journal.reset(newFile, [], QtCore.QPointF(0, 0))
+    journal.checkpointWritten(oldFile)
+    assert journal.ready is False
+
+
+def itemSummary(items, origin):
+    return sorted(
+        (type(item).__name__, round(item.pos().x() - origin.x(), 3), round(item.pos().y() - origin.y(), 3))
+        for item in items)
+
+
+def test_journalIsReplayedOverCheckpoint(app, tmp_path):
+    scene = loadSchematic(example('Inverter', 'inverter.sch'))
+    items = topLevelItems(scene)
+    snapshot, origin = takeSnapshot(items)
+    fileName = str(tmp_path / 'backup')
+    journal = AutobackupJournal()
+    journal.reset(fileName, items, origin)
+    # Changes made while the checkpoint is written wait for it
+    moved, removed = items[0], items[1]
+    moved.setPos(moved.pos() + QtCore.QPointF(20, 10))
+    journal.recordItems([moved])
+    assert journal.pending != []
+    writer = AutobackupWriter()
+    writer.written.connect(lambda revision, writtenFile: journal.checkpointWritten(writtenFile))
+    writer.write(snapshot, fileName, 1)
+    writer.waitForDone()
+    assert journal.ready is True
+    scene.removeItem(removed)
+    added = Junction(None, origin + QtCore.QPointF(40, 40))
+    scene.addItem(added)
+    journal.recordItems([removed, added])
+    root = loadAutobackupFile(fileName)
+    assert itemSummary(root.listOfItems, QtCore.QPointF(0, 0)) == \
+        itemSummary(topLevelItems(scene), origin)
+
+
+def test_damagedJournalRecordEndsReplay(app, tmp_path):
+    scene = loadSchematic(example('Inverter', 'inverter.sch'))
+    items = topLevelItems(scene)
+    snapshot, origin = takeSnapshot(items)
+    fileName = str(tmp_path / 'backup')
+    with open(fileName, 'wb') as file:
+        file.write(snapshot.encode())
+        file.write(encodeRemove(0))
+        # A record cut short by a crash
+        file.write(encodeRemove(1)[:-1])
+    assert len(loadAutobackupFile(fileName).listOfItems) == len(items) - 1
+
+
+def test_movesAndPenChangesAreRecordedAsDeltas(app, tmp_path):
+    scene = loadSchematic(example('Inverter', 'inverter.sch'))
+    items = topLevelItems(scene)
+    snapshot, origin = takeSnapshot(items)
+    fileName = str(tmp_path / 'backup')
+    with open(fileName, 'wb') as file:
+        file.write(snapshot.encode())
+    journal = AutobackupJournal()
+    journal.reset(fileName, items, origin)
+    journal.checkpointWritten(fileName)
+    group = [item for item in items if isinstance(item, myGraphicsItemGroup)][0]
+    line = [item for item in items if not isinstance(item, myGraphicsItemGroup)][0]
+    assert line.localPenWidth != 7
+    commands = [
+        Move(scene=scene, listOfItems=[group, line],
+             startPoint=QtCore.QPointF(0, 0), stopPoint=QtCore.QPointF(30, -20)),
+        Rotate(scene=scene, listOfItems=[group], point=group.scenePos(), angle=90),
+        ChangePen(item=[line], width=7)]
+    for command in commands:
+        command.redo()
+    journal.recordCommands(commands)
+    # Much smaller than storing the symbol again
+    assert journal.size < len(encodePut(0, group, origin))
+    root = loadAutobackupFile(fileName)
+    assert itemSummary(root.listOfItems, QtCore.QPointF(0, 0)) == itemSummary(items, origin)
+    replayed = dict(zip([id(item) for item in items], root.listOfItems))
+    assert replayed[id(line)].localPenWidth == 7
+    assert not group.transform().isIdentity()
+    assert replayed[id(group)].transform() == group.transform()
@@ -0,0 +1,35 @@
+import gc
+
+from PyQt5 import QtWidgets
+
+from conftest import example
+from src.commands import Ungroup
+from src.components import myGraphicsItemGroup
+from src.headless import loadSchematic, saveScene
+
+
+def test_ungroupSharedSymbolThenSave(app, tmp_path):
+    # Only files in the new format have symbols drawn from shared definitions
+    converted = str(tmp_path / 'converted.sch')
+    saveScene(loadSchematic(example('TIA noise', 'tia_noise.sch')), converted)
+    scene = loadSchematic(converted)
+    groups = [
+        item for item in scene.items()
+        if isinstance(item, myGraphicsItemGroup) and item.parentItem() is None and
+        item.definition is not None]
+    uses = {}
+    for group in groups:
+        uses[id(group.definition)] = uses.get(id(group.definition), 0) + 1
+    # Materializing the only instance of a definition drops the definition
+    group = [group for group in groups if uses[id(group.definition)] == 1][0]
+    undoStack = QtWidgets.QUndoStack()
+    undoStack.push(Ungroup(None, scene, group))
+    for item in scene.selectedItems():
+        item.setSelected(False)
+    gc.collect()
+    saved = str(tmp_path / 'saved.sch')
+    saveScene(scene, saved)
+    topLevel = [item for item in scene.items() if item.parentItem() is None]
+    reloadedScene = loadSchematic(saved)
+    reloaded = [item for item in reloadedScene.items() if item.parentItem() is None]
+    assert len(reloaded) == len(topLevel)
@@ -0,0 +1,94 @@
+from PyQt5 import QtCore, QtWidgets
+
+from conftest import example
+from src.components import Junction, Net
+from src.connectivity import NetGraph, sceneLine
+from src.headless import cleanupFile, loadSchematic
+
+
+def countNets(scene):
+    return len([item for item in scene.items() if isinstance(item, Net) and item.parentItem() is None])
+
+
+def countJunctions(scene):
+    return len([item for item in scene.items() if isinstance(item, Junction)])
+
+
+def test_cleanupKeepsNewItems(app, tmp_path):
+    inputFile = example('Full adder', 'Full adder.sch')
+    outputFile = str(tmp_path / 'Full adder.sch')
+    nets = countNets(loadSchematic(inputFile))
+    summary = cleanupFile(inputFile, outputFile)
+    scene = loadSchematic(outputFile)
+    assert countNets(scene) == nets - summary['netsRemoved'] + summary['netsAdded']
+
+
+def test_cleanupKeepsAddedDots(app, tmp_path):
+    inputFile = example('TIA noise', 'tia_noise.sch')
+    outputFile = str(tmp_path / 'tia_noise.sch')
+    dots = countJunctions(loadSchematic(inputFile))
+    summary = cleanupFile(inputFile, outputFile)
+    assert summary['dotsAdded'] > 0
+    scene = loadSchematic(outputFile)
+    assert countJunctions(scene) == dots - summary['dotsRemoved'] + summary['dotsAdded']
+
+
+def test_cleanupOfCleanSchematicChangesNothing(app, tmp_path):
+    cleanFile = str(tmp_path / 'clean.sch')
+    cleanupFile(example('Full adder', 'Full adder.sch'), cleanFile)
+    summary = cleanupFile(cleanFile, str(tmp_path / 'again.sch'))
+    assert summary == {'netsRemoved': 0, 'netsAdded': 0, 'dotsRemoved': 0, 'dotsAdded': 0}
+
+
+def addNet(scene, x1, y1, x2, y2):
+    net = Net(
+        None, QtCore.QPointF(x1, y1), penColour=QtCore.Qt.black, width=2,
+        penStyle=QtCore.Qt.SolidLine, penCapStyle=QtCore.Qt.RoundCap,
+        penJoinStyle=QtCore.Qt.RoundJoin, brushColour=QtCore.Qt.black,
+        brushStyle=QtCore.Qt.NoBrush)
+    net.setLine(QtCore.QLineF(0, 0, x2 - x1, y2 - y1))
+    net.oldLine = net.line()
+    scene.addItem(net)
+    return net
+
+
+def netLines(scene):
+    lines = []
+    for item in scene.items():
+        if isinstance(item, Net):
+            line = sceneLine(item)
+            points = sorted([(line.x1(), line.y1()), (line.x2(), line.y2())])
+            lines.append(tuple(points))
+    return sorted(lines)
+
+
+def placeNet(scene, net):
+    undoStack = QtWidgets.QUndoStack()
+    graph = NetGraph(scene)
+    undoStack.beginMacro('Place net')
+    graph.placeNet(net, undoStack)
+    undoStack.endMacro()
+    return undoStack
+
+
+def test_overlappingNetsAreMerged(app):
+    scene = QtWidgets.QGraphicsScene()
+    addNet(scene, 0, 0, 100, 0)
+    net = addNet(scene, 50, 0, 200, 0)
+    undoStack = placeNet(scene, net)
+    assert netLines(scene) == [((0, 0), (200, 0))]
+    undoStack.undo()
+    assert netLines(scene) == [((0, 0), (100, 0)), ((50, 0), (200, 0))]
+
+
+def test_netEndingOnAnotherSplitsIt(app):
+    scene = QtWidgets.QGraphicsScene()
+    addNet(scene, 0, 0, 200, 0)
+    net = addNet(scene, 100, 0, 100, 100)
+    undoStack = placeNet(scene, net)
+    assert netLines(scene) == [((0, 0), (100, 0)), ((100, 0), (100, 100)), ((100, 0), (200, 0))]
+    assert [dot.scenePos() for dot in scene.items() if isinstance(dot, Junction)] == \
+        [QtCore.QPointF(100, 0)]
+    undoStack.undo()
+    assert netLines(scene) == [((0, 0), (200, 0)), ((100, 0), (100, 100))]
+    assert countJunctions(scene) == 0
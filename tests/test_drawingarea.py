@@ -0,0 +1,106 @@
+import os
+import shutil
+
+import pytest
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from conftest import example
+
+
+@pytest.fixture
+def window(app):
+    from src.mainwindow import myMainWindow
+    window = myMainWindow(clipboard=app.clipboard())
+    yield window
+    window.ui.drawingArea.closeAutobackupFile()
+    window.thumbnailLoader.shutdown()
+
+
+def openCopy(area, folder):
+    fileName = str(folder / 'inverter.sch')
+    shutil.copy(example('Inverter', 'inverter.sch'), fileName)
+    area.loadRoutine('schematic', fileName)
+    for item in area.scene().selectedItems():
+        item.setSelected(False)
+    return fileName
+
+
+def test_saveIsFinishedByTheWriter(window, tmp_path):
+    area = window.ui.drawingArea
+    fileName = openCopy(area, tmp_path)
+    os.remove(fileName)
+    oldAutobackupFile = area.autobackupFile.fileName()
+    area.undoStack.push(QtWidgets.QUndoCommand('Edit'))
+    assert area.saveRoutine('schematic') is True
+    # The save is only queued, so nothing is marked as saved yet
+    assert area.autobackupWriter.busy is True
+    assert not area.undoStack.isClean()
+    assert os.path.exists(oldAutobackupFile)
+    assert area.waitForSaves() is True
+    assert os.path.getsize(fileName) > 0
+    assert area.undoStack.isClean()
+    assert not os.path.exists(oldAutobackupFile)
+    assert os.path.exists(area.autobackupFile.fileName())
+
+
+def test_failedSaveKeepsAutobackupFile(window, tmp_path):
+    area = window.ui.drawingArea
+    openCopy(area, tmp_path)
+    autobackupFile = area.autobackupFile.fileName()
+    area.undoStack.push(QtWidgets.QUndoCommand('Edit'))
+    area.schematicFileName = str(tmp_path / 'missing' / 'inverter.sch')
+    assert area.saveRoutine('schematic') is True
+    assert area.waitForSaves() is False
+    assert area.autobackupFile.fileName() == autobackupFile
+    assert os.path.exists(autobackupFile)
+    assert area.schematicFileName == str(tmp_path / 'missing' / 'inverter.sch')
+    assert not area.undoStack.isClean()
+
+
+def test_editsAtUndoLimitAreTracked(window):
+    from src.commands import Add
+    from src.components import Junction
+    area = window.ui.drawingArea
+    area.undoStack.setUndoLimit(2)
+    area.netGraph.ensureValid()
+    dots = []
+    for x in range(4):
+        dots.append(Junction(None, QtCore.QPointF(100*x, 0)))
+        area.undoStack.push(Add(None, area.scene(), dots[-1]))
+    assert area.undoStack.count() == 2
+    assert area.netGraph.valid is True
+    assert area.autobackupJournal.dirty is False
+    assert set(area.netGraph.dotPoints) == set(dots)
+
+
+
+class AcceptedExportWindow(object):
+    """Stands in for the export dialog and accepts its options"""
+
+    def __init__(self, parent, scene=None, **kwargs):
+        self.__dict__.update(kwargs)
+        self.scaleFactor = 1.
+        self.sourceRect = QtCore.QRectF(0, 0, 100, 50)
+
+    def exec_(self):
+        return 1
+
+
+def test_exportRestoresTheDrawingArea(window, tmp_path, monkeypatch):
+    area = window.ui.drawingArea
+    openCopy(area, tmp_path)
+    item = [item for item in area.scene().items()
+            if item.parentItem() is None and item is not area.mouseRect][0]
+    item.setSelected(True)
+    showPins = area.showPins
+    saveFile = str(tmp_path / 'inverter.png')
+    monkeypatch.setattr('src.drawingarea.ExportWindow', AcceptedExportWindow)
+    monkeypatch.setattr(
+        QtWidgets.QFileDialog, 'getSaveFileName',
+        lambda *args: (saveFile, 'PNG files (*.png)'))
+    area.exportRoutine(None)
+    # The options accepted in the dialog are used
+    assert QtGui.QImage(saveFile).size() == QtCore.QSize(100, 50)
+    assert item.isSelected()
+    assert area.mouseRect in area.scene().items()
+    assert area.showPins is showPins
@@ -0,0 +1,56 @@
+import json
+import struct
+
+import pytest
+
+from conftest import example
+from src.fileformat import (
+    FileFormatError, VERSION, encodeMetadata, headerFormat, loadSchematicFile, packSections,
+    readMetadata, unpackSections)
+from src.headless import convertFile
+
+examples = [
+    ('Full adder', 'Full adder.sch'),
+    ('TIA noise', 'tia_noise.sch'),
+    ('Inverter', 'inverter.sch'),
+    ('Stacked ring oscillators', 'stacked ring oscillators.sch')]
+
+
+@pytest.mark.parametrize('path', examples)
+def test_convertedFileMatchesOldFile(app, tmp_path, path):
+    oldRoot = loadSchematicFile(example(*path))
+    expected = json.loads(encodeMetadata(oldRoot).decode('utf-8'))
+    outputFile = str(tmp_path / path[1])
+    convertFile(example(*path), outputFile)
+    assert readMetadata(outputFile) == expected
+    newRoot = loadSchematicFile(outputFile)
+    assert json.loads(encodeMetadata(newRoot).decode('utf-8')) == expected
+
+
+@pytest.mark.parametrize('path', examples)
+def test_saveOfLoadedFileIsStable(app, tmp_path, path):
+    first, second = str(tmp_path / 'first.sch'), str(tmp_path / 'second.sch')
+    convertFile(example(*path), first)
+    convertFile(first, second)
+    with open(first, 'rb') as file1, open(second, 'rb') as file2:
+        assert file1.read() == file2.read()
+
+
+def test_fileHoldsCurrentVersion(app, tmp_path):
+    outputFile = str(tmp_path / 'inverter.sch')
+    convertFile(example('Inverter', 'inverter.sch'), outputFile)
+    with open(outputFile, 'rb') as file:
+        magic, version, count = struct.unpack_from(headerFormat, file.read())
+    assert version == VERSION == 1
+
+
+def test_newerVersionIsRejected():
+    data = bytearray(packSections([(b'META', b'{}')]))
+    struct.pack_into('<H', data, 8, VERSION + 1)
+    with pytest.raises(FileFormatError):
+        unpackSections(bytes(data))
+
+
+def test_unknownSectionsAreIgnored():
+    data = packSections([(b'META', b'{}'), (b'XTRA', b'data')])
+    assert unpackSections(data)[b'META'] == b'{}'
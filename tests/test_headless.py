@@ -0,0 +1,61 @@
+import os
+
+import pytest
+from PyQt5 import QtCore, QtGui
+
+from conftest import example
+from src.headless import batchExport, collectInputFiles, main, parseTarget
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    return path
+
+
+def test_globMirrorsFoldersAfterWildcard(tmp_path):
+    first = touch(str(tmp_path / 'a' / 'figure.sch'))
+    second = touch(str(tmp_path / 'b' / 'figure.sch'))
+    inputFiles = collectInputFiles([str(tmp_path / '*' / '*.sch')])
+    assert inputFiles == [
+        (first, os.path.join('a', 'figure.sch')),
+        (second, os.path.join('b', 'figure.sch'))]
+
+
+def test_sameNameFromTwoPatternsIsRejected(tmp_path):
+    first = touch(str(tmp_path / 'a' / 'figure.sch'))
+    second = touch(str(tmp_path / 'b' / 'figure.sch'))
+    patterns = [str(tmp_path / 'a' / '*.sch'), str(tmp_path / 'b' / '*.sch')]
+    # Next to their inputs the two outputs do not collide
+    inputFiles = collectInputFiles(patterns)
+    assert inputFiles == [(first, 'figure.sch'), (second, 'figure.sch')]
+    with pytest.raises(ValueError):
+        collectInputFiles(patterns, str(tmp_path / 'out'))
+    with pytest.raises(ValueError):
+        batchExport(inputFiles, str(tmp_path / 'out'), ['pdf'], processes=1)
+
+
+def test_sameOutputFromSchematicAndSymbolIsRejected(tmp_path):
+    inputFiles = [
+        (touch(str(tmp_path / 'figure.sch')), 'figure.sch'),
+        (touch(str(tmp_path / 'figure.sym')), 'figure.sym')]
+    with pytest.raises(ValueError):
+        batchExport(inputFiles, str(tmp_path / 'out'), ['pdf'], processes=1)
+
+
+def test_targetsHaveTheirOwnScaleAndArea(app, tmp_path):
+    whole = str(tmp_path / 'whole.png')
+    detail = str(tmp_path / 'detail.png')
+    assert main([
+        'export', example('Inverter', 'inverter.sch'),
+        '-t', whole + ':1',
+        '-t', detail + ':2:0,0,100,50']) == 0
+    assert not os.path.exists(str(tmp_path / 'inverter.pdf'))
+    assert QtGui.QImage(detail).size() == QtCore.QSize(200, 100)
+    assert not QtGui.QImage(whole).isNull()
+
+
+def test_targetWithoutScaleKeepsColonsInFileName():
+    assert parseTarget('C:\\figures\\fig.svg') == ('svg', 'C:\\figures\\fig.svg', None, None)
+    exportFormat, saveFile, scaleFactor, sourceRect = parseTarget('fig.png::1,2,3,4')
+    assert (saveFile, scaleFactor, sourceRect) == ('fig.png', None, QtCore.QRectF(1, 2, 3, 4))
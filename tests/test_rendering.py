@@ -0,0 +1,25 @@
+from PyQt5 import QtCore, QtGui
+
+from conftest import example
+from src.headless import loadSchematic, saveScene
+
+
+def renderImage(scene, rect, dpi):
+    image = QtGui.QImage(400, 300, QtGui.QImage.Format_ARGB32)
+    image.fill(QtGui.QColor('white'))
+    image.setDotsPerMeterX(int(dpi / 0.0254))
+    image.setDotsPerMeterY(int(dpi / 0.0254))
+    painter = QtGui.QPainter(image)
+    scene.render(painter, QtCore.QRectF(image.rect()), rect)
+    painter.end()
+    return image
+
+
+def test_sharedSymbolsIgnoreDeviceResolution(app, tmp_path):
+    converted = str(tmp_path / 'converted.sch')
+    saveScene(loadSchematic(example('TIA noise', 'tia_noise.sch')), converted)
+    scene = loadSchematic(converted)
+    rect = scene.itemsBoundingRect()
+    # A 1200 dpi device, such as the printer used for PDF export, has to
+    # look the same as the screen
+    assert renderImage(scene, rect, 1200) == renderImage(scene, rect, 96)
@@ -0,0 +1,50 @@
+import shutil
+
+from PyQt5 import QtCore
+
+from conftest import example
+from src.commands import Group
+from src.components import TextBox
+from src.headless import loadSchematic, saveScene
+from src.symbollibrary import SymbolLibrary
+
+
+def waitForMeasurements(library):
+    timer = QtCore.QElapsedTimer()
+    timer.start()
+    while len(library.measureQueue) > 0 and timer.elapsed() < 10000:
+        QtCore.QCoreApplication.processEvents()
+
+
+def test_textOfSharedSymbolsIsIndexed(app, tmp_path):
+    scene = loadSchematic(example('TIA noise', 'tia_noise.sch'))
+    textBoxes = [item for item in scene.items() if isinstance(item, TextBox)]
+    # Groups are stored as shared definitions, with their text inside
+    Group(None, scene, textBoxes).redo()
+    for item in scene.selectedItems():
+        item.setSelected(False)
+    saveScene(scene, str(tmp_path / 'tia.sym'))
+    library = SymbolLibrary(str(tmp_path / 'index'))
+    library.setFolders([str(tmp_path)])
+    library.waitForDone()
+    path = str(tmp_path / 'tia.sym')
+    assert path in library.entries
+    assert library.search('vout') == [path]
+
+
+def test_oldSymbolsAreMeasuredOnGuiThread(app, tmp_path):
+    shutil.copy('Resources/Symbols/Standard/Resistor.sym', str(tmp_path))
+    library = SymbolLibrary(str(tmp_path / 'index'))
+    changed = []
+    library.changed.connect(lambda: changed.append(True))
+    library.setFolders([str(tmp_path)])
+    assert library.entries == {}
+    library.waitForDone()
+    assert changed == [True]
+    entry = library.entries[str(tmp_path / 'Resistor.sym')]
+    assert entry['bbox'] is None
+    waitForMeasurements(library)
+    assert entry['pins'] == 2
+    assert entry['bbox'] is not None
+    # The measurements are kept in the saved index
+    assert SymbolLibrary(str(tmp_path / 'index')).entries[str(tmp_path / 'Resistor.sym')]['pins'] == 2
@@ -0,0 +1,118 @@
+import os
+import threading
+
+from PyQt5 import QtCore, QtGui
+
+from conftest import example
+from src.components import myGraphicsItemGroup
+from src.drawingitems import myIconProvider
+from src.fileformat import Snapshot
+from src.headless import loadSchematic
+from src.thumbnails import IconRenderer, ThumbnailCache, ThumbnailLoader
+
+
+class RecordingIconProvider(myIconProvider):
+    """Records the threads that previews are rendered on"""
+
+    def __init__(self):
+        super().__init__()
+        self.iconSize = 64
+        self.renderThreads = []
+
+    def createIconImage(self, loadItem, scene=None):
+        self.renderThreads.append(QtCore.QThread.currentThread())
+        return super().createIconImage(loadItem, scene)
+
+
+def writeWithoutPreview(fileName):
+    scene = loadSchematic(example('Inverter', 'inverter.sch'))
+    items = [item for item in scene.items() if item.parentItem() is None]
+    origin = QtCore.QPointF(0, 0)
+    saveObject = myGraphicsItemGroup(None, origin, [])
+    saveObject.origin = origin
+    with open(fileName, 'wb') as file:
+        file.write(Snapshot(saveObject, items).encode())
+    return fileName
+
+
+def waitForIcons(loader, filePaths):
+    ready = []
+    loader.iconReady.connect(ready.append)
+    timer = QtCore.QElapsedTimer()
+    timer.start()
+    while set(ready) != set(filePaths) and timer.elapsed() < 10000:
+        QtCore.QCoreApplication.processEvents(QtCore.QEventLoop.AllEvents, 50)
+    return ready
+
+
+def test_filesWithoutPreviewAreRenderedOnGuiThread(app, tmp_path):
+    iconProvider = RecordingIconProvider()
+    cache = ThumbnailCache(str(tmp_path), maxPixmaps=10)
+    loader = ThumbnailLoader(iconProvider, cache)
+    filePath = writeWithoutPreview(str(tmp_path / 'inverter.sch'))
+    assert iconProvider.storedIconImage(filePath) is None
+    loader.icon(filePath)
+    assert waitForIcons(loader, [filePath]) == [filePath]
+    loader.shutdown()
+    assert iconProvider.renderThreads == [app.thread()]
+    key = cache.knownKey(filePath, iconProvider.iconSize)
+    assert cache.findPixmap(key) is not None
+    # The rendered thumbnail is stored on disk for the next session
+    assert not ThumbnailCache(str(tmp_path)).findImage(key).isNull()
+
+
+def test_iconThreadGetsPreviewRenderedOnGuiThread(app, tmp_path):
+    iconProvider = RecordingIconProvider()
+    renderer = IconRenderer(iconProvider)
+    filePath = writeWithoutPreview(str(tmp_path / 'inverter.sch'))
+    images = []
+    thread = threading.Thread(target=lambda: images.append(renderer.render(filePath)))
+    thread.start()
+    while thread.is_alive():
+        QtCore.QCoreApplication.processEvents(QtCore.QEventLoop.AllEvents, 50)
+    thread.join()
+    assert iconProvider.renderThreads == [app.thread()]
+    assert images[0] is not None and not images[0].isNull()
+
+
+def test_stoppedRendererDoesNotWait(app, tmp_path):
+    iconProvider = RecordingIconProvider()
+    renderer = IconRenderer(iconProvider)
+    filePath = writeWithoutPreview(str(tmp_path / 'inverter.sch'))
+    images = []
+    thread = threading.Thread(target=lambda: images.append(renderer.render(filePath)))
+    thread.start()
+    # Without processing events the request is never rendered
+    renderer.stop()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert images == [None]
+    QtCore.QCoreApplication.processEvents()
+    assert iconProvider.renderThreads == []
+
+
+def test_cancelledThumbnailIsNotDelivered(app, tmp_path):
+    loader = ThumbnailLoader(RecordingIconProvider(), ThumbnailCache(str(tmp_path)))
+    filePath = example('Inverter', 'inverter.sch')
+    loader.icon(filePath)
+    loader.cancel(filePath)
+    loader.shutdown()
+    ready = []
+    loader.iconReady.connect(ready.append)
+    QtCore.QCoreApplication.processEvents()
+    assert ready == []
+
+
+def test_pixmapsAreCappedInMemory(app, tmp_path):
+    cache = ThumbnailCache(str(tmp_path), maxPixmaps=2)
+    for key in ['a', 'b', 'c']:
+        cache.remember(key, QtGui.QPixmap(1, 1))
+    assert cache.findPixmap('a') is None
+    assert list(cache.pixmaps) == ['b', 'c']
+
+
+def test_defaultDirectoryIsInCacheLocation(app):
+    cacheLocation = QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.CacheLocation)
+    directory = ThumbnailCache().directory
+    assert os.path.isabs(directory)
+    assert os.path.dirname(directory) == cacheLocation
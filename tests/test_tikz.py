@@ -0,0 +1,53 @@
+import io
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from src.components import Net
+from src.drawingitems import richTextToLatex
+from src.tikz import TikzWriter
+
+
+def addNet(scene, x1, y1, x2, y2, penColour=QtCore.Qt.black):
+    net = Net(
+        None, QtCore.QPointF(x1, y1), penColour=penColour, width=2,
+        penStyle=QtCore.Qt.SolidLine, penCapStyle=QtCore.Qt.RoundCap,
+        penJoinStyle=QtCore.Qt.RoundJoin, brushColour=QtCore.Qt.black,
+        brushStyle=QtCore.Qt.NoBrush)
+    net.setLine(QtCore.QLineF(0, 0, x2 - x1, y2 - y1))
+    scene.addItem(net)
+    return net
+
+
+def writeTikz(scene):
+    stream = io.StringIO()
+    TikzWriter(stream).write(scene.items())
+    return stream.getvalue()
+
+
+def test_overlappingOpaqueNetsAreMerged(app):
+    scene = QtWidgets.QGraphicsScene()
+    addNet(scene, 0, 0, 100, 0)
+    addNet(scene, 50, 0, 200, 0)
+    latex = writeTikz(scene)
+    assert '% Drawing 2 nets' in latex
+    assert '(0.0,-0.0) -- (2.0,-0.0)' in latex
+
+
+def test_translucentNetsAreDrawnOneByOne(app):
+    scene = QtWidgets.QGraphicsScene()
+    colour = QtGui.QColor(0, 0, 0, 128)
+    addNet(scene, 0, 0, 100, 0, colour)
+    addNet(scene, 50, 0, 200, 0, colour)
+    latex = writeTikz(scene)
+    assert 'nets\n' not in latex
+    assert '(2.0,-0.0)' in latex and '(1.0,-0.0)' in latex
+
+
+def test_lineSeparatorBreaksLikeParagraph(app):
+    lines = QtGui.QTextDocument()
+    lines.setHtml('<b>a<br />b</b>')
+    assert '\u2028' in lines.toRawText()
+    paragraphs = QtGui.QTextDocument()
+    paragraphs.setHtml('<p><b>a</b></p><p><b>b</b></p>')
+    assert richTextToLatex(lines) == richTextToLatex(paragraphs) == \
+        '\\textbf{a}\\textbf{\n}\\textbf{b}'
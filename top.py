@@ -31,6 +31,11 @@ def logException(excType, value, traceback):
 
 
 if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "export":
+        # Headless export does not need the main window
+        from src.headless import main
+
+        sys.exit(main(sys.argv[1:]))
     logger.info("YCircuit started on " + sys.platform)
     logger.info("Setting directory to " + dname)
     if platform.system() == "Windows":